@@ -26,6 +26,10 @@ def create_app(config_class=Config):
     cors.init_app(app)
     ma.init_app(app)
 
+    # Listeners de la sesión que mantienen productos.stock_total, ranking_ventas, catalog_version
+    # y productos.modificado_at
+    from app.services import stock_totals, sales_rank, catalog_version, catalog_snapshot  # noqa: F401
+
     # 3. REGISTRAR BLUEPRINTS
     # Auth
     from app.auth import bp as auth_bp
@@ -58,6 +62,10 @@ def create_app(config_class=Config):
     from app.clients.routes import bp as clients_bp
     app.register_blueprint(clients_bp, url_prefix='/api/clients')
 
+    # Comandos de consola (workers en segundo plano)
+    from app.commands import register_commands
+    register_commands(app)
+
     # 4. Ruta de Salud
     @app.route('/api/health', methods=['GET'])
     def health_check():
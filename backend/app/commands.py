@@ -0,0 +1,144 @@
+# backend/app/commands.py
+"""Comandos de consola (`flask <comando>`) para procesos que corren fuera de los requests."""
+import time
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+
+from app.extensions import db
+
+
+def register_commands(app):
+
+    @app.cli.command('sync-worker')
+    @click.option('--batch-size', default=50, show_default=True, help='Tareas por lote.')
+    @click.option('--interval', default=2.0, show_default=True, help='Segundos de espera cuando la cola está vacía.')
+    @click.option('--once', is_flag=True, help='Procesa un solo lote y termina (útil para cron).')
+    def sync_worker(batch_size, interval, once):
+        """Drena la cola sync_queue empujando stock a Tienda Nube."""
+        from app.services.stock_sync_queue import process_sync_queue, purge_completed
+
+        print(f"🚚 Worker de sincronización iniciado (lote={batch_size}, espera={interval}s)")
+        ultima_purga = 0
+
+        while True:
+            try:
+                procesadas, exitosas = process_sync_queue(batch_size)
+                if procesadas:
+                    print(f"📦 Lote procesado: {exitosas}/{procesadas} variantes OK")
+
+                if time.time() - ultima_purga > 3600:
+                    purge_completed()
+                    ultima_purga = time.time()
+            except Exception as e:
+                db.session.rollback()
+                procesadas = 0
+                print(f"🔥 Error en worker de sincronización: {e}")
+            finally:
+                # Soltamos la sesión entre lotes para que el identity map no crezca sin límite
+                db.session.remove()
+
+            if once:
+                break
+            if not procesadas:
+                time.sleep(interval)
+
+    @app.cli.command('tn-mirror-refresh')
+    @click.option('--full', is_flag=True, help='Trae todo el catálogo y borra lo que ya no existe en TN.')
+    def tn_mirror_refresh(full):
+        """Refresca el espejo local del catálogo de Tienda Nube (tn_catalog_mirror)."""
+        from app.services.catalog_mirror import refresh_catalog_mirror
+
+        resumen = refresh_catalog_mirror(full=full)
+        print(f"✅ Espejo actualizado: {resumen}")
+
+    @app.cli.command('webhook-worker')
+    @click.option('--workers', default=4, show_default=True, help='Órdenes procesadas en paralelo.')
+    @click.option('--batch-size', default=20, show_default=True, help='Notificaciones por lote.')
+    @click.option('--interval', default=1.0, show_default=True, help='Segundos de espera cuando la bandeja está vacía.')
+    @click.option('--once', is_flag=True, help='Procesa un solo lote y termina (útil para cron).')
+    def webhook_worker(workers, batch_size, interval, once):
+        """Procesa la bandeja tn_webhook_inbox: descarga las órdenes de TN y registra las ventas."""
+        from app.services.webhook_inbox import process_inbox, purge_done
+
+        print(f"📬 Worker de webhooks iniciado (hilos={workers}, lote={batch_size}, espera={interval}s)")
+        ultima_purga = 0
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while True:
+                try:
+                    procesadas, exitosas = process_inbox(app, batch_size, executor=pool)
+                    if procesadas:
+                        print(f"🧾 Lote de webhooks: {exitosas}/{procesadas} órdenes OK")
+
+                    if time.time() - ultima_purga > 3600:
+                        purge_done()
+                        ultima_purga = time.time()
+                except Exception as e:
+                    db.session.rollback()
+                    procesadas = 0
+                    print(f"🔥 Error en worker de webhooks: {e}")
+                finally:
+                    db.session.remove()
+
+                if once:
+                    break
+                if not procesadas:
+                    time.sleep(interval)
+
+    @app.cli.command('tn-orders-backfill')
+    @click.option('--hours', default=24.0, show_default=True, help='Órdenes creadas en las últimas N horas.')
+    @click.option('--since', default=None, help='Desde esta fecha UTC (ISO, ej: 2026-10-16T00:00:00). Tiene prioridad sobre --hours.')
+    def tn_orders_backfill(hours, since):
+        """Importa las órdenes de Tienda Nube que no llegaron por webhook."""
+        from app.services.order_backfill import backfill_orders
+
+        desde = datetime.fromisoformat(since) if since else datetime.utcnow() - timedelta(hours=hours)
+        print(f"🔎 Buscando órdenes de Tienda Nube creadas desde {desde.isoformat()} (UTC)...")
+        resumen = backfill_orders(desde)
+        print(f"✅ Backfill terminado: {resumen}")
+
+    @app.cli.command('stock-total-check')
+    @click.option('--fix', is_flag=True, help='Corrige los productos cuyo total no coincide.')
+    def stock_total_check(fix):
+        """Compara productos.stock_total con la suma real del inventario."""
+        from app.services.stock_totals import check_stock_totals
+
+        diferencias = check_stock_totals(fix=fix)
+        for d in diferencias[:50]:
+            print(f"   ⚠️ #{d['id']} {d['nombre']}: guardado {d['stock_total']} / real {d['stock_real']}")
+        if len(diferencias) > 50:
+            print(f"   ... y {len(diferencias) - 50} más")
+
+        if not diferencias:
+            print("✅ stock_total coincide con el inventario en todos los productos")
+        elif fix:
+            print(f"🔧 {len(diferencias)} productos corregidos")
+        else:
+            print(f"❌ {len(diferencias)} productos con diferencias (correr con --fix para corregir)")
+
+    @app.cli.command('sales-rank-rebuild')
+    @click.option('--loop', is_flag=True, help='Queda corriendo y reconstruye cada RANK_REBUILD_INTERVAL (Procfile: rank).')
+    def sales_rank_rebuild(loop):
+        """
+        Recalcula ranking_ventas (unidades vendidas total / 30 / 90 días) desde el historial.
+        Las ventas viejas salen de las ventanas de 30/90 días solo al reconstruir: correr
+        con --loop o desde cron. Va aparte del sync-worker para no frenar los envíos a TN.
+        """
+        from app.services.sales_rank import rebuild_sales_rank, RANK_REBUILD_INTERVAL
+
+        while True:
+            try:
+                print(f"✅ Ranking de ventas reconstruido: {rebuild_sales_rank()} productos")
+            except Exception as e:
+                db.session.rollback()
+                if not loop:
+                    raise
+                print(f"🔥 Error reconstruyendo el ranking de ventas: {e}")
+            finally:
+                db.session.remove()
+
+            if not loop:
+                break
+            time.sleep(RANK_REBUILD_INTERVAL.total_seconds())
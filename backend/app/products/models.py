@@ -41,6 +41,12 @@ class Producto(db.Model):
     activo = db.Column(db.Boolean, default=True, server_default='1') 
     # ---------------------
 
+    # Suma de stock_actual de sus variantes, mantenida por services/stock_totals.py
+    stock_total = db.Column(db.Integer, nullable=False, default=0, server_default='0', index=True)
+
+    # Último cambio del producto, sus variantes o su stock (deltas de /snapshot, ver services/catalog_snapshot.py)
+    modificado_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+
 class ProductoVariante(db.Model):
     __tablename__ = 'producto_variantes'
     id_variante = db.Column(db.Integer, primary_key=True)
@@ -50,7 +56,12 @@ class ProductoVariante(db.Model):
     codigo_sku = db.Column(db.String(50), unique=True)
     
     inventario = db.relationship('Inventario', backref='variante', uselist=False, lazy=True)
-    tiendanube_variant_id = db.Column(db.String(50), nullable=True)
+    tiendanube_variant_id = db.Column(db.String(50), nullable=True, index=True)
+
+    # Último stock / precio web que Tienda Nube confirmó (ver services/sync_state.py)
+    tn_stock_sincronizado = db.Column(db.Integer, nullable=True)
+    tn_precio_sincronizado = db.Column(db.Numeric(10, 2), nullable=True)
+    tn_sincronizado_at = db.Column(db.DateTime, nullable=True)
     
 
 class Inventario(db.Model):
@@ -64,18 +75,99 @@ class Inventario(db.Model):
 
 class SyncQueue(db.Model):
     __tablename__ = 'sync_queue'
+    __table_args__ = (
+        # El worker siempre busca "pendientes cuyo próximo intento ya venció"
+        db.Index('ix_sync_queue_status_next_attempt', 'status', 'next_attempt_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     tn_product_id = db.Column(db.String(100), nullable=False)
-    tn_variant_id = db.Column(db.String(100), nullable=False)
-    new_stock = db.Column(db.Integer, nullable=False)
+    tn_variant_id = db.Column(db.String(100), nullable=False, index=True)
+    # Variante local: el worker lee el stock VIGENTE al momento de enviar (no el de new_stock)
+    id_variante = db.Column(db.Integer, nullable=True)
+    new_stock = db.Column(db.Integer, nullable=False) # Stock al momento de encolar (solo referencia / fallback)
     
     # Control de estado y reintentos
-    status = db.Column(db.String(20), default='pending') # Estados: pending, completed, failed
+    status = db.Column(db.String(20), default='pending') # Estados: pending, processing, completed, failed
     retries = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow) # Backoff: no se reintenta antes de esta hora
+    last_error = db.Column(db.String(255), nullable=True)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def __repr__(self):
-        return f"<SyncQueue Var:{self.tn_variant_id} Stock:{self.new_stock}>"
\ No newline at end of file
+        return f"<SyncQueue Var:{self.tn_variant_id} Stock:{self.new_stock}>"
+
+class TnCatalogMirror(db.Model):
+    """Copia local del catálogo de Tienda Nube (una fila por variante), ver services/catalog_mirror.py"""
+    __tablename__ = 'tn_catalog_mirror'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tn_product_id = db.Column(db.String(50), nullable=False, index=True)
+    tn_variant_id = db.Column(db.String(50), nullable=False, unique=True)
+    sku = db.Column(db.String(100), nullable=True)
+    product_name = db.Column(db.String(255), nullable=True)
+    stock = db.Column(db.Integer, nullable=True) # None = TN no controla stock (infinito)
+    price = db.Column(db.Numeric(10, 2), nullable=True)
+    permalink = db.Column(db.String(500), nullable=True)
+
+    tn_updated_at = db.Column(db.DateTime, nullable=True) # updated_at del producto en TN (UTC)
+    synced_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<TnCatalogMirror Var:{self.tn_variant_id} Stock:{self.stock}>"
+
+
+class TnMirrorStatus(db.Model):
+    """Estado del espejo del catálogo de TN (una sola fila, id=1), compartido entre workers y hosts."""
+    __tablename__ = 'tn_mirror_status'
+
+    id = db.Column(db.Integer, primary_key=True)
+    last_refresh = db.Column(db.DateTime, nullable=True) # Inicio del último refresco (UTC)
+    last_full_refresh = db.Column(db.DateTime, nullable=True)
+    refreshing_since = db.Column(db.DateTime, nullable=True) # Refresco en segundo plano en curso (lo toma un solo worker)
+
+
+class SyncProgress(db.Model):
+    """Progreso de los procesos largos contra TN (sync completa, margen), compartido entre workers."""
+    __tablename__ = 'sync_progress'
+
+    job = db.Column(db.String(50), primary_key=True) # 'full_sync', 'margen'
+    run_id = db.Column(db.String(32), nullable=True) # Corrida dueña del registro (las viejas no pisan)
+    is_running = db.Column(db.Boolean, default=False, nullable=False)
+    cancel_requested = db.Column(db.Boolean, default=False, nullable=False)
+    current = db.Column(db.Integer, default=0)
+    total = db.Column(db.Integer, default=0)
+    errores = db.Column(db.Integer, default=0)
+    message = db.Column(db.String(255), default='')
+
+    started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class RankingVenta(db.Model):
+    """
+    Unidades vendidas por producto (total y últimos 30/90 días) para ordenar
+    el listado por "más vendidos" sin sumar detalles_ventas en cada request.
+    Lo mantiene services/sales_rank.py.
+    """
+    __tablename__ = 'ranking_ventas'
+
+    id_producto = db.Column(db.Integer, primary_key=True) # Sin FK: es un cache, no debe trabar el borrado de productos
+    unidades_total = db.Column(db.Integer, nullable=False, default=0, index=True)
+    unidades_30d = db.Column(db.Integer, nullable=False, default=0, index=True)
+    unidades_90d = db.Column(db.Integer, nullable=False, default=0, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class CatalogVersion(db.Model):
+    """
+    Contadores que suben con cada cambio confirmado del catálogo o del stock.
+    Son el ETag de los listados: si no cambió, el navegador recibe un 304.
+    Lo mantiene services/catalog_version.py.
+    """
+    __tablename__ = 'catalog_version'
+
+    scope = db.Column(db.String(20), primary_key=True) # 'catalogo', 'stock'
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,4 +1,5 @@
 from sqlalchemy.exc import IntegrityError
+import gzip
 import io
 import os
 import qrcode
@@ -6,22 +7,24 @@ import threading
 import time
 import requests
 import json
-import time
-import tempfile
+import orjson
+import base64
+from decimal import Decimal
+from itertools import groupby
 from PIL import Image
 from reportlab.lib.utils import ImageReader
 from werkzeug.utils import secure_filename
-from flask import jsonify, request, send_file, current_app
+from flask import jsonify, request, send_file, current_app, Response, stream_with_context
 from app.products import bp
 # IMPORTAMOS DESDE EL ARCHIVO DE PRODUCTOS
-from app.products.models import Producto, ProductoVariante, Categoria, CategoriaEspecifica, Inventario
-from app.sales.models import DetalleVenta
+from app.products.models import Producto, ProductoVariante, Categoria, CategoriaEspecifica, Inventario, TnCatalogMirror, RankingVenta
 from app.extensions import db
-from flask_jwt_extended import jwt_required
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from itsdangerous import URLSafeTimedSerializer, BadSignature
 import barcode
 from barcode.writer import ImageWriter
-from sqlalchemy import or_, func, and_
-from sqlalchemy.orm import selectinload
+from sqlalchemy import or_, func, and_, false
+from sqlalchemy.orm import selectinload, contains_eager
 from reportlab.graphics.barcode import code128
 from reportlab.graphics import renderPDF
 from reportlab.pdfgen import canvas
@@ -30,10 +33,34 @@ from reportlab.lib.pagesizes import A4
 from reportlab.platypus import Paragraph
 from reportlab.lib.styles import ParagraphStyle
 from app.services.tiendanube_service import tn_service # <--- SERVICIO IMPORTADO
+from app.services.stock_sync_queue import queue_status
+from app.services.inventory import fijar_stock
+from app.services.sync_state import variantes_pendientes, marcar_sincronizada
+from app.services.product_search import buscar_productos, filtro_sql
+from app.services.product_suggest import sugerir_productos, DEFAULT_LIMIT as DEFAULT_SUGGEST_LIMIT
+from app.services.catalog_version import versioned
+from app.services.catalog_snapshot import build_snapshot, SnapshotInvalido
+from app.services.progress import ProgressReporter, get_progress, request_cancel, JOBS as PROGRESS_JOBS
+from app.services.catalog_mirror import (
+    refresh_catalog_mirror, refresh_if_stale, registrar_stock, get_permalink, mirror_status
+)
 from threading import Thread
 
 
-SYNC_PROGRESS_FILE = os.path.join(tempfile.gettempdir(), 'tn_sync_progress.json')
+# Stream de progreso (SSE): reconexión del navegador y duración máxima de una conexión.
+# Cada stream ocupa uno de los 8 hilos del worker (Procfile: gthread --threads 8) mientras
+# está abierto: se corta a los SSE_MAX_SECONDS y, si el proceso sigue corriendo, el
+# navegador vuelve enseguida. Como mucho SSE_MAX_STREAMS por worker esperan cambios; los
+# demás reciben el estado actual y reconectan, así siempre quedan hilos para la API.
+SSE_RETRY_MS = 5000
+SSE_RETRY_RUNNING_MS = 500
+SSE_MAX_SECONDS = 10
+SSE_MAX_STREAMS = 3
+_sse_streams = threading.BoundedSemaphore(SSE_MAX_STREAMS)
+
+# EventSource no manda headers: el stream se abre con un token propio, firmado, que solo
+# sirve para ese proceso y vence a los SSE_TOKEN_MAX_AGE (el JWT nunca viaja en la URL)
+SSE_TOKEN_MAX_AGE = 60
 
 
 def serialize_producto(prod):
@@ -67,10 +94,6 @@ def serialize_producto(prod):
         "activo": prod.activo
     }
 
-# Señal de cancelación para el hilo de actualización de "Margen Nube".
-# Se usa un Event a nivel de módulo porque el hilo en background no guarda
-# ninguna referencia (ni task id) que se pueda usar para abortarlo de otra forma.
-_margen_cancel_event = threading.Event()
 
 # ==========================================
 # 1. CRUD DE CATEGORÍAS
@@ -78,6 +101,7 @@ _margen_cancel_event = threading.Event()
 
 @bp.route('/categories', methods=['GET'])
 @jwt_required()
+@versioned('catalogo')
 def get_categories():
     cats = Categoria.query.all()
     return jsonify([{"id": c.id_categoria, "nombre": c.nombre} for c in cats]), 200
@@ -120,6 +144,7 @@ def delete_category(id):
 
 @bp.route('/specific-categories', methods=['GET'])
 @jwt_required()
+@versioned('catalogo')
 def get_specific_categories():
     specs = CategoriaEspecifica.query.all()
     return jsonify([{"id": c.id_categoria_especifica, "nombre": c.nombre} for c in specs]), 200
@@ -161,6 +186,7 @@ def delete_specific_category(id):
 # ==========================================
 @bp.route('', methods=['GET'])
 @jwt_required()
+@versioned('catalogo', 'stock')
 def get_products():
     # 1. Parámetros
     page = request.args.get('page', 1, type=int)
@@ -181,13 +207,14 @@ def get_products():
     no_image = request.args.get('no_image') == 'true'
     sort_by = request.args.get('sort_by', 'recientes') # <--- PARÁMETRO DE ORDEN
 
+    # Proyección: ?fields=id,nombre,precio,stock_total (o ?fields=lite). Sin el parámetro, el producto completo.
+    try:
+        campos = _parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 400
+
     # 2. Query Base
-    # selectinload evita el N+1: sin esto, cada producto listado dispara una
-    # query aparte para sus variantes y otra por cada variante para su
-    # inventario (cientos de queries por página de 50 productos).
-    query = Producto.query.outerjoin(Categoria).outerjoin(CategoriaEspecifica).options(
-        selectinload(Producto.variantes).selectinload(ProductoVariante.inventario)
-    )
+    query = Producto.query.outerjoin(Categoria).outerjoin(CategoriaEspecifica)
 
     # 3. Aplicar Filtros
     if active_param == 'true':
@@ -209,26 +236,22 @@ def get_products():
         query = query.filter(or_(Producto.imagen.is_(None), Producto.imagen == ''))
 
     # --- BÚSQUEDA TEXTO ---
-    if search:
+    # Índice en memoria (trigramas, sin acentos); si matchea demasiados productos, en SQL (también sin acentos)
+    ids_busqueda = buscar_productos(search) if search.strip() else None
+    agrupado = False
+    if ids_busqueda is not None:
+        query = query.filter(Producto.id_producto.in_(ids_busqueda)) if ids_busqueda else query.filter(false())
+    elif search.strip():
         query = query.join(ProductoVariante)
-        terms = search.strip().split()
-        for term in terms:
-            term_filter = f"%{term}%"
-            query = query.filter(or_(
-                Producto.nombre.ilike(term_filter),
-                Categoria.nombre.ilike(term_filter),
-                ProductoVariante.codigo_sku.ilike(term_filter)
-            ))
+        query = query.filter(*filtro_sql(search, Producto.nombre, Categoria.nombre, ProductoVariante.codigo_sku))
         query = query.group_by(Producto.id_producto)
+        agrupado = True
 
     # --- FILTROS DE STOCK Y TALLE ---
     
     # Caso 1: Filtro "Stock Mínimo General" (Ocultar stock 0)
     if min_stock is not None and min_stock > 0:
-        products_with_stock = db.session.query(ProductoVariante.id_producto) \
-            .join(Inventario).group_by(ProductoVariante.id_producto) \
-            .having(func.sum(Inventario.stock_actual) >= min_stock).subquery()
-        query = query.filter(Producto.id_producto.in_(products_with_stock))
+        query = query.filter(Producto.stock_total >= min_stock)
 
     # Caso 2: Filtro "Stock Exacto" y/o "Talle Específico"
     if exact_stock is not None or size_filter:
@@ -245,44 +268,79 @@ def get_products():
 # ==========================================
     # --- 4. LÓGICA DE ORDENAMIENTO (SORTING) ---
     # ==========================================
-    if sort_by == 'mas_vendidos':
-        # Creamos una subconsulta para saber cuánto se vendió de cada producto
-        sales_subq = db.session.query(
-            ProductoVariante.id_producto,
-            func.sum(DetalleVenta.cantidad).label('total_vendido')
-        ).join(DetalleVenta, DetalleVenta.id_variante == ProductoVariante.id_variante) \
-         .group_by(ProductoVariante.id_producto).subquery()
-        
-        # Unimos la subconsulta a la consulta principal y ordenamos (quitamos nulls_last)
-        query = query.outerjoin(sales_subq, Producto.id_producto == sales_subq.c.id_producto)
-        query = query.order_by(sales_subq.c.total_vendido.desc(), Producto.id_producto.desc())
+    # Cada orden es (clave, desempate por id). Las sumas van con COALESCE para
+    # que el cursor pueda compararlas (un producto sin ventas/stock cuenta como 0).
+    sort_key, sort_desc, id_desc = None, False, True
+
+    if sort_by in ['mas_vendidos', 'mas_vendidos_30d', 'mas_vendidos_90d']:
+        # Ranking precalculado (services/sales_rank.py): una fila por producto
+        columna = {
+            'mas_vendidos': RankingVenta.unidades_total,
+            'mas_vendidos_30d': RankingVenta.unidades_30d,
+            'mas_vendidos_90d': RankingVenta.unidades_90d
+        }[sort_by]
+        query = query.outerjoin(RankingVenta, RankingVenta.id_producto == Producto.id_producto)
+        sort_key, sort_desc = func.coalesce(columna, 0), True
         
     elif sort_by in ['mayor_stock', 'menor_stock']:
-        # Creamos una subconsulta para sumar el stock total de todas las variantes de un producto
-        stock_subq = db.session.query(
-            ProductoVariante.id_producto,
-            func.sum(Inventario.stock_actual).label('total_stock')
-        ).join(Inventario, Inventario.id_variante == ProductoVariante.id_variante) \
-         .group_by(ProductoVariante.id_producto).subquery()
-         
-        query = query.outerjoin(stock_subq, Producto.id_producto == stock_subq.c.id_producto)
-        
-        if sort_by == 'mayor_stock':
-            # Quitamos nulls_last
-            query = query.order_by(stock_subq.c.total_stock.desc(), Producto.id_producto.desc())
-        else:
-            # Quitamos nulls_first
-            query = query.order_by(stock_subq.c.total_stock.asc(), Producto.id_producto.desc())
+        # Columna mantenida en cada cambio de inventario (services/stock_totals.py)
+        sort_key, sort_desc = Producto.stock_total, sort_by == 'mayor_stock'
             
     elif sort_by == 'az':
-        query = query.order_by(Producto.nombre.asc())
+        sort_key, sort_desc, id_desc = Producto.nombre, False, False
 
     else:
         # Default: 'recientes'
-        query = query.order_by(Producto.id_producto.desc())
+        sort_by = 'recientes'
+
+    orden = []
+    if sort_key is not None:
+        orden.append(sort_key.desc() if sort_desc else sort_key.asc())
+    orden.append(Producto.id_producto.desc() if id_desc else Producto.id_producto.asc())
+    query = query.order_by(*orden)
+
+    # 5. Proyección liviana: columnas sueltas con Core, sin armar objetos ORM
+    if campos is not None:
+        return _listado_liviano(query, campos, agrupado, sort_by, sort_key, sort_desc, id_desc, page, per_page)
 
+    # selectinload evita el N+1: sin esto, cada producto listado dispara una
+    # query aparte para sus variantes y otra por cada variante para su
+    # inventario (cientos de queries por página de 50 productos).
+    query = query.options(selectinload(Producto.variantes).selectinload(ProductoVariante.inventario))
 
-    # 5. Paginación y Respuesta (Removido el order_by viejo de aquí)
+    # 5a. Modo cursor (keyset): ?cursor= (vacío para la primera página).
+    # Sin OFFSET ni COUNT: la página 200 cuesta lo mismo que la 1. El total es opcional (?with_total=true).
+    if 'cursor' in request.args:
+        try:
+            ultimo = _decode_cursor(request.args.get('cursor'), sort_by)
+        except ValueError:
+            return jsonify({"msg": "Cursor inválido o de otro orden. Pedí la primera página de nuevo."}), 400
+
+        total = query.order_by(None).count() if request.args.get('with_total') == 'true' else None
+
+        if ultimo is not None:
+            query = query.filter(_keyset_filter(sort_key, sort_desc, id_desc, ultimo))
+        if sort_key is not None:
+            query = query.add_columns(sort_key.label('sort_value'))
+
+        filas = query.limit(per_page + 1).all()
+        has_more = len(filas) > per_page
+        filas = filas[:per_page]
+        productos = [fila[0] for fila in filas] if sort_key is not None else filas
+
+        next_cursor = None
+        if has_more:
+            ult = filas[-1]
+            valor = ult[1] if sort_key is not None else None
+            next_cursor = _encode_cursor(sort_by, valor, productos[-1].id_producto)
+
+        meta = {"next_cursor": next_cursor, "has_more": has_more, "current_page": page}
+        if total is not None:
+            meta["total_items"] = total
+            meta["total_pages"] = (total + per_page - 1) // per_page if per_page else 0
+        return jsonify({"products": [serialize_producto(prod) for prod in productos], "meta": meta}), 200
+
+    # 5b. Paginación clásica (page/limit)
     paginated_data = query.paginate(page=page, per_page=per_page, error_out=False)
 
     resultado = [serialize_producto(prod) for prod in paginated_data.items]
@@ -292,6 +350,160 @@ def get_products():
         "meta": { "total_items": paginated_data.total, "total_pages": paginated_data.pages, "current_page": paginated_data.page }
     }), 200
 
+
+def _encode_cursor(sort_by, valor, id_producto):
+    """Token opaco con la posición del último producto entregado."""
+    if isinstance(valor, Decimal):
+        valor = int(valor) if valor == valor.to_integral_value() else float(valor)
+    datos = json.dumps({"s": sort_by, "v": valor, "id": id_producto}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(datos.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(token, sort_by):
+    """None para la primera página. ValueError si el token no es válido o es de otro orden."""
+    if not token:
+        return None
+    try:
+        datos = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        if datos["s"] != sort_by or not isinstance(datos["id"], int):
+            raise ValueError
+        return datos
+    except (ValueError, KeyError, TypeError):
+        raise ValueError("cursor inválido")
+
+
+def _keyset_filter(sort_key, sort_desc, id_desc, ultimo):
+    """Condición "viene después de `ultimo`" para el orden (clave, id)."""
+    id_col = Producto.id_producto
+    sigue_id = id_col < ultimo["id"] if id_desc else id_col > ultimo["id"]
+    if sort_key is None:
+        return sigue_id
+    valor = ultimo["v"]
+    sigue_clave = sort_key < valor if sort_desc else sort_key > valor
+    return or_(sigue_clave, and_(sort_key == valor, sigue_id))
+
+
+def _precio(valor):
+    return float(valor) if valor is not None else 0.0
+
+
+def _nombre_o_guion(valor):
+    return valor or "-"
+
+
+# Campos de ?fields= -> (columna, conversión). Mismas claves y formato que serialize_producto.
+# stock_total sale de la columna mantenida (services/stock_totals.py), no de sumar variantes.
+LITE_FIELDS = {
+    "id": (Producto.id_producto, None),
+    "nombre": (Producto.nombre, None),
+    "descripcion": (Producto.descripcion, None),
+    "precio": (Producto.precio, _precio),
+    "stock_total": (Producto.stock_total, None),
+    "imagen": (Producto.imagen, None),
+    "categoria_id": (Producto.id_categoria, None),
+    "categoria_especifica_id": (Producto.id_categoria_especifica, None),
+    "categoria": (Categoria.nombre, _nombre_o_guion),
+    "liga": (CategoriaEspecifica.nombre, _nombre_o_guion),
+    "tiendanube_id": (Producto.tiendanube_id, None),
+    "sincronizado_web": (Producto.sincronizado_web, None),
+    "activo": (Producto.activo, None),
+    "variantes": (None, None), # Se traen aparte, en una sola consulta para toda la página
+}
+
+# Lo que necesita la grilla del POS
+LITE_DEFAULT = ("id", "nombre", "precio", "stock_total")
+
+
+def _parse_fields(valor):
+    """Lista de campos pedidos (siempre con 'id' primero), o None para el producto completo."""
+    if valor is None:
+        return None
+    pedidos = [c.strip() for c in valor.split(',') if c.strip()]
+    if pedidos == ['lite']:
+        pedidos = list(LITE_DEFAULT)
+    desconocidos = [c for c in pedidos if c not in LITE_FIELDS]
+    if desconocidos or not pedidos:
+        raise ValueError(f"Campos desconocidos: {', '.join(desconocidos) or '(vacío)'}. Válidos: lite, {', '.join(LITE_FIELDS)}")
+    return ["id"] + [c for c in dict.fromkeys(pedidos) if c != "id"]
+
+
+def _variantes_de(ids_producto):
+    """{id_producto: [variantes serializadas]} con una sola consulta de columnas (variante + inventario)."""
+    por_producto = {id_producto: [] for id_producto in ids_producto}
+    if not ids_producto:
+        return por_producto
+    filas = db.session.execute(
+        db.select(ProductoVariante.id_producto, ProductoVariante.id_variante, ProductoVariante.talla,
+                  ProductoVariante.color, ProductoVariante.codigo_sku, Inventario.stock_actual)
+        .outerjoin(Inventario, Inventario.id_variante == ProductoVariante.id_variante)
+        .where(ProductoVariante.id_producto.in_(ids_producto))
+        .order_by(ProductoVariante.id_variante)
+    )
+    for id_producto, id_variante, talla, color, sku, stock in filas:
+        por_producto[id_producto].append({
+            "id_variante": id_variante, "talle": talla, "estampa": color, "sku": sku, "stock": stock or 0
+        })
+    return por_producto
+
+
+def _listado_liviano(query, campos, agrupado, sort_by, sort_key, sort_desc, id_desc, page, per_page):
+    """
+    Misma búsqueda, filtros, orden y paginación que get_products, pero seleccionando
+    solo las columnas pedidas: filas planas (sin objetos ORM ni identity map) que se
+    serializan directo con orjson.
+    """
+    escalares = [c for c in campos if c != "variantes"]
+    columnas = [LITE_FIELDS[c][0] for c in escalares]
+    conversiones = [(i, campo, LITE_FIELDS[campo][1]) for i, campo in enumerate(escalares)]
+
+    q = query.with_entities(*columnas)
+    if agrupado:
+        # Con el GROUP BY de la búsqueda por SQL, las columnas de las categorías también van agrupadas
+        q = q.group_by(*[col for col in columnas if col.class_ is not Producto])
+    if sort_key is not None:
+        q = q.add_columns(sort_key.label('sort_value'))
+
+    if 'cursor' in request.args:
+        try:
+            ultimo = _decode_cursor(request.args.get('cursor'), sort_by)
+        except ValueError:
+            return jsonify({"msg": "Cursor inválido o de otro orden. Pedí la primera página de nuevo."}), 400
+        total = query.order_by(None).count() if request.args.get('with_total') == 'true' else None
+        if ultimo is not None:
+            q = q.filter(_keyset_filter(sort_key, sort_desc, id_desc, ultimo))
+        filas = db.session.execute(q.limit(per_page + 1).statement).all()
+        has_more = len(filas) > per_page
+        filas = filas[:per_page]
+
+        meta = {"next_cursor": None, "has_more": has_more, "current_page": page}
+        if has_more:
+            ult = filas[-1]
+            meta["next_cursor"] = _encode_cursor(sort_by, ult[-1] if sort_key is not None else None, ult[0])
+        if total is not None:
+            meta["total_items"] = total
+            meta["total_pages"] = (total + per_page - 1) // per_page if per_page else 0
+    else:
+        # Igual que paginate(error_out=False)
+        page = max(page, 1)
+        per_page = per_page if per_page > 0 else 20
+        total = query.order_by(None).count()
+        filas = db.session.execute(q.limit(per_page).offset((page - 1) * per_page).statement).all() if total else []
+        meta = {"total_items": total, "total_pages": (total + per_page - 1) // per_page, "current_page": page}
+
+    productos = []
+    for fila in filas:
+        item = {}
+        for i, campo, conversion in conversiones:
+            item[campo] = conversion(fila[i]) if conversion else fila[i]
+        productos.append(item)
+
+    if "variantes" in campos:
+        variantes = _variantes_de([item["id"] for item in productos])
+        for item in productos:
+            item["variantes"] = variantes[item["id"]]
+
+    return Response(orjson.dumps({"products": productos, "meta": meta}), status=200, mimetype='application/json')
+
 # ==========================================
 # 5. Crear producto
 # ==========================================
@@ -373,6 +585,39 @@ def create_product():
         return jsonify({"msg": str(e)}), 500
 
 
+# ==========================================
+# 4.b Snapshot del catálogo para las terminales (columnar + gzip)
+# ==========================================
+@bp.route('/snapshot', methods=['GET'])
+@jwt_required()
+@versioned('catalogo', 'stock', cache=False) # El cuerpo ya viene cacheado y comprimido
+def get_catalog_snapshot():
+    """Catálogo activo completo, o solo lo cambiado con ?since_version=<version de la respuesta anterior>."""
+    try:
+        cuerpo = build_snapshot(request.args.get('since_version'))
+    except SnapshotInvalido as e:
+        return jsonify({"msg": str(e)}), 400
+
+    if 'gzip' in request.headers.get('Accept-Encoding', ''):
+        resp = Response(cuerpo, status=200, mimetype='application/json')
+        resp.headers['Content-Encoding'] = 'gzip'
+        resp.headers['Vary'] = 'Accept-Encoding'
+        return resp
+    return Response(gzip.decompress(cuerpo), status=200, mimetype='application/json')
+
+
+# ==========================================
+# 4.c Sugerencias del buscador (type-ahead)
+# ==========================================
+@bp.route('/suggest', methods=['GET'])
+@jwt_required()
+def suggest_products():
+    """Sugerencias por prefijo (productos, SKUs, categorías y ligas) desde el índice en memoria, sin DB."""
+    texto = request.args.get('q', '', type=str)
+    limite = request.args.get('limit', DEFAULT_SUGGEST_LIMIT, type=int)
+    return jsonify({"suggestions": sugerir_productos(texto, limite)}), 200
+
+
 # ==========================================
 # 5.b Obtener un solo producto (para refrescos puntuales, ej. EditProductModal)
 # ==========================================
@@ -493,13 +738,22 @@ def update_product(id):
                         # 1. Datos básicos (Cambiamos esto)
                         tn_service.update_product_data(p) # <--- AHORA LE PASAMOS EL PRODUCTO COMPLETO
                         
-                        # 2. Actualizar variantes existentes
+                        # 2. Actualizar variantes existentes (stock + precio, un request por producto)
+                        cambios = []
                         for var in p.variantes:
                             tn_var_id = getattr(var, 'tiendanube_id', None) or getattr(var, 'tiendanube_variant_id', None)
                             if tn_var_id:
-                                if var.inventario:
-                                    tn_service.update_variant_stock(p.tiendanube_id, tn_var_id, var.inventario.stock_actual)
-                                tn_service.update_variant_price(p.tiendanube_id, tn_var_id, p.precio)
+                                cambios.append({
+                                    "id": tn_var_id,
+                                    "stock": var.inventario.stock_actual if var.inventario else None,
+                                    "precio_local": p.precio,
+                                    "variante": var
+                                })
+                        resultados = tn_service.update_product_variants(p.tiendanube_id, cambios)
+                        for c in cambios:
+                            if resultados.get(str(c["id"])) is True:
+                                marcar_sincronizada(c["variante"], stock=c["stock"], precio_local=p.precio)
+                        db.session.commit()
 
                         # 3. Sincronizar Variantes Faltantes
                         nuevas_creadas = tn_service.sync_missing_variants(p)
@@ -550,34 +804,11 @@ def update_variant(id):
         # -------------------------------
 
         if 'stock' in data:
-            if not var.inventario:
-                nuevo_inv = Inventario(id_variante=var.id_variante, stock_actual=int(data['stock']))
-                db.session.add(nuevo_inv)
-            else:
-                var.inventario.stock_actual = int(data['stock'])
+            # 2. Stock (con la fila bloqueada) y sync a Tienda Nube encolada junto con el cambio local
+            fijar_stock({var.id_variante: int(data['stock'])})
         
         db.session.commit()
 
-        # 2. Sincronización con Tienda Nube (Stock)
-        if getattr(var, 'tiendanube_variant_id', None) and getattr(var.producto, 'tiendanube_id', None):
-            app = current_app._get_current_object()
-            sync_data = {
-                'tn_product_id': var.producto.tiendanube_id,
-                'tn_variant_id': var.tiendanube_variant_id,
-                'new_stock': int(data.get('stock', var.inventario.stock_actual if var.inventario else 0))
-            }
-            
-            def background_sync_variant(app_context, s_data):
-                with app_context.app_context():
-                    from app.services.tiendanube_service import tn_service
-                    try:
-                        tn_service.update_variant_stock(s_data['tn_product_id'], s_data['tn_variant_id'], s_data['new_stock'])
-                    except Exception as e:
-                        print(f"🔥 Error Crítico Sync TN (Variante {s_data['tn_variant_id']}): {e}")
-
-            thread = threading.Thread(target=background_sync_variant, args=(app, sync_data))
-            thread.start()
-
         return jsonify({"msg": "Variante actualizada localmente"}), 200
         
     except Exception as e:
@@ -789,47 +1020,21 @@ def bulk_stock_update():
     if not items: return jsonify({"msg": "Lista vacía"}), 400
 
     try:
-        updated_count = 0
-        variantes_a_sincronizar = [] # Recolectamos todo para la nube sin bloquear el bucle
-        
-        for item in items:
-            variante = ProductoVariante.query.filter_by(codigo_sku=item['sku']).first()
-            
-            if variante and variante.inventario:
-                variante.inventario.stock_actual = int(item['cantidad'])
-                updated_count += 1
-                
-                # --- PREPARAMOS LA SYNC TIENDA NUBE ---
-                if getattr(variante, 'tiendanube_variant_id', None) and getattr(variante.producto, 'tiendanube_id', None):
-                    variantes_a_sincronizar.append({
-                        'tn_product_id': variante.producto.tiendanube_id,
-                        'tn_variant_id': variante.tiendanube_variant_id,
-                        'new_stock': variante.inventario.stock_actual
-                    })
-        
-        # Confirmamos la transacción local PRIMERO para asegurar la consistencia del ERP
+        cantidades = {item['sku']: int(item['cantidad']) for item in items}
+
+        # Todas las variantes de la planilla en consultas por lote (no una por SKU)
+        skus = list(cantidades)
+        id_por_sku = {}
+        for i in range(0, len(skus), 500):
+            id_por_sku.update(db.session.query(ProductoVariante.codigo_sku, ProductoVariante.id_variante)
+                              .filter(ProductoVariante.codigo_sku.in_(skus[i:i + 500])).all())
+
+        # Un solo ajuste (filas bloqueadas en orden) y las syncs a Tienda Nube encoladas en lote;
+        # stock local y tareas de sync se confirman juntos, el worker las empuja a la nube
+        niveles = fijar_stock({id_por_sku[sku]: cantidad for sku, cantidad in cantidades.items() if sku in id_por_sku})
         db.session.commit()
-        
-        # --- LANZAMOS LA SYNC A LA NUBE EN SEGUNDO PLANO ---
-        if variantes_a_sincronizar:
-            app = current_app._get_current_object()
-            def sync_bulk_background(app_context, sync_list):
-                with app_context.app_context():
-                    from app.services.tiendanube_service import tn_service
-                    for sync_item in sync_list:
-                        try:
-                            tn_service.update_variant_stock(
-                                tn_product_id=sync_item['tn_product_id'],
-                                tn_variant_id=sync_item['tn_variant_id'],
-                                new_stock=sync_item['new_stock']
-                            )
-                        except Exception as e:
-                            print(f"⚠️ Error en sync masiva de stock para var {sync_item['tn_variant_id']}: {e}")
-            
-            thread = threading.Thread(target=sync_bulk_background, args=(app, variantes_a_sincronizar))
-            thread.start()
 
-        return jsonify({"msg": f"Stock actualizado en {updated_count} productos"}), 200
+        return jsonify({"msg": f"Stock actualizado en {len(niveles)} productos"}), 200
 
     except Exception as e:
         db.session.rollback()
@@ -987,59 +1192,45 @@ def publish_product_to_cloud(id):
         return jsonify({"msg": "Se subió pero falló al guardar IDs locales", "error": str(e)}), 500
 
 
-def background_full_sync(app):
-    """Proceso pesado en segundo plano con barra de progreso y LOGS DETALLADOS"""
-    with app.app_context():
-        try:
-            # Contadores para el log final
-            actualizados = 0
-            errores = 0
-            
-            with open(SYNC_PROGRESS_FILE, 'w') as f:
-                json.dump({"is_running": True, "current": 0, "total": 1, "message": "Preparando catálogo..."}, f)
+def background_full_sync(app, forzar=False, progreso=None):
+    """Proceso pesado en segundo plano con barra de progreso y LOGS DETALLADOS.
+    Sin forzar sólo empuja las variantes que cambiaron desde la última sync.
+    El progreso va a la tabla sync_progress (ver services/progress.py)."""
+    from app.services.full_sync import run_full_sync
 
-            productos = Producto.query.filter(Producto.tiendanube_id.isnot(None)).all()
-            total_productos = len(productos)
-            
-            print(f"🔄 [BACKGROUND] Iniciando Sync Masiva de {total_productos} productos con Tienda Nube...")
+    if progreso is None:
+        progreso = ProgressReporter(app, 'full_sync')
+        if not progreso.claim("Preparando catálogo..."):
+            print("⚠️ Ya hay una sincronización completa en curso.")
+            return
 
-            for i, prod in enumerate(productos):
-                # Actualiza la barra de progreso en React
-                with open(SYNC_PROGRESS_FILE, 'w') as f:
-                    json.dump({"is_running": True, "current": i, "total": total_productos, "message": f"Sincronizando: {prod.nombre}"}, f)
-                
-                try:
-                    # 1. Actualizamos estructura y variantes nuevas (Vital para que no falle la estampa)
-                    tn_service.update_product_data(prod)
-                    tn_service.sync_missing_variants(prod)
-                    
-                    # 2. Sincronizamos stock y precio de cada variante existente
-                    for var in prod.variantes:
-                        if var.tiendanube_variant_id:
-                            stock_actual = var.inventario.stock_actual if var.inventario else 0
-                            
-                            tn_service.update_variant_stock(prod.tiendanube_id, var.tiendanube_variant_id, stock_actual)
-                            tn_service.update_variant_price(prod.tiendanube_id, var.tiendanube_variant_id, prod.precio)
-                            
-                            # --- LOG DETALLADO MANTENIDO ---
-                            print(f"✅ TN Sync OK: {var.codigo_sku} -> Stock {stock_actual} | Precio Local Base: ${prod.precio}")
-                            actualizados += 1
-                            
-                except Exception as sync_err:
-                    print(f"❌ TN Sync Error en producto {prod.nombre}: {sync_err}")
-                    errores += 1
+    try:
+        # Los productos se sincronizan en paralelo; el progreso se escribe desde este hilo
+        total_productos = 0
+        def on_progress(current, total, nombre):
+            nonlocal total_productos
+            total_productos = total
+            progreso.update(current, total, f"Sincronizando: {nombre}")
 
-            # Terminó con éxito
-            with open(SYNC_PROGRESS_FILE, 'w') as f:
-                json.dump({"is_running": False, "current": total_productos, "total": total_productos, "message": "¡Sincronización completada exitosamente!"}, f)
-            
-            # --- LOG FINAL MANTENIDO ---
-            print(f"🏁 [BACKGROUND] Sync Finalizada. Exitos: {actualizados} | Errores: {errores}")
+        actualizados, errores = run_full_sync(app, on_progress=on_progress, forzar=forzar, should_stop=progreso.cancelled)
 
-        except Exception as e:
-            with open(SYNC_PROGRESS_FILE, 'w') as f:
-                json.dump({"is_running": False, "current": 0, "total": 1, "message": f"Error crítico: {str(e)}"}, f)
-            print(f"🔥 Error Crítico en Hilo de Sincronización: {e}")
+        if progreso.cancelled():
+            progreso.finish("Sincronización cancelada por el usuario.")
+            print(f"🛑 [BACKGROUND] Sync cancelada. Exitos: {actualizados} | Errores: {errores}")
+            return
+
+        # Terminó con éxito
+        progreso.finish("¡Sincronización completada exitosamente!", current=total_productos, total=total_productos or 1, errores=errores)
+
+        # --- LOG FINAL MANTENIDO ---
+        print(f"🏁 [BACKGROUND] Sync Finalizada. Exitos: {actualizados} | Errores: {errores}")
+        conexiones = tn_service.connection_stats()
+        print(f"📈 Ritmo contra TN: {tn_service.rate_limiter.stats()['requests_per_sec']} req/seg | "
+              f"Conexiones abiertas: {conexiones['conexiones_abiertas']} | Reutilizadas: {conexiones['conexiones_reutilizadas']}")
+
+    except Exception as e:
+        progreso.finish(f"Error crítico: {str(e)}", current=0, total=1)
+        print(f"🔥 Error Crítico en Hilo de Sincronización: {e}")
 
 
 # ==========================================
@@ -1048,20 +1239,20 @@ def background_full_sync(app):
 @bp.route('/sync/force-tiendanube', methods=['POST'])
 @jwt_required()
 def force_sync_tiendanube():
+    # ?full=1 (o {"full": true}) reenvía todo el catálogo; por defecto sólo lo que cambió
+    data = request.get_json(silent=True) or {}
+    forzar = request.args.get('full') in ('1', 'true') or bool(data.get('full'))
+
     # Evitamos lanzar una sync completa si ya hay una corriendo
-    # (si se dispara 2 o 3 veces en paralelo, se multiplica la carga contra TN)
-    try:
-        if os.path.exists(SYNC_PROGRESS_FILE):
-            with open(SYNC_PROGRESS_FILE, 'r') as f:
-                current_status = json.load(f)
-                if current_status.get("is_running"):
-                    return jsonify({"msg": "Ya hay una sincronización completa en curso."}), 400
-    except Exception:
-        pass
+    # (si se dispara 2 o 3 veces en paralelo, se multiplica la carga contra TN).
+    # El claim es un UPDATE condicional: vale aunque el otro pedido lo atienda otro worker.
+    app = current_app._get_current_object()
+    progreso = ProgressReporter(app, 'full_sync')
+    if not progreso.claim("Preparando catálogo..."):
+        return jsonify({"msg": "Ya hay una sincronización completa en curso."}), 400
 
     # Disparamos el hilo secundario para no bloquear al usuario
-    app = current_app._get_current_object()
-    thread = threading.Thread(target=background_full_sync, args=(app,))
+    thread = threading.Thread(target=background_full_sync, args=(app, forzar, progreso))
     thread.daemon = True 
     thread.start()
     return jsonify({"msg": "Sincronización iniciada en segundo plano"}), 202
@@ -1069,46 +1260,153 @@ def force_sync_tiendanube():
 @bp.route('/sync/status', methods=['GET'])
 @jwt_required()
 def get_sync_status():
-    # Esta ruta es consultada por React cada 3 segundos para dibujar la barra
+    # Consulta puntual; la barra de React escucha /sync/progress/stream
+    return jsonify(get_progress('full_sync')), 200
+
+@bp.route('/sync/cancel', methods=['POST'])
+@jwt_required()
+def cancel_full_sync():
+    """Cancela la sync completa en curso (o libera un estado trabado)."""
+    request_cancel('full_sync', "Sincronización cancelada por el usuario.")
+    return jsonify({'msg': 'Sincronización cancelada.'}), 200
+
+def _firmador_stream():
+    return URLSafeTimedSerializer(current_app.config['SECRET_KEY'], salt='sync-progress-stream')
+
+
+@bp.route('/sync/progress/stream-token', methods=['POST'])
+@jwt_required()
+def create_progress_stream_token():
+    """Token de corta duración para abrir /sync/progress/stream?job=...&token=..."""
+    job = (request.get_json(silent=True) or {}).get('job', 'full_sync')
+    if job not in PROGRESS_JOBS:
+        return jsonify({"msg": "Proceso desconocido"}), 400
+    token = _firmador_stream().dumps({"job": job, "user": get_jwt_identity()})
+    return jsonify({"token": token, "expires_in": SSE_TOKEN_MAX_AGE}), 200
+
+
+@bp.route('/sync/progress/stream', methods=['GET'])
+def stream_sync_progress():
+    """
+    Server-Sent Events con el progreso de ?job=full_sync|margen. Se autentica con
+    ?token= de /sync/progress/stream-token (EventSource no puede mandar headers).
+    Mientras el proceso corre la conexión queda abierta y se empuja cada cambio;
+    si no hay nada corriendo se manda el estado y se cierra, y el navegador se
+    reconecta solo a los SSE_RETRY_MS (así un tab abierto no retiene un worker).
+    Una conexión dura a lo sumo SSE_MAX_SECONDS y hay como mucho SSE_MAX_STREAMS
+    abiertas por worker; con el cupo lleno se contesta el estado y se cierra.
+    """
+    job = request.args.get('job', 'full_sync')
+    if job not in PROGRESS_JOBS:
+        return jsonify({"msg": "Proceso desconocido"}), 400
     try:
-        if os.path.exists(SYNC_PROGRESS_FILE):
-            with open(SYNC_PROGRESS_FILE, 'r') as f:
-                data = json.load(f)
-            return jsonify(data), 200
-        return jsonify({"is_running": False}), 200
-    except:
-        return jsonify({"is_running": False}), 200
+        datos = _firmador_stream().loads(request.args.get('token', ''), max_age=SSE_TOKEN_MAX_AGE)
+    except BadSignature:
+        return jsonify({"msg": "Token de stream inválido o vencido"}), 401
+    if datos.get("job") != job:
+        return jsonify({"msg": "El token es de otro proceso"}), 401
+
+    def generar():
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        if not _sse_streams.acquire(blocking=False):
+            # Cupo lleno: el estado de ahora y que vuelva a intentar después
+            yield f"data: {json.dumps(get_progress(job))}\n\n"
+            db.session.remove()
+            return
+        try:
+            inicio = time.monotonic()
+            ultimo = None
+            while True:
+                data = get_progress(job)
+                # Cerramos la transacción: la próxima lectura tiene que ver lo que escribió el worker
+                db.session.remove()
+
+                if data != ultimo:
+                    yield f"data: {json.dumps(data)}\n\n"
+                    ultimo = data
+
+                if not data["is_running"]:
+                    return
+                if time.monotonic() - inicio > SSE_MAX_SECONDS:
+                    yield f"retry: {SSE_RETRY_RUNNING_MS}\n\n"
+                    return
+                time.sleep(1)
+        finally:
+            _sse_streams.release()
+
+    return Response(
+        stream_with_context(generar()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/sync/queue/status', methods=['GET'])
+@jwt_required()
+def get_sync_queue_status():
+    """Cantidad de tareas de stock por estado en sync_queue (pending / processing / completed / failed)."""
+    return jsonify(queue_status()), 200
+
+@bp.route('/tiendanube/rate-limit', methods=['GET'])
+@jwt_required()
+def get_tn_rate_limit():
+    """Estado del rate limiter compartido contra Tienda Nube (requests/seg, tokens disponibles, etc.)
+    y del pool de conexiones keep-alive del proceso que atiende el request."""
+    data = tn_service.rate_limiter.stats()
+    data["conexiones"] = tn_service.connection_stats()
+    return jsonify(data), 200
+
+@bp.route('/tiendanube/mirror/status', methods=['GET'])
+@jwt_required()
+def get_tn_mirror_status():
+    """Cuántas variantes tiene el espejo local del catálogo de TN y cuándo se refrescó."""
+    return jsonify(mirror_status()), 200
+
+@bp.route('/tiendanube/mirror/refresh', methods=['POST'])
+@jwt_required()
+def refresh_tn_mirror():
+    """Refresca el espejo ya mismo. {"full": true} trae todo el catálogo (y borra lo eliminado en TN)."""
+    data = request.get_json(silent=True) or {}
+    try:
+        resumen = refresh_catalog_mirror(full=bool(data.get('full')))
+        return jsonify(resumen), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"msg": "No se pudo refrescar el catálogo de Tienda Nube", "error": str(e)}), 502
 
 @bp.route('/sync/force-prices-update', methods=['GET'])
 @jwt_required()
 def force_prices_update():
     try:
-        # 1. Traemos todos los productos que estén vinculados a TN
-        productos = Producto.query.filter(Producto.tiendanube_id.isnot(None)).all()
+        # 1. Variantes vinculadas a TN cuyo precio web no coincide con el último confirmado
+        #    (?full=1 reenvía todas)
+        forzar = request.args.get('full') in ('1', 'true')
+        pendientes = variantes_pendientes(campos=('precio',), forzar=forzar)
         
         total_actualizados = 0
         errores = 0
-        log = []
 
-        print(f"🚀 Iniciando actualización masiva de precios al 18%...")
+        print(f"🚀 Iniciando actualización masiva de precios ({len(pendientes)} variantes)...")
 
-        for prod in productos:
-            # Pausa muy breve para no saturar la API de Tienda Nube
-            time.sleep(0.1) 
-            
-            for var in prod.variantes:
-                if var.tiendanube_variant_id:
-                    try:
-                        # Esto usará el NUEVO 1.18 que configuraste en el Paso 1
-                        tn_service.update_variant_price(
-                            tn_product_id=prod.tiendanube_id,
-                            tn_variant_id=var.tiendanube_variant_id,
-                            precio_local=prod.precio
-                        )
-                        total_actualizados += 1
-                    except Exception as e:
-                        errores += 1
-                        print(f"Error en {prod.nombre}: {e}")
+        # Sin pausas manuales: el rate limiter compartido de tn_service marca el ritmo
+        for prod, grupo in groupby(pendientes, key=lambda v: v.producto):
+            grupo = list(grupo)
+            try:
+                resultados = tn_service.update_product_variants(
+                    prod.tiendanube_id,
+                    [{"id": v.tiendanube_variant_id, "precio_local": prod.precio} for v in grupo]
+                )
+            except Exception as e:
+                print(f"Error en {prod.nombre}: {e}")
+                resultados = {}
+
+            for var in grupo:
+                if resultados.get(str(var.tiendanube_variant_id)) is True:
+                    marcar_sincronizada(var, precio_local=prod.precio)
+                    total_actualizados += 1
+                else:
+                    errores += 1
+
+        db.session.commit()
 
         return jsonify({
             "msg": "Proceso finalizado",
@@ -1117,6 +1415,7 @@ def force_prices_update():
         }), 200
 
     except Exception as e:
+        db.session.rollback()
         return jsonify({"msg": "Error critico", "error": str(e)}), 500
 
 
@@ -1269,14 +1568,7 @@ def bulk_price_selected():
 @bp.route('/tiendanube/margen/status', methods=['GET'])
 @jwt_required()
 def get_tn_margen_status():
-    status_file = os.path.join(os.path.dirname(__file__), 'margin_sync_status.json')
-    try:
-        if os.path.exists(status_file):
-            with open(status_file, 'r') as f:
-                return jsonify(json.load(f)), 200
-    except Exception:
-        pass
-    return jsonify({"is_running": False, "current": 0, "total": 0, "message": "", "errores": 0}), 200
+    return jsonify(get_progress('margen')), 200
 
 @bp.route('/tiendanube/margen/cancel', methods=['POST'])
 @jwt_required()
@@ -1284,23 +1576,12 @@ def cancel_tn_margen():
     """Cancela la actualización de margen en curso (o limpia un estado
     "trabado" si el proceso quedó marcado como corriendo pero ya no avanza,
     por ejemplo tras un reinicio del servidor)."""
-    status_file = os.path.join(os.path.dirname(__file__), 'margin_sync_status.json')
-
-    # Le avisamos al hilo (si sigue vivo) que debe detenerse en la próxima iteración.
-    _margen_cancel_event.set()
-
-    # Y de una forma u otra liberamos el "lock" ya mismo, para que el usuario
-    # pueda iniciar un nuevo proceso sin esperar a que el hilo lo note.
     try:
-        with open(status_file, 'w') as f:
-            json.dump({
-                "is_running": False,
-                "current": 0,
-                "total": 0,
-                "message": "Proceso cancelado por el usuario.",
-                "errores": 0
-            }, f)
+        # El hilo (en el worker que sea) ve la marca en la DB y corta en la próxima iteración;
+        # el "lock" se libera ya mismo para poder iniciar otro proceso.
+        request_cancel('margen')
     except Exception as e:
+        db.session.rollback()
         return jsonify({'msg': f'No se pudo cancelar: {str(e)}'}), 500
 
     return jsonify({'msg': 'Proceso cancelado.'}), 200
@@ -1310,23 +1591,7 @@ def cancel_tn_margen():
 @jwt_required()
 def manage_tn_margen():
     from app.services.tiendanube_service import tn_service
-    from app.products.models import Producto
-    
-    status_file = os.path.join(os.path.dirname(__file__), 'margin_sync_status.json')
     
-    def update_status(is_running, current, total, message, errores=0):
-        try:
-            with open(status_file, 'w') as f:
-                json.dump({
-                    "is_running": is_running, 
-                    "current": current, 
-                    "total": total, 
-                    "message": message,
-                    "errores": errores
-                }, f)
-        except Exception:
-            pass
-
     if request.method == 'GET':
         return jsonify({'margen': tn_service.get_margen_web()}), 200
     
@@ -1335,92 +1600,85 @@ def manage_tn_margen():
     
     # NUEVO: Atrapamos los IDs seleccionados desde el Frontend
     product_ids = data.get('product_ids', []) 
+    # Por defecto sólo se suben los precios que cambian; "forzar" reenvía todos
+    forzar = bool(data.get('forzar'))
     
     if not nuevo_margen:
         return jsonify({'msg': 'Falta el margen'}), 400
         
-    try:
-        if os.path.exists(status_file):
-            with open(status_file, 'r') as f:
-                current_status = json.load(f)
-                if current_status.get("is_running"):
-                    return jsonify({'msg': 'Ya hay una actualización en curso.'}), 400
-    except Exception:
-        pass
+    app = current_app._get_current_object()
+    progreso = ProgressReporter(app, 'margen')
+    if not progreso.claim("Preparando productos..."):
+        return jsonify({'msg': 'Ya hay una actualización en curso.'}), 400
         
     # Establecemos el margen configurado
     tn_service.set_margen_web(nuevo_margen)
-
-    # Limpiamos cualquier señal de cancelación de una corrida anterior
-    _margen_cancel_event.clear()
-
-    app = current_app._get_current_object()
     
     # NUEVO: Le pasamos los IDs al hilo secundario
     def background_price_update(app_context, ids_a_sincronizar):
-        update_status(True, 0, 0, "Preparando productos...", 0)
         with app_context.app_context():
             
-            # NUEVO: Lógica de filtrado dinámico
-            query = Producto.query.filter(Producto.tiendanube_id != None, Producto.activo == True)
-
-            # Si el frontend mandó IDs, filtramos solo esos. Si no, tomamos todos.
-            if ids_a_sincronizar and len(ids_a_sincronizar) > 0:
-                query = query.filter(Producto.id_producto.in_(ids_a_sincronizar))
-
-            productos_en_nube = query.all()
+            # Sólo las variantes cuyo precio web (con el margen nuevo) difiere del último
+            # confirmado por TN. Si el frontend mandó IDs, filtramos solo esos.
+            pendientes = variantes_pendientes(
+                campos=('precio',),
+                ids_producto=ids_a_sincronizar or None,
+                forzar=forzar,
+                solo_activos=True
+            )
+            productos_en_nube = [(prod, list(grupo)) for prod, grupo in groupby(pendientes, key=lambda v: v.producto)]
 
-            total_variantes = sum(1 for p in productos_en_nube for v in p.variantes if v.tiendanube_variant_id)
+            total_variantes = len(pendientes)
 
             # Validación por si la selección no tiene variantes vinculadas
             if total_variantes == 0:
-                update_status(False, 0, 0, "No hay productos vinculados en la selección para actualizar.", 0)
+                progreso.finish("No hay precios pendientes de actualizar en la selección.", current=0, total=0, errores=0)
                 return
 
-            update_status(True, 0, total_variantes, "Iniciando subida a Tienda Nube...", 0)
+            progreso.update(0, total_variantes, "Iniciando subida a Tienda Nube...", 0, force=True)
 
             procesados = 0
             errores = 0
             desvinculados = 0
             cancelado = False
 
-            for prod in productos_en_nube:
-                if cancelado:
+            for prod, variantes_tn in productos_en_nube:
+                if progreso.cancelled():
+                    cancelado = True
                     break
-                for var in prod.variantes:
-                    if var.tiendanube_variant_id:
-                        if _margen_cancel_event.is_set():
-                            cancelado = True
-                            break
 
-                        update_status(True, procesados, total_variantes, f"Actualizando: {prod.nombre[:25]}...", errores)
+                progreso.update(procesados, total_variantes, f"Actualizando: {prod.nombre[:25]}...", errores)
 
-                        try:
-                            resultado = tn_service.update_variant_price(prod.tiendanube_id, var.tiendanube_variant_id, prod.precio)
-                            if resultado == "not_found":
-                                # El vínculo local con Tienda Nube quedó desactualizado
-                                # (el producto/variante fue borrado o recreado del lado de TN).
-                                # Lo desvinculamos para que deje de reintentarse en cada sync.
-                                var.tiendanube_variant_id = None
-                                desvinculados += 1
-                                errores += 1
-                            elif resultado is False:
-                                errores += 1
-                            else:
-                                time.sleep(0.1)
-
-                        except Exception as e:
-                            print(f"⚠️ Error al subir precio de {prod.nombre} (ID: {var.tiendanube_variant_id}): {e}")
-                            errores += 1
+                try:
+                    # Todas las variantes del producto en un solo request (con fallback una por una)
+                    resultados = tn_service.update_product_variants(
+                        prod.tiendanube_id,
+                        [{"id": v.tiendanube_variant_id, "precio_local": prod.precio} for v in variantes_tn]
+                    )
+                except Exception as e:
+                    print(f"⚠️ Error al subir precios de {prod.nombre}: {e}")
+                    resultados = {}
+
+                for var in variantes_tn:
+                    resultado = resultados.get(str(var.tiendanube_variant_id), False)
+                    if resultado == "not_found":
+                        # El vínculo local con Tienda Nube quedó desactualizado
+                        # (el producto/variante fue borrado o recreado del lado de TN).
+                        # Lo desvinculamos para que deje de reintentarse en cada sync.
+                        var.tiendanube_variant_id = None
+                        desvinculados += 1
+                        errores += 1
+                    elif resultado is True:
+                        marcar_sincronizada(var, precio_local=prod.precio)
+                    else:
+                        errores += 1
 
-                        procesados += 1
+                    procesados += 1
 
-            if desvinculados > 0:
-                db.session.commit()
+            db.session.commit()
 
             if cancelado:
-                update_status(False, procesados, total_variantes, "Proceso cancelado por el usuario.", errores)
-                _margen_cancel_event.clear()
+                progreso.finish("Proceso cancelado por el usuario.", procesados, total_variantes, errores)
                 return
 
             mensaje_final = "¡Precios actualizados con éxito!"
@@ -1433,7 +1691,7 @@ def manage_tn_margen():
                 else:
                     mensaje_final = f"Terminado. Fallaron {errores} variantes por un error de conexión con Tienda Nube. Intenta de nuevo más tarde."
 
-            update_status(False, procesados, total_variantes, mensaje_final, errores)
+            progreso.finish(mensaje_final, procesados, total_variantes, errores)
             
     # Lanzamos el proceso enviando la variable "product_ids"
     Thread(target=background_price_update, args=(app, product_ids)).start()
@@ -1441,75 +1699,140 @@ def manage_tn_margen():
 
 
 
+def _indice_local_auditoria():
+    """
+    Índice local para cruzar contra TN, armado con UNA consulta:
+    ({tn_variant_id: variante}, [variantes sin vincular]).
+    """
+    variantes = ProductoVariante.query \
+        .join(Producto, Producto.id_producto == ProductoVariante.id_producto) \
+        .outerjoin(Inventario, Inventario.id_variante == ProductoVariante.id_variante) \
+        .options(contains_eager(ProductoVariante.producto), contains_eager(ProductoVariante.inventario)) \
+        .filter(Producto.tiendanube_id.isnot(None)) \
+        .order_by(ProductoVariante.id_producto, ProductoVariante.id_variante).all()
+
+    indice = {}
+    sin_vincular = []
+    for var in variantes:
+        if var.tiendanube_variant_id:
+            indice[str(var.tiendanube_variant_id)] = var
+        else:
+            sin_vincular.append(var)
+    return indice, sin_vincular
+
+
+def _discrepancia(var, causa, stock_nube=None):
+    prod = var.producto
+    stock_local = var.inventario.stock_actual if var.inventario else 0
+
+    if causa == "sin_vincular":
+        causa_detalle = "La variante no tiene tiendanube_variant_id: nunca se creó/vinculó del lado de Tienda Nube."
+    elif causa == "no_encontrado_en_tn":
+        causa_detalle = "El producto o la variante ya no existen en Tienda Nube (fue borrado o el ID guardado quedó desactualizado)."
+    elif stock_local > stock_nube:
+        causa_detalle = "ERP > Tienda Nube: probablemente una reposición/compra o devolución que subió el stock local sin empujarse a la web."
+    else:
+        causa_detalle = "ERP < Tienda Nube: probablemente una venta en el local (o un ajuste) que bajó el stock local sin reflejarse en la web, o una venta web cuyo webhook no se procesó."
+
+    return {
+        "id_variante": var.id_variante,
+        "producto_nombre": prod.nombre,
+        "sku": var.codigo_sku,
+        "talle": var.talla,
+        "estampa": var.color or "-",
+        "stock_local": stock_local,
+        "stock_nube": stock_nube,
+        "diferencia": (stock_local - stock_nube) if stock_nube is not None else None,
+        "causa": causa,
+        "causa_detalle": causa_detalle,
+        "tn_product_id": prod.tiendanube_id,
+        "tn_variant_id": var.tiendanube_variant_id
+    }
+
+
+def _auditar(indice, sin_vincular, variantes_tn):
+    """
+    Generador de discrepancias. `variantes_tn` es un iterable de
+    (tn_variant_id, stock_en_nube) que se consume como stream: las diferencias
+    de stock salen apenas llega cada variante, y las que nunca aparecieron en TN
+    recién al final.
+    """
+    for var in sin_vincular:
+        yield _discrepancia(var, "sin_vincular")
+
+    pendientes = dict(indice)
+    for tn_variant_id, stock_nube in variantes_tn:
+        var = pendientes.pop(str(tn_variant_id), None)
+        if var is None:
+            continue
+        stock_local = var.inventario.stock_actual if var.inventario else 0
+        if stock_local != stock_nube:
+            yield _discrepancia(var, "stock_desincronizado", stock_nube)
+
+    for var in pendientes.values():
+        yield _discrepancia(var, "no_encontrado_en_tn")
+
+
+def _variantes_tn_en_vivo():
+    """Catálogo de TN directo de la API, página por página (con la siguiente precargándose)."""
+    for tn_prod in tn_service.iter_products():
+        for tn_var in tn_prod.get('variants', []):
+            yield str(tn_var['id']), tn_var.get('stock', 0)
+
+
 @bp.route('/sync/audit-stock', methods=['GET'])
 @jwt_required()
 def audit_stock_discrepancies():
-    try:
-        # 1. Traemos todos los productos locales vinculados a la web
-        productos_locales = Producto.query.filter(Producto.tiendanube_id.isnot(None)).all()
+    """
+    Compara el stock del ERP contra Tienda Nube.
+    Por defecto lee el espejo local (tn_catalog_mirror) y responde JSON.
+    Con ?source=live recorre la API en vivo y responde NDJSON en streaming: una
+    discrepancia por línea a medida que llegan las páginas y al final {"resumen": ...}.
+    """
+    if request.args.get('source') == 'live':
+        indice, sin_vincular = _indice_local_auditoria()
+
+        def generar():
+            resumen = {"sin_vincular": 0, "no_encontrado_en_tn": 0, "stock_desincronizado": 0}
+            try:
+                for disc in _auditar(indice, sin_vincular, _variantes_tn_en_vivo()):
+                    resumen[disc["causa"]] += 1
+                    yield json.dumps(disc, default=str) + "\n"
+                yield json.dumps({"resumen": resumen, "total": sum(resumen.values())}) + "\n"
+            except Exception as e:
+                yield json.dumps({"msg": "No se pudo consultar el catálogo de Tienda Nube", "error": str(e)}) + "\n"
+
+        return Response(stream_with_context(generar()), mimetype='application/x-ndjson')
 
-        # 2. Obtenemos el catálogo completo de Tienda Nube
-        try:
-            tn_catalogo = tn_service.get_all_products()
-        except Exception as e:
-            return jsonify({"msg": "No se pudo consultar el catálogo de Tienda Nube", "error": str(e)}), 502
-
-        # Armamos un diccionario rápido de Tienda Nube: { "tn_variant_id": stock_en_nube }
-        tn_stock_map = {}
-        tn_product_ids = set()
-        for tn_prod in tn_catalogo:
-            tn_product_ids.add(str(tn_prod.get('id')))
-            for tn_var in tn_prod.get('variants', []):
-                tn_stock_map[str(tn_var['id'])] = tn_var.get('stock', 0)
+    try:
+        # 1. Leemos el catálogo de Tienda Nube desde el espejo local (tn_catalog_mirror). Si quedó
+        #    viejo se refresca en segundo plano (?refresh=0 lo evita): la respuesta no espera a TN
+        if request.args.get('refresh') != '0':
+            refresh_if_stale()
+        espejo = mirror_status()
+        if not espejo["variantes"]:
+            return jsonify({
+                "msg": "El espejo del catálogo de Tienda Nube todavía se está cargando. Probá de nuevo en unos minutos.",
+                "espejo_refrescando": espejo["refrescando"]
+            }), 503
+
+        # 2. Índice local de variantes vinculadas y cruce contra el espejo (leído en tandas)
+        indice, sin_vincular = _indice_local_auditoria()
+        variantes_tn = db.session.query(TnCatalogMirror.tn_variant_id, TnCatalogMirror.stock).yield_per(1000)
 
-        # 3. Cruzamos los datos
         discrepancias = []
         resumen = {"sin_vincular": 0, "no_encontrado_en_tn": 0, "stock_desincronizado": 0}
-
-        for prod in productos_locales:
-            producto_existe_en_tn = str(prod.tiendanube_id) in tn_product_ids
-
-            for var in prod.variantes:
-                stock_local = var.inventario.stock_actual if var.inventario else 0
-
-                if not var.tiendanube_variant_id:
-                    causa = "sin_vincular"
-                    causa_detalle = "La variante no tiene tiendanube_variant_id: nunca se creó/vinculó del lado de Tienda Nube."
-                    stock_nube = None
-                elif not producto_existe_en_tn or str(var.tiendanube_variant_id) not in tn_stock_map:
-                    causa = "no_encontrado_en_tn"
-                    causa_detalle = "El producto o la variante ya no existen en Tienda Nube (fue borrado o el ID guardado quedó desactualizado)."
-                    stock_nube = None
-                else:
-                    stock_nube = tn_stock_map[str(var.tiendanube_variant_id)]
-                    if stock_local == stock_nube:
-                        continue
-                    causa = "stock_desincronizado"
-                    if stock_local > stock_nube:
-                        causa_detalle = "ERP > Tienda Nube: probablemente una reposición/compra o devolución que subió el stock local sin empujarse a la web."
-                    else:
-                        causa_detalle = "ERP < Tienda Nube: probablemente una venta en el local (o un ajuste) que bajó el stock local sin reflejarse en la web, o una venta web cuyo webhook no se procesó."
-
-                resumen[causa] += 1
-                discrepancias.append({
-                    "id_variante": var.id_variante,
-                    "producto_nombre": prod.nombre,
-                    "sku": var.codigo_sku,
-                    "talle": var.talla,
-                    "estampa": var.color or "-",
-                    "stock_local": stock_local,
-                    "stock_nube": stock_nube,
-                    "diferencia": (stock_local - stock_nube) if stock_nube is not None else None,
-                    "causa": causa,
-                    "causa_detalle": causa_detalle,
-                    "tn_product_id": prod.tiendanube_id,
-                    "tn_variant_id": var.tiendanube_variant_id
-                })
+        for disc in _auditar(indice, sin_vincular, variantes_tn):
+            resumen[disc["causa"]] += 1
+            discrepancias.append(disc)
 
         return jsonify({
             "discrepancias": discrepancias,
             "total": len(discrepancias),
-            "resumen": resumen
+            "resumen": resumen,
+            "espejo_actualizado": espejo["ultimo_refresco"],
+            "espejo_antiguedad_segundos": espejo["antiguedad_segundos"],
+            "espejo_refrescando": espejo["refrescando"]
         }), 200
 
     except Exception as e:
@@ -1536,6 +1859,11 @@ def force_stock_sync(variant_id):
     if not ok:
         return jsonify({"msg": "No se pudo actualizar el stock en Tienda Nube (ver logs del servidor)"}), 502
 
+    # Lo confirmado por TN queda reflejado en el espejo y en el estado de la sync delta
+    registrar_stock(variante.tiendanube_variant_id, stock_local)
+    marcar_sincronizada(variante, stock=stock_local)
+    db.session.commit()
+
     return jsonify({"msg": "Stock sincronizado con Tienda Nube", "stock_local": stock_local}), 200
 
 
@@ -1544,19 +1872,20 @@ def force_stock_sync(variant_id):
 @bp.route('/<int:id>/tn-link', methods=['GET'])
 @jwt_required()
 def get_tn_link(id):
-    import requests
     prod = Producto.query.get_or_404(id)
     
     if not prod.tiendanube_id:
         return jsonify({"msg": "El producto no está vinculado a la nube"}), 400
         
     try:
-        # Consultamos la API de Tienda Nube en tiempo real
-        url = f"{tn_service.api_url}/products/{prod.tiendanube_id}"
-        response = requests.get(url, headers=tn_service._get_headers())
+        # Primero el espejo local; solo si no lo tiene consultamos la API en tiempo real
+        permalink = get_permalink(prod.tiendanube_id)
+        if permalink:
+            return jsonify({"url": permalink}), 200
+
+        data = tn_service.get_product(prod.tiendanube_id)
         
-        if response.status_code == 200:
-            data = response.json()
+        if data:
             # TN devuelve la URL pública exacta y actualizada acá:
             permalink = data.get('permalink') 
             if permalink:
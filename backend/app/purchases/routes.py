@@ -1,7 +1,8 @@
 from flask import Blueprint, jsonify, request
 from app.extensions import db
 from app.purchases.models import Proveedor, Compra, DetalleCompra
-from app.products.models import ProductoVariante, Inventario
+from app.products.models import ProductoVariante
+from app.services.inventory import ajustar_stock, VarianteInexistente
 from flask_jwt_extended import jwt_required
 from sqlalchemy import desc
 
@@ -45,6 +46,7 @@ def create_purchase():
         db.session.flush()
 
         # B. Procesar Ítems
+        movimientos = []
         for item in items:
             # 1. Guardar Detalle
             costo = float(item.get('costo', 0))
@@ -58,16 +60,15 @@ def create_purchase():
                 subtotal=costo * cantidad
             )
             db.session.add(detalle)
+            movimientos.append((item['id_variante'], cantidad))
 
-            # 2. ACTUALIZAR STOCK (SUMAR)
-            # Buscamos el inventario de esa variante
-            inv = Inventario.query.filter_by(id_variante=item['id_variante']).first()
-            if inv:
-                inv.stock_actual += cantidad # Sumamos lo que compramos
-            else:
-                # Si por algún error no tenía inventario, lo creamos
-                new_inv = Inventario(id_variante=item['id_variante'], stock_actual=cantidad)
-                db.session.add(new_inv)
+        # 2. ACTUALIZAR STOCK (SUMAR): todo el ingreso de una vez, creando el inventario si
+        # la variante no tenía, y con la sync a Tienda Nube encolada en la misma transacción
+        try:
+            ajustar_stock(movimientos)
+        except VarianteInexistente as e:
+            db.session.rollback()
+            return jsonify({"msg": f"Variantes inexistentes en la compra: {', '.join(map(str, e.ids))}"}), 400
 
         db.session.commit()
         return jsonify({"msg": "Compra registrada y stock actualizado", "id": nueva_compra.id_compra}), 201
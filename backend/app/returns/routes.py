@@ -1,13 +1,12 @@
 # backend/app/returns/routes.py
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
 from app.extensions import db
 # IMPORTANTE: Importamos ProductoVariante para acceder a los IDs de Tienda Nube
-from app.products.models import Inventario, ProductoVariante
+from app.products.models import ProductoVariante
 from app.sales.models import Venta, DetalleVenta, NotaCredito, VentaPago, SesionCaja
-from app.sales.routes import sync_tn_background
+from app.services.inventory import ajustar_stock, StockInsuficiente
 from datetime import datetime, timedelta
-import threading
 
 bp = Blueprint('returns', __name__, url_prefix='/api/returns')
 
@@ -22,6 +21,13 @@ def _es_item_custom(item):
     return valor is True or str(valor).lower() == 'true'
 
 
+def _id_variante(item):
+    try:
+        return int(item.get('id_variante'))
+    except (TypeError, ValueError):
+        return None
+
+
 def _parse_precio(item):
     """Devuelve (precio, error). error es un mensaje listo para el cliente si el precio es inválido."""
     nombre = item.get('nombre', 'un artículo')
@@ -55,14 +61,23 @@ def process_return():
     if not sesion_activa:
         return jsonify({"msg": "No se puede procesar el cambio: la caja está cerrada."}), 400
 
-    # Guardamos los syncs de Tienda Nube para dispararlos recién después del
-    # commit, en un hilo aparte (igual que /sales/checkout). Antes se hacía
-    # una llamada HTTP a TN por cada ítem DENTRO de la transacción: con un
-    # cambio de varios artículos la request podía tardar varios segundos,
-    # lo que además ampliaba la ventana para un doble envío accidental.
-    items_to_sync = []
+    # Los syncs de Tienda Nube se encolan en sync_queue dentro de esta misma
+    # transacción (igual que /sales/checkout). Antes se hacía una llamada
+    # HTTP a TN por cada ítem DENTRO de la transacción: con un cambio de
+    # varios artículos la request podía tardar varios segundos, lo que
+    # además ampliaba la ventana para un doble envío accidental.
 
     try:
+        # Todas las variantes de entradas y salidas en una sola consulta
+        ids_variante = {
+            _id_variante(item) for item in items_in + items_out if not _es_item_custom(item)
+        } - {None}
+        variantes = {
+            v.id_variante: v for v in ProductoVariante.query.options(db.joinedload(ProductoVariante.producto))
+            .filter(ProductoVariante.id_variante.in_(ids_variante)).all()
+        } if ids_variante else {}
+        movimientos = []
+
         # 1. PROCESAR ENTRADAS (Devolución) -> Sumar Stock
         total_in = 0
         for item in items_in:
@@ -71,30 +86,15 @@ def process_return():
                 db.session.rollback()
                 return jsonify({"msg": error}), 400
 
-            variante = None
             if not _es_item_custom(item):
-                var_id = item.get('id_variante')
-                variante = ProductoVariante.query.get(var_id)
+                variante = variantes.get(_id_variante(item))
                 if not variante:
                     db.session.rollback()
                     return jsonify({"msg": f"El producto '{item.get('nombre', 'desconocido')}' ya no existe en el catálogo."}), 400
 
-                # Si la variante nunca tuvo un registro de inventario, lo
-                # creamos ahora en vez de perder el ingreso de stock en
-                # silencio (como pasaba antes).
-                if not variante.inventario:
-                    variante.inventario = Inventario(id_variante=variante.id_variante, stock_actual=0)
-                    db.session.add(variante.inventario)
-
-                variante.inventario.stock_actual += 1
-
-                if variante.producto.tiendanube_id and variante.tiendanube_variant_id:
-                    items_to_sync.append({
-                        'tn_product_id': variante.producto.tiendanube_id,
-                        'tn_variant_id': variante.tiendanube_variant_id,
-                        'new_stock': variante.inventario.stock_actual,
-                        'nombre': variante.producto.nombre
-                    })
+                # Si la variante nunca tuvo un registro de inventario, ajustar_stock
+                # lo crea en vez de perder el ingreso de stock en silencio.
+                movimientos.append((variante.id_variante, 1))
 
             total_in += precio
 
@@ -112,32 +112,25 @@ def process_return():
                 db.session.rollback()
                 return jsonify({"msg": error}), 400
 
-            variante = None
             if not _es_item_custom(item):
-                var_id = item.get('id_variante')
-                variante = ProductoVariante.query.get(var_id)
+                variante = variantes.get(_id_variante(item))
                 if not variante:
                     db.session.rollback()
                     return jsonify({"msg": f"El producto '{item.get('nombre', 'desconocido')}' ya no existe en el catálogo."}), 400
 
-                stock_disponible = variante.inventario.stock_actual if variante.inventario else 0
-                if stock_disponible <= 0:
-                    db.session.rollback()
-                    talle = item.get('talle', '')
-                    return jsonify({"msg": f"Sin stock disponible para: {variante.producto.nombre} (talle {talle})"}), 400
-
-                variante.inventario.stock_actual -= 1
-
-                if variante.producto.tiendanube_id and variante.tiendanube_variant_id:
-                    items_to_sync.append({
-                        'tn_product_id': variante.producto.tiendanube_id,
-                        'tn_variant_id': variante.tiendanube_variant_id,
-                        'new_stock': variante.inventario.stock_actual,
-                        'nombre': variante.producto.nombre
-                    })
+                movimientos.append((variante.id_variante, -1))
 
             total_out += precio
 
+        # Entradas y salidas netas por variante, en un solo ajuste atómico
+        # (cambiar un talle por el mismo no necesita stock disponible)
+        try:
+            ajustar_stock(movimientos)
+        except StockInsuficiente as e:
+            db.session.rollback()
+            variante = variantes[e.faltantes[0]["id_variante"]]
+            return jsonify({"msg": f"Sin stock disponible para: {variante.producto.nombre} (talle {variante.talla})"}), 400
+
         # 3. BALANCE FINANCIERO
         balance = total_out - total_in
         nota_credito = None
@@ -200,15 +193,9 @@ def process_return():
             )
             db.session.add(pago)
 
+        # Stock, venta/nota y tareas de sync a Tienda Nube se confirman juntos
         db.session.commit()
 
-        # Recién ahora, con todo ya confirmado en la base, avisamos a
-        # Tienda Nube en segundo plano.
-        if items_to_sync:
-            app = current_app._get_current_object()
-            thread = threading.Thread(target=sync_tn_background, args=(app, items_to_sync))
-            thread.start()
-
         return jsonify({
             "msg": "Procesado correctamente",
             "nota_credito": {
@@ -213,4 +213,51 @@ class DetalleNotaCredito(db.Model):
     id_detalle = db.Column(db.Integer, primary_key=True)
     id_nota = db.Column(db.Integer, db.ForeignKey('notas_credito.id_nota'), nullable=False)
     id_venta = db.Column(db.Integer, db.ForeignKey('ventas.id_venta'), nullable=False)
-    monto_aplicado = db.Column(db.Numeric(10, 2), nullable=False)
\ No newline at end of file
+    monto_aplicado = db.Column(db.Numeric(10, 2), nullable=False)
+class TnWebhookInbox(db.Model):
+    """
+    Notificaciones de Tienda Nube tal como llegaron. El webhook solo guarda la
+    fila y responde 200; `flask webhook-worker` descarga la orden y la procesa.
+    """
+    __tablename__ = 'tn_webhook_inbox'
+    __table_args__ = (
+        # El worker siempre busca "pendientes cuyo próximo intento ya venció"
+        db.Index('ix_tn_webhook_inbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    event = db.Column(db.String(50), nullable=True) # ej: 'order/created'
+    tn_order_id = db.Column(db.String(50), nullable=True, index=True)
+    store_id = db.Column(db.String(50), nullable=True)
+    payload = db.Column(db.Text, nullable=True) # Cuerpo crudo de la notificación
+
+    status = db.Column(db.String(20), default='pending') # pending, processing, done, failed
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.String(255), nullable=True)
+
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<TnWebhookInbox #{self.id} Orden:{self.tn_order_id} {self.status}>"
+
+class OrdenTiendaNube(db.Model):
+    """
+    Una fila por orden de Tienda Nube ya registrada. El índice único sobre
+    tn_order_id es el control de duplicados: el INSERT va en la misma transacción
+    que la venta, así que dos entregas simultáneas de la misma orden no pueden
+    registrarla dos veces (la segunda recibe IntegrityError).
+    """
+    __tablename__ = 'tn_ordenes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tn_order_id = db.Column(db.String(50), nullable=False, unique=True, index=True)
+    id_venta = db.Column(db.Integer, db.ForeignKey('ventas.id_venta'), nullable=True) # NULL si solo se descontó stock
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    venta = db.relationship('Venta')
+
+    def __repr__(self):
+        return f"<OrdenTiendaNube #{self.tn_order_id} Venta:{self.id_venta}>"
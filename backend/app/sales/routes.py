@@ -1,17 +1,19 @@
 #backend/app/sales/routes.py
 import csv
 import io
-import threading
 from io import StringIO
-from flask import Blueprint, jsonify, request, Response, send_file, current_app
+from flask import Blueprint, jsonify, request, Response, send_file
 from app.extensions import db
 # IMPORTAMOS DESDE TUS ARCHIVOS SEPARADOS
-from app.sales.models import Venta, DetalleVenta, MetodoPago, SesionCaja, MovimientoCaja, Reserva, DetalleReserva, Presupuesto, DetallePresupuesto, NotaCredito, Gasto, DetalleNotaCredito
+from app.sales.models import Venta, DetalleVenta, MetodoPago, SesionCaja, MovimientoCaja, Reserva, DetalleReserva, Presupuesto, DetallePresupuesto, NotaCredito, Gasto, DetalleNotaCredito, OrdenTiendaNube
 from app.products.models import Producto, ProductoVariante, Inventario, Categoria
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy import desc, func, extract
 from datetime import date, datetime, timedelta
 from app.services.tiendanube_service import tn_service
+from app.services.catalog_version import versioned
+from app.services.sku_index import scan_codes, MAX_BATCH
+from app.services.inventory import ajustar_stock, StockInsuficiente, VarianteInexistente
 from app.sales.models import VentaPago
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
@@ -172,37 +174,89 @@ def get_sales_history():
 # --- NUEVO ENDPOINT: Listar Métodos ---
 @bp.route('/payment-methods', methods=['GET'])
 @jwt_required()
+@versioned('catalogo')
 def get_payment_methods():
     metodos = MetodoPago.query.all()
     return jsonify([{"id": m.id_metodo_pago, "nombre": m.nombre} for m in metodos]), 200
 
+
+def _es_custom(item):
+    # Ítems del "Anotador Libre": no tienen variante ni mueven stock
+    es_custom = item.get('is_custom')
+    return es_custom is True or str(es_custom).lower() == 'true'
+
+
+def _id_variante(valor):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        return None
+
+
+def _cargar_variantes(ids):
+    """{id_variante: variante} (con su producto) en una sola consulta."""
+    ids = {i for i in map(_id_variante, ids) if i is not None}
+    if not ids:
+        return {}
+    variantes = ProductoVariante.query.options(db.joinedload(ProductoVariante.producto)) \
+        .filter(ProductoVariante.id_variante.in_(ids)).all()
+    return {v.id_variante: v for v in variantes}
+
+
+def _nombres_faltantes(error, variantes):
+    """Nombres (con talle) de las variantes sin stock suficiente, para el mensaje al cliente."""
+    nombres = []
+    for faltante in error.faltantes:
+        variante = variantes.get(faltante["id_variante"])
+        nombres.append(f"{variante.producto.nombre} ({variante.talla})" if variante else f"variante #{faltante['id_variante']}")
+    return ', '.join(nombres)
+
+
 @bp.route('/scan/<string:code>', methods=['GET']) # Cambiamos 'sku' por 'code' para ser genéricos
 @jwt_required()
 def scan_product(code):
-    # 1. Intentar buscar por SKU exacto (comportamiento original)
-    variante = ProductoVariante.query.filter_by(codigo_sku=code).first()
-    
-    # 2. Si no encuentra y el código es numérico, buscar por ID Interno
-    if not variante and code.isdigit():
-        variante = ProductoVariante.query.get(int(code))
+    # SKU exacto o, si es numérico, ID interno de la variante. Datos fijos del índice en memoria,
+    # stock vigente con una consulta por clave primaria (ver services/sku_index.py)
+    _, scan, stock = scan_codes([code])[0]
 
-    if not variante: 
+    if not scan:
         return jsonify({"found": False, "msg": "Producto no encontrado"}), 404
-        
-    stock = variante.inventario.stock_actual if variante.inventario else 0
-    
-    return jsonify({
-        "found": True,
-        "product": {
-            "id_variante": variante.id_variante,
-            "sku": variante.codigo_sku,
-            "nombre": variante.producto.nombre,
-            "talle": variante.talla,
-            "estampa": variante.color, 
-            "precio": float(variante.producto.precio),
-            "stock_actual": stock
-        }
-    }), 200
+
+    return jsonify({"found": True, "product": _scan_a_dict(scan, stock)}), 200
+
+
+@bp.route('/scan/batch', methods=['POST'])
+@jwt_required()
+def scan_batch():
+    """Resuelve muchos códigos de una vez (conteos de stock, listas de SKUs pegadas)."""
+    data = request.get_json(silent=True) or {}
+    codes = [str(c).strip() for c in data.get('codes', []) if str(c).strip()]
+    if not codes:
+        return jsonify({"msg": "Lista vacía"}), 400
+    if len(codes) > MAX_BATCH:
+        return jsonify({"msg": f"Máximo {MAX_BATCH} códigos por pedido"}), 400
+
+    resultados, no_encontrados = [], []
+    for code, scan, stock in scan_codes(codes):
+        if scan:
+            resultados.append({"code": code, "found": True, "product": _scan_a_dict(scan, stock)})
+        else:
+            resultados.append({"code": code, "found": False})
+            no_encontrados.append(code)
+
+    return jsonify({"results": resultados, "not_found": no_encontrados}), 200
+
+
+def _scan_a_dict(scan, stock):
+    return {
+        "id_variante": scan.id_variante,
+        "sku": scan.sku,
+        "nombre": scan.nombre,
+        "talle": scan.talle,
+        "estampa": scan.estampa,
+        "precio": scan.precio,
+        "stock_actual": stock
+    }
 
 
 # --- 1. VER ESTADO DE CAJA ---
@@ -749,25 +803,15 @@ def create_reserva():
             )
             db.session.add(detalle_v)
 
-        items_to_sync = [] # <-- RECOLECTOR PARA SEGUNDO PLANO
-
+        variantes = _cargar_variantes(item.get('id_variante') for item in items)
+        movimientos = []
         for item in items:
-            variante = ProductoVariante.query.get(item['id_variante'])
-            
-            if variante.inventario.stock_actual < item['cantidad']:
+            variante = variantes.get(_id_variante(item.get('id_variante')))
+            if not variante:
                 db.session.rollback()
-                return jsonify({"msg": f"Sin stock suficiente: {variante.producto.nombre}"}), 400
+                return jsonify({"msg": f"El producto '{item.get('nombre', 'desconocido')}' ya no existe."}), 400
 
-            variante.inventario.stock_actual -= item['cantidad']
-
-            # PREPARAMOS LA SYNC SIN FRENAR EL CÓDIGO
-            if getattr(variante, 'tiendanube_variant_id', None) and getattr(variante.producto, 'tiendanube_id', None):
-                items_to_sync.append({
-                    'tn_product_id': variante.producto.tiendanube_id,
-                    'tn_variant_id': variante.tiendanube_variant_id,
-                    'new_stock': variante.inventario.stock_actual,
-                    'nombre': variante.producto.nombre
-                })
+            movimientos.append((variante.id_variante, -int(item['cantidad'])))
 
             detalle_r = DetalleReserva(
                 id_reserva=nueva_reserva.id_reserva,
@@ -778,14 +822,14 @@ def create_reserva():
             )
             db.session.add(detalle_r)
 
-        # 1. ASEGURAMOS LA DB LOCAL PRIMERO
+        try:
+            ajustar_stock(movimientos)
+        except StockInsuficiente as e:
+            db.session.rollback()
+            return jsonify({"msg": f"Sin stock suficiente: {_nombres_faltantes(e, variantes)}"}), 400
+
+        # Reserva + tareas de sync se confirman juntas (el worker las empuja a TN)
         db.session.commit()
-        
-        # 2. LANZAMOS LA SYNC A LA NUBE
-        if items_to_sync:
-            app = current_app._get_current_object()
-            thread = threading.Thread(target=sync_tn_background, args=(app, items_to_sync))
-            thread.start()
 
         return jsonify({"msg": "Reserva creada exitosamente", "id": nueva_reserva.id_reserva}), 201
 
@@ -804,32 +848,24 @@ def anular_venta(id_venta):
              return jsonify({"msg": "Esta venta ya está anulada"}), 400
 
         detalles = DetalleVenta.query.filter_by(id_venta=id_venta).all()
-        items_to_sync = []
-        
-        for d in detalles:
-            variante = ProductoVariante.query.get(d.id_variante)
-            
-            if variante and variante.inventario:
-                variante.inventario.stock_actual += d.cantidad
-                
-                if getattr(variante, 'tiendanube_variant_id', None) and getattr(variante.producto, 'tiendanube_id', None):
-                    items_to_sync.append({
-                        'tn_product_id': variante.producto.tiendanube_id,
-                        'tn_variant_id': variante.tiendanube_variant_id,
-                        'new_stock': variante.inventario.stock_actual,
-                        'nombre': variante.producto.nombre
-                    })
+
+        # Devolvemos el stock de todos los ítems de una vez (los de "Anotador Libre" no tienen variante)
+        movimientos = [(d.id_variante, d.cantidad) for d in detalles if d.id_variante is not None]
+        try:
+            ajustar_stock(movimientos, crear_inventario=False)
+        except VarianteInexistente as e:
+            # Variantes borradas desde la venta: esas líneas no devuelven stock (no se aplicó nada todavía)
+            ajustar_stock([m for m in movimientos if m[0] not in e.ids], crear_inventario=False)
+
+        # Si era una orden de Tienda Nube, la orden queda registrada (sin venta) para que
+        # un reenvío del webhook o el backfill no la vuelvan a importar
+        OrdenTiendaNube.query.filter_by(id_venta=id_venta).update({"id_venta": None})
 
         for d in detalles:
             db.session.delete(d)
         db.session.delete(venta)
 
         db.session.commit()
-        
-        if items_to_sync:
-            app = current_app._get_current_object()
-            thread = threading.Thread(target=sync_tn_background, args=(app, items_to_sync))
-            thread.start()
 
         return jsonify({"msg": f"Venta #{id_venta} anulada, stock local actualizado."}), 200
 
@@ -895,28 +931,11 @@ def cancelar_reserva(id):
         return jsonify({"msg": "Solo se pueden cancelar reservas pendientes"}), 400
 
     try:
-        items_to_sync = []
+        ajustar_stock([(det.id_variante, det.cantidad) for det in reserva.detalles], crear_inventario=False)
 
-        for det in reserva.detalles:
-            variante = det.variante
-            variante.inventario.stock_actual += det.cantidad
-            
-            if getattr(variante, 'tiendanube_variant_id', None) and getattr(variante.producto, 'tiendanube_id', None):
-                items_to_sync.append({
-                    'tn_product_id': variante.producto.tiendanube_id,
-                    'tn_variant_id': variante.tiendanube_variant_id,
-                    'new_stock': variante.inventario.stock_actual,
-                    'nombre': variante.producto.nombre
-                })
-        
         reserva.estado = 'cancelada'
         db.session.commit()
 
-        if items_to_sync:
-            app = current_app._get_current_object()
-            thread = threading.Thread(target=sync_tn_background, args=(app, items_to_sync))
-            thread.start()
-
         return jsonify({"msg": "Reserva cancelada y stock restaurado"}), 200
         
     except Exception as e:
@@ -1121,21 +1140,6 @@ def validar_nota(code):
     }), 200
 
 
-def sync_tn_background(app, items_to_sync):
-    """Sincroniza el stock con Tienda Nube en segundo plano para evitar demoras/timeouts"""
-    with app.app_context():
-        for item in items_to_sync:
-            try:
-                from app.services.tiendanube_service import tn_service
-                tn_service.update_variant_stock(
-                    tn_product_id=item['tn_product_id'],
-                    tn_variant_id=item['tn_variant_id'],
-                    new_stock=item['new_stock']
-                )
-                print(f"✅ TN Sync (Background): {item['nombre']} -> {item['new_stock']}")
-            except Exception as e:
-                print(f"⚠️ Error Sync TN (Background) para {item['nombre']}: {e}")
-
 @bp.route('/notas-credito/<int:id>', methods=['DELETE'])
 @jwt_required()
 def eliminar_nota_credito(id):
@@ -1222,16 +1226,13 @@ def checkout():
         if nota_usada:
             nota_usada.id_venta_uso = nueva_venta.id_venta
 
-        # --- AQUÍ ESTÁ LA MAGIA DE LA OPTIMIZACIÓN ---
-        # Creamos una lista para guardar qué productos hay que avisarle a Tienda Nube
-        items_to_sync = []
-
-        # 3. Procesar Items y Stock Local
+        # 3. Procesar Items y Stock Local (todas las variantes del carrito en una consulta)
+        variantes = _cargar_variantes(item.get('id_variante') for item in items if not _es_custom(item))
+        movimientos = []
         for item in items:
             nombre_item = item.get('nombre', 'Item sin nombre')
-            es_custom = item.get('is_custom')
 
-            if es_custom is True or str(es_custom).lower() == 'true':
+            if _es_custom(item):
                 detalle = DetalleVenta(
                     id_venta=nueva_venta.id_venta,
                     id_variante=None,
@@ -1243,32 +1244,14 @@ def checkout():
                 db.session.add(detalle)
                 continue
 
-            id_variante = item.get('id_variante')
-            variante = ProductoVariante.query.get(id_variante)
+            variante = variantes.get(_id_variante(item.get('id_variante')))
             
             if not variante:
                 db.session.rollback()
                 return jsonify({"msg": f"El producto '{nombre_item}' ya no existe."}), 400
 
             cantidad_solicitada = int(item['cantidad'])
-            
-            # Chequeo Stock
-            if variante.inventario and variante.inventario.stock_actual < cantidad_solicitada:
-                db.session.rollback()
-                return jsonify({"msg": f"Sin stock suficiente para: {variante.producto.nombre}"}), 400
-            
-            # Descontar Stock Local
-            if variante.inventario:
-                variante.inventario.stock_actual -= cantidad_solicitada
-                
-                # En lugar de pausar el código para avisar a Tienda Nube, lo agendamos:
-                if variante.producto.tiendanube_id and variante.tiendanube_variant_id:
-                    items_to_sync.append({
-                        'tn_product_id': variante.producto.tiendanube_id,
-                        'tn_variant_id': variante.tiendanube_variant_id,
-                        'new_stock': variante.inventario.stock_actual,
-                        'nombre': variante.producto.nombre
-                    })
+            movimientos.append((variante.id_variante, -cantidad_solicitada))
 
             # Crear detalle de la venta
             detalle = DetalleVenta(
@@ -1281,16 +1264,17 @@ def checkout():
             )
             db.session.add(detalle)
 
-        # 4. Confirmamos la venta en la Base de Datos Local de inmediato
-        db.session.commit()
+        # Descuento atómico de todo el carrito (y sync a TN encolada en la misma transacción)
+        try:
+            ajustar_stock(movimientos)
+        except StockInsuficiente as e:
+            db.session.rollback()
+            return jsonify({"msg": f"Sin stock suficiente para: {_nombres_faltantes(e, variantes)}"}), 400
 
-        # 5. DISPARAMOS EL HILO EN SEGUNDO PLANO (La página no tiene que esperar a esto)
-        if items_to_sync:
-            app = current_app._get_current_object()
-            thread = threading.Thread(target=sync_tn_background, args=(app, items_to_sync))
-            thread.start()
+        # 4. Confirmamos la venta (y sus tareas de sync) en la Base de Datos Local de inmediato
+        db.session.commit()
 
-        # 6. Respondemos Éxito al Instante
+        # 5. Respondemos Éxito al Instante
         return jsonify({"msg": "Venta exitosa", "id": nueva_venta.id_venta}), 201
 
     except Exception as e:
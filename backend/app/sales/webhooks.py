@@ -2,56 +2,68 @@
 from flask import Blueprint, request, jsonify
 from app.extensions import db
 from app.products.models import ProductoVariante
-from app.sales.models import Venta, DetalleVenta, MetodoPago, VentaPago 
+from app.sales.models import Venta, DetalleVenta, MetodoPago, VentaPago, OrdenTiendaNube
 from app.services.tiendanube_service import tn_service
-from datetime import datetime, timedelta
+from app.services.webhook_inbox import registrar_notificacion, inbox_status
+from app.services.inventory import ajustar_stock
+from flask_jwt_extended import jwt_required
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta, timezone
+import hashlib
+import hmac
+import os
 
 bp_webhooks = Blueprint('webhooks', __name__)
 
+def verify_hmac(data, hmac_header):
+    """Firma de Tienda Nube (X-LinkedStore-HMAC-SHA256). Sin TIENDANUBE_CLIENT_SECRET o sin header no se valida."""
+    client_secret = os.getenv('TIENDANUBE_CLIENT_SECRET')
+    if not client_secret or not hmac_header:
+        return True
+    signature = hmac.new(client_secret.encode('utf-8'), data, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(signature, hmac_header)
+
 # --- Función para hora local ---
 def ahora_argentina():
     return datetime.utcnow() - timedelta(hours=3)
 
+def fecha_orden_argentina(order_data):
+    """Fecha de creación de la orden en TN ('2024-05-10T12:34:56+0000') en hora local; si no viene, ahora."""
+    try:
+        creada = datetime.strptime(order_data.get('created_at') or '', '%Y-%m-%dT%H:%M:%S%z')
+    except ValueError:
+        return ahora_argentina()
+    return creada.astimezone(timezone.utc).replace(tzinfo=None) - timedelta(hours=3)
+
 @bp_webhooks.route('/tiendanube/orders', methods=['POST'])
 def handle_new_order():
     """
-    Recibe notificación de Tienda Nube, valida y descarga la orden completa.
+    Recibe notificación de Tienda Nube, valida la tienda y la deja en la bandeja
+    (tn_webhook_inbox). La descarga y el registro de la venta los hace
+    `flask webhook-worker`: acá solo respondemos rápido para que TN no reintente.
     """
     try:
-        # 1. Obtener Headers y Datos
+        # 1. Obtener Headers
         store_id_header = request.headers.get('X-Store-Id') or request.headers.get('x-store-id')
-        
-        data = request.get_json() or {}
-        order_id = data.get('id')
-        
+
         # --- SEGURIDAD 1: Validar Store ID ---
         if tn_service.store_id and store_id_header:
             if str(store_id_header) != str(tn_service.store_id):
                 print(f"⛔ Alerta de Seguridad: ID recibido {store_id_header} no coincide con local.")
                 return jsonify({"msg": "Unauthorized Store ID"}), 401
 
-        if not order_id:
-            return jsonify({"msg": "Sin ID de orden"}), 200
+        # --- SEGURIDAD 2: Firma HMAC ---
+        if not verify_hmac(request.get_data(), request.headers.get('X-LinkedStore-HMAC-SHA256')):
+            print("❌ Error de firma HMAC")
+            return jsonify({"msg": "Invalid signature"}), 401
 
-        print(f"🔔 NOTIFICACIÓN RECIBIDA: ID #{order_id}")
-
-        # --- SEGURIDAD 2: Evitar Duplicados ---
-        venta_existente = Venta.query.filter(Venta.observaciones.like(f"%{order_id}%")).first()
-        if venta_existente:
-            print(f"⚠️ La Orden #{order_id} ya fue procesada anteriormente (Venta ID: {venta_existente.id_venta}). Se ignora.")
-            return jsonify({"msg": "Orden ya registrada previamente"}), 200
-
-        # 3. DESCARGAR LA DATA COMPLETA
-        full_order_data = tn_service.get_order_details(order_id)
-
-        if not full_order_data:
-            print("❌ No se pudo obtener la información de la orden desde la API.")
-            return jsonify({"msg": "Error fetching order data"}), 500
+        # 2. Guardar la notificación cruda (los duplicados se descartan en el worker)
+        fila = registrar_notificacion(request.get_data(as_text=True), store_id_header)
+        if not fila.tn_order_id:
+            return jsonify({"msg": "Sin ID de orden"}), 200
 
-        # 4. PROCESAR LA ORDEN
-        process_cloud_order(full_order_data)
-        
-        return jsonify({"msg": "Orden procesada exitosamente"}), 200
+        print(f"🔔 NOTIFICACIÓN RECIBIDA: ID #{fila.tn_order_id} (bandeja #{fila.id})")
+        return jsonify({"msg": "Notificación recibida"}), 200
 
     except Exception as e:
         print(f"🔥 ERROR CRÍTICO EN WEBHOOK: {e}")
@@ -59,109 +71,216 @@ def handle_new_order():
         traceback.print_exc()
         return jsonify({"msg": "Error interno"}), 500
 
-def process_cloud_order(order_data):
-    """Lógica para registrar la venta en MySQL y bajar stock usando el PRECIO LOCAL"""
-    
-    order_id_tn = order_data.get('id')
+@bp_webhooks.route('/tiendanube/inbox/status', methods=['GET'])
+@jwt_required()
+def inbox_status_endpoint():
+    """Profundidad de la bandeja de webhooks y demora hasta registrar la venta."""
+    return jsonify(inbox_status()), 200
+
+@bp_webhooks.route('/tiendanube/orders/backfill', methods=['POST'])
+@jwt_required()
+def backfill_orders_endpoint():
+    """
+    Importa las órdenes de TN que no llegaron por webhook.
+    Body: {"desde": "2026-10-16T00:00:00"} (UTC) o {"horas": 24} (default: últimas 24 h).
+    """
+    from app.services.order_backfill import backfill_orders
+
+    data = request.get_json(silent=True) or {}
+    try:
+        if data.get('desde'):
+            desde = datetime.fromisoformat(str(data['desde']))
+        else:
+            desde = datetime.utcnow() - timedelta(hours=float(data.get('horas', 24)))
+    except ValueError:
+        return jsonify({"msg": "Fecha u horas inválidas"}), 400
+
+    try:
+        resumen = backfill_orders(desde)
+    except Exception as e:
+        db.session.rollback()
+        print(f"🔥 Error en backfill de órdenes: {e}")
+        return jsonify({"msg": f"Error consultando Tienda Nube: {e}"}), 502
+
+    return jsonify({"msg": f"{resumen['importadas']} órdenes importadas", **resumen}), 200
+
+class OrdenDuplicada(Exception):
+    """La orden de Tienda Nube ya estaba registrada (otra entrega del mismo webhook)."""
+
+
+def orden_registrada(order_id):
+    """Consulta rápida (índice único de tn_ordenes) para no descargar órdenes ya registradas."""
+    return db.session.query(OrdenTiendaNube.id).filter_by(tn_order_id=str(order_id)).first() is not None
+
+
+def reclamar_orden(order_id):
+    """
+    Inserta la referencia de la orden dentro de la transacción en curso. Si otra
+    entrega ya la registró (o la está registrando en paralelo) el índice único lo
+    rechaza: se deshace solo ese INSERT (SAVEPOINT) y se lanza OrdenDuplicada; lo
+    que el llamador ya tenía en la transacción sigue en pie.
+    """
+    orden = OrdenTiendaNube(tn_order_id=str(order_id))
+    try:
+        with db.session.begin_nested():
+            db.session.add(orden)
+    except IntegrityError:
+        raise OrdenDuplicada(f"La Orden #{order_id} ya fue procesada anteriormente.")
+    return orden
+
+
+def resolver_variantes(items, chunk_size=500):
+    """
+    Resuelve las variantes locales de los items de una orden con un IN por ID de
+    variante de TN y otro IN por SKU solo para los que no aparecieron, trayendo
+    inventario y producto en la misma consulta.
+    Devuelve (por_tn_id, por_sku): {tiendanube_variant_id: variante}, {codigo_sku: variante}.
+    """
+    def _consultar(columna, valores):
+        encontradas = []
+        valores = list(valores)
+        for i in range(0, len(valores), chunk_size):
+            encontradas += ProductoVariante.query.options(
+                db.joinedload(ProductoVariante.inventario),
+                db.joinedload(ProductoVariante.producto)
+            ).filter(columna.in_(valores[i:i + chunk_size])).all()
+        return encontradas
+
+    ids_tn = {str(item.get('variant_id')) for item in items if item.get('variant_id')}
+    por_tn_id = {}
+    if ids_tn:
+        por_tn_id = {v.tiendanube_variant_id: v for v in _consultar(ProductoVariante.tiendanube_variant_id, ids_tn)}
+
+    skus = {item.get('sku') for item in items
+            if item.get('sku') and str(item.get('variant_id')) not in por_tn_id}
+    por_sku = {}
+    if skus:
+        por_sku = {v.codigo_sku: v for v in _consultar(ProductoVariante.codigo_sku, skus)}
+
+    return por_tn_id, por_sku
+
 
-    # 1. Buscar o Crear Método de Pago "Tienda Nube"
+def metodo_pago_tienda_nube():
+    """Busca o crea el Método de Pago "Tienda Nube"."""
     metodo_nube = MetodoPago.query.filter_by(nombre="Tienda Nube").first()
     if not metodo_nube:
         metodo_nube = MetodoPago(nombre="Tienda Nube")
         db.session.add(metodo_nube)
         db.session.flush()
+    return metodo_nube
 
+
+def armar_venta_tienda_nube(order_data, metodo_nube, por_tn_id, por_sku, descuentos, verbose=True):
+    """
+    Arma la Venta local (con detalles y pago) de una orden de TN usando el PRECIO LOCAL.
+    No consulta la DB ni hace flush: las variantes llegan resueltas (resolver_variantes) y
+    las unidades a descontar se acumulan en `descuentos` {id_variante: cantidad} para
+    aplicarlas una sola vez con aplicar_descuentos. Devuelve la venta (ya agregada a la sesión).
+    """
+    order_id_tn = order_data.get('id')
     products = order_data.get('products', [])
-    
+
     if not products:
-        print("⚠️ ALERTA: La orden descargada no tiene productos.")
+        print(f"⚠️ ALERTA: La orden #{order_id_tn} no tiene productos.")
 
-    # --- NUEVA LÓGICA: Calcular el total con el precio local ---
     total_venta_local = 0
-    detalles_a_guardar = []
+    nueva_venta = Venta(
+        descuento=0,
+        metodo=metodo_nube,
+        fecha_venta=fecha_orden_argentina(order_data), # Con la bandeja/backfill puede llegar tarde
+        observaciones=f"Orden Tienda Nube #{order_id_tn}"
+    )
 
     for item in products:
         variant_id_nube = str(item.get('variant_id'))
         cantidad = int(item.get('quantity', 1))
         precio_tienda = float(item.get('price', 0)) # Precio de la web por defecto
         nombre_producto = item.get('name', 'Producto Nube')
-        
-        print(f"   procesando item: {nombre_producto} (VarID: {variant_id_nube})")
-
-        # Buscar variante local vinculada
-        variante_local = ProductoVariante.query.filter_by(tiendanube_variant_id=variant_id_nube).first()
-        
-        # Intento por SKU si falla ID
-        if not variante_local:
-             sku = item.get('sku')
-             if sku:
-                 variante_local = ProductoVariante.query.filter_by(codigo_sku=sku).first()
+
+        if verbose:
+            print(f"   procesando item: {nombre_producto} (VarID: {variant_id_nube})")
+
+        # Buscar variante local vinculada (por ID de TN y, si falla, por SKU)
+        variante_local = por_tn_id.get(variant_id_nube) or por_sku.get(item.get('sku'))
 
         precio_final_aplicado = precio_tienda
 
         if variante_local:
             # A. Descontar Stock Local
             if variante_local.inventario:
-                variante_local.inventario.stock_actual -= cantidad
-                print(f"   📉 Stock bajado: {variante_local.producto.nombre} -{cantidad}u")
-            
+                descuentos[variante_local.id_variante] = descuentos.get(variante_local.id_variante, 0) + cantidad
+                if verbose:
+                    print(f"   📉 Stock bajado: {variante_local.producto.nombre} -{cantidad}u")
+
             # B. Reemplazar por Precio Local
             if variante_local.producto and variante_local.producto.precio:
                 precio_final_aplicado = float(variante_local.producto.precio)
-                print(f"   💵 Aplicando Precio Local de lista: ${precio_final_aplicado} (Ignorando precio web: ${precio_tienda})")
-            
-            detalles_a_guardar.append({
-                "id_variante": variante_local.id_variante,
-                "producto_nombre": variante_local.producto.nombre,
-                "cantidad": cantidad,
-                "precio_unitario": precio_final_aplicado,
-                "subtotal": precio_final_aplicado * cantidad
-            })
+                if verbose:
+                    print(f"   💵 Aplicando Precio Local de lista: ${precio_final_aplicado} (Ignorando precio web: ${precio_tienda})")
+
+            id_variante = variante_local.id_variante
+            producto_nombre = variante_local.producto.nombre
         else:
-            print(f"   ⚠️ Producto no vinculado localmente. Se guardará con el precio de TiendaNube.")
-            detalles_a_guardar.append({
-                "id_variante": None,
-                "producto_nombre": nombre_producto,
-                "cantidad": cantidad,
-                "precio_unitario": precio_final_aplicado,
-                "subtotal": precio_final_aplicado * cantidad
-            })
+            if verbose:
+                print(f"   ⚠️ Producto no vinculado localmente. Se guardará con el precio de TiendaNube.")
+            id_variante = None
+            producto_nombre = nombre_producto
+
+        nueva_venta.detalles.append(DetalleVenta(
+            id_variante=id_variante,
+            producto_nombre=producto_nombre,
+            cantidad=cantidad,
+            precio_unitario=precio_final_aplicado,
+            subtotal=precio_final_aplicado * cantidad
+        ))
 
         # Sumamos al total general de la venta
         total_venta_local += (precio_final_aplicado * cantidad)
 
+    # Total sumado real sin envíos
+    nueva_venta.total = total_venta_local
+    nueva_venta.subtotal = total_venta_local
+
+    # VentaPago: fundamental para que no de 0 en el Historial de Ventas
+    nueva_venta.pagos.append(VentaPago(metodo=metodo_nube, monto=total_venta_local))
 
-    # 2. Crear la Venta Local (Usando el monto sumado real sin envíos)
-    nueva_venta = Venta(
-        total=total_venta_local,
-        subtotal=total_venta_local,
-        descuento=0,
-        id_metodo_pago=metodo_nube.id_metodo_pago,
-        fecha_venta=ahora_argentina(),
-        observaciones=f"Orden Tienda Nube #{order_id_tn}" # Clave para detectar duplicados
-    )
     db.session.add(nueva_venta)
-    db.session.flush() # Guardar temporalmente para obtener el ID de la venta
-
-    # 3. Guardar los Detalles (Productos de la venta)
-    for det in detalles_a_guardar:
-        detalle_db = DetalleVenta(
-            id_venta=nueva_venta.id_venta,
-            id_variante=det["id_variante"],
-            producto_nombre=det["producto_nombre"],
-            cantidad=det["cantidad"],
-            precio_unitario=det["precio_unitario"],
-            subtotal=det["subtotal"]
-        )
-        db.session.add(detalle_db)
-
-    # 4. Guardar el VentaPago (Fundamental para que no de 0 en el Historial de Ventas)
-    nuevo_pago = VentaPago(
-        id_venta=nueva_venta.id_venta,
-        id_metodo_pago=metodo_nube.id_metodo_pago,
-        monto=total_venta_local
+    return nueva_venta
+
+
+def aplicar_descuentos(descuentos):
+    """
+    Descuenta el stock acumulado con ajustar_stock (UPDATE relativo, variantes en orden
+    de id): el worker procesa varias órdenes en paralelo y así no se pisan ni se traban.
+    La orden ya se vendió en la web, así que se registra aunque deje el stock negativo,
+    y no se encola sync: TN ya descontó esas unidades.
+    """
+    niveles = ajustar_stock(
+        [(id_variante, -cantidad) for id_variante, cantidad in descuentos.items()],
+        permitir_negativo=True, sincronizar=False
     )
-    db.session.add(nuevo_pago)
+    for id_variante, stock in niveles.items():
+        if stock < 0:
+            print(f"🚨 SOBREVENTA: la variante #{id_variante} quedó con stock {stock} tras una orden de Tienda Nube.")
+    return niveles
+
+
+def process_cloud_order(order_data):
+    """Lógica para registrar la venta en MySQL y bajar stock usando el PRECIO LOCAL"""
+
+    # 0. Reclamar la orden (lanza OrdenDuplicada si ya estaba registrada)
+    orden_tn = reclamar_orden(order_data.get('id'))
+
+    # 1. Método de pago y todas las variantes de la orden en dos consultas
+    metodo_nube = metodo_pago_tienda_nube()
+    por_tn_id, por_sku = resolver_variantes(order_data.get('products', []))
+
+    # 2. Crear la Venta Local con sus detalles y el pago
+    descuentos = {}
+    nueva_venta = armar_venta_tienda_nube(order_data, metodo_nube, por_tn_id, por_sku, descuentos)
+    orden_tn.venta = nueva_venta
+    aplicar_descuentos(descuentos)
+    total_venta_local = nueva_venta.total
 
     db.session.commit()
-    print(f"✅ Venta local registrada exitosamente por un total de ${total_venta_local}")
\ No newline at end of file
+    print(f"✅ Venta local registrada exitosamente por un total de ${total_venta_local}")
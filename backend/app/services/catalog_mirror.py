@@ -0,0 +1,252 @@
+# backend/app/services/catalog_mirror.py
+"""
+Espejo local del catálogo de Tienda Nube (tabla tn_catalog_mirror).
+
+La auditoría de stock y el link a la tienda leían la API en cada request:
+hasta 200 páginas por vista de la auditoría. Ahora leen esta tabla, que se
+refresca de forma incremental con `updated_at_min` (solo los productos que
+cambiaron desde el último refresco, normalmente una página o ninguna).
+
+El refresco completo (`full=True`) además borra lo que ya no existe en TN;
+conviene correrlo una vez por día (`flask tn-mirror-refresh --full`).
+
+Cuándo fue el último refresco vive en la tabla tn_mirror_status (una fila),
+así lo ven todos los workers y hosts y no se pierde al limpiar el temporal.
+La auditoría nunca espera a TN: si el espejo quedó viejo lanza un refresco
+incremental en segundo plano (uno solo entre todos los workers) y responde
+con la copia actual y su antigüedad.
+"""
+import threading
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import update, or_
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.products.models import TnCatalogMirror, TnMirrorStatus
+from app.services.tiendanube_service import tn_service
+
+# Antigüedad tolerada antes de que la auditoría pida un refresco incremental
+MIRROR_MAX_AGE = timedelta(seconds=60)
+
+# Un refresco en segundo plano que no terminó en este tiempo se da por abandonado
+REFRESH_TIMEOUT = timedelta(minutes=30)
+
+# Margen hacia atrás en el filtro incremental (relojes desfasados / escrituras en vuelo)
+INCREMENTAL_OVERLAP = timedelta(minutes=2)
+
+
+def _parse_tn_datetime(valor):
+    """'2024-05-10T12:34:56+0000' -> datetime naive en UTC."""
+    if not valor:
+        return None
+    try:
+        dt = datetime.strptime(valor, '%Y-%m-%dT%H:%M:%S%z')
+    except ValueError:
+        return None
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _nombre(tn_prod):
+    nombre = tn_prod.get('name')
+    if isinstance(nombre, dict):
+        nombre = nombre.get('es') or next(iter(nombre.values()), None)
+    return (nombre or '')[:255]
+
+
+def _permalink(tn_prod):
+    return tn_prod.get('permalink') or tn_prod.get('canonical_url')
+
+
+def _estado():
+    return db.session.get(TnMirrorStatus, 1)
+
+
+def _iso(fecha):
+    return fecha.isoformat() if fecha else None
+
+
+def read_status():
+    estado = _estado()
+    if estado is None:
+        return {}
+    refrescando = bool(estado.refreshing_since and datetime.utcnow() - estado.refreshing_since < REFRESH_TIMEOUT)
+    return {
+        "last_refresh": _iso(estado.last_refresh),
+        "last_full_refresh": _iso(estado.last_full_refresh),
+        "refreshing": refrescando,
+    }
+
+
+def _guardar_estado(inicio, full):
+    """Anota el refresco en la sesión (se confirma junto con las filas del espejo)."""
+    estado = _estado()
+    if estado is None:
+        estado = TnMirrorStatus(id=1)
+        db.session.add(estado)
+    estado.last_refresh = inicio
+    if full:
+        estado.last_full_refresh = inicio
+
+
+def _aplicar_productos(tn_productos):
+    """Upsert de los productos recibidos. Devuelve el set de tn_product_id vistos."""
+    vistos = set()
+    if not tn_productos:
+        return vistos
+
+    ids_producto = [str(p.get('id')) for p in tn_productos]
+    existentes = {}
+    for i in range(0, len(ids_producto), 500):
+        for fila in TnCatalogMirror.query.filter(TnCatalogMirror.tn_product_id.in_(ids_producto[i:i + 500])).all():
+            existentes[fila.tn_variant_id] = fila
+
+    variantes_vistas = set()
+    for tn_prod in tn_productos:
+        tn_product_id = str(tn_prod.get('id'))
+        vistos.add(tn_product_id)
+        actualizado = _parse_tn_datetime(tn_prod.get('updated_at'))
+
+        for tn_var in tn_prod.get('variants', []):
+            tn_variant_id = str(tn_var['id'])
+            variantes_vistas.add(tn_variant_id)
+
+            fila = existentes.get(tn_variant_id)
+            if fila is None:
+                fila = TnCatalogMirror(tn_variant_id=tn_variant_id)
+                db.session.add(fila)
+                existentes[tn_variant_id] = fila
+
+            fila.tn_product_id = tn_product_id
+            fila.sku = tn_var.get('sku')
+            fila.product_name = _nombre(tn_prod)
+            fila.stock = tn_var.get('stock')
+            fila.price = tn_var.get('price')
+            fila.permalink = _permalink(tn_prod)
+            fila.tn_updated_at = actualizado
+
+    # Variantes que desaparecieron de productos que sí vinieron en la respuesta
+    for tn_variant_id, fila in existentes.items():
+        if tn_variant_id not in variantes_vistas:
+            db.session.delete(fila)
+
+    return vistos
+
+
+def refresh_catalog_mirror(full=False):
+    """
+    Refresca el espejo. Si está vacío o full=True trae todo el catálogo y borra los
+    productos que ya no están en TN; si no, solo lo modificado desde el último refresco.
+    Devuelve un resumen con la cantidad de productos recibidos.
+    """
+    estado = _estado()
+    ultimo = estado.last_refresh if estado else None
+    if not ultimo or db.session.query(TnCatalogMirror.id).first() is None:
+        full = True
+
+    inicio = datetime.utcnow()
+    desde = None
+    if not full:
+        desde = ultimo - INCREMENTAL_OVERLAP
+
+    # Se procesa página por página (con la siguiente bajándose en segundo plano)
+    vistos = set()
+    recibidos = 0
+    for pagina in tn_service.iter_product_pages(updated_at_min=desde):
+        vistos |= _aplicar_productos(pagina)
+        recibidos += len(pagina)
+        # Bajamos la página a la DB y soltamos los objetos: en memoria queda solo una página
+        db.session.flush()
+        for obj in [o for o in db.session.identity_map.values() if isinstance(o, TnCatalogMirror)]:
+            db.session.expunge(obj)
+
+    borrados = 0
+    if full:
+        # En el refresco completo lo que no vino es porque ya no existe en TN
+        query = TnCatalogMirror.query
+        if vistos:
+            query = query.filter(TnCatalogMirror.tn_product_id.notin_(list(vistos)))
+        borrados = query.delete(synchronize_session=False)
+
+    _guardar_estado(inicio, full)
+    db.session.commit()
+
+    modo = "completo" if full else "incremental"
+    print(f"🪞 Espejo TN ({modo}): {recibidos} productos actualizados, {borrados} variantes eliminadas")
+    return {"modo": modo, "productos": recibidos, "variantes_eliminadas": borrados}
+
+
+def _reclamar_refresco():
+    """
+    Marca refreshing_since si el espejo tiene más de MIRROR_MAX_AGE y nadie lo está
+    refrescando. Es un UPDATE condicional: entre varios workers lo gana uno solo.
+    """
+    if _estado() is None:
+        try:
+            db.session.add(TnMirrorStatus(id=1))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback() # Otro worker creó la fila al mismo tiempo
+
+    ahora = datetime.utcnow()
+    tabla = TnMirrorStatus.__table__
+    tomado = db.session.execute(
+        update(tabla).where(
+            tabla.c.id == 1,
+            or_(tabla.c.last_refresh.is_(None), tabla.c.last_refresh < ahora - MIRROR_MAX_AGE),
+            or_(tabla.c.refreshing_since.is_(None), tabla.c.refreshing_since < ahora - REFRESH_TIMEOUT),
+        ).values(refreshing_since=ahora)
+    ).rowcount
+    db.session.commit()
+    return bool(tomado)
+
+
+def refresh_if_stale():
+    """
+    Si el espejo tiene más de MIRROR_MAX_AGE lanza un refresco incremental en un hilo
+    (sin esperarlo). Devuelve True si este worker lo lanzó.
+    """
+    if not _reclamar_refresco():
+        return False
+    app = current_app._get_current_object()
+
+    def tarea():
+        with app.app_context():
+            try:
+                refresh_catalog_mirror()
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️ No se pudo refrescar el espejo de TN en segundo plano: {e}")
+            finally:
+                tabla = TnMirrorStatus.__table__
+                db.session.execute(update(tabla).where(tabla.c.id == 1).values(refreshing_since=None))
+                db.session.commit()
+
+    threading.Thread(target=tarea, name='tn-mirror-refresh', daemon=True).start()
+    return True
+
+
+def registrar_stock(tn_variant_id, stock):
+    """Refleja en el espejo un stock que TN acaba de confirmar. No hace commit."""
+    TnCatalogMirror.query.filter_by(tn_variant_id=str(tn_variant_id)).update(
+        {"stock": stock, "synced_at": datetime.utcnow()}, synchronize_session=False
+    )
+
+
+def get_permalink(tn_product_id):
+    return db.session.query(TnCatalogMirror.permalink) \
+        .filter(TnCatalogMirror.tn_product_id == str(tn_product_id), TnCatalogMirror.permalink.isnot(None)) \
+        .limit(1).scalar()
+
+
+def mirror_status():
+    estado = read_status()
+    ultimo = estado.get('last_refresh')
+    return {
+        "variantes": db.session.query(db.func.count(TnCatalogMirror.id)).scalar(),
+        "ultimo_refresco": ultimo,
+        "ultimo_refresco_completo": estado.get('last_full_refresh'),
+        "antiguedad_segundos": int((datetime.utcnow() - datetime.fromisoformat(ultimo)).total_seconds()) if ultimo else None,
+        "refrescando": estado.get('refreshing', False),
+    }
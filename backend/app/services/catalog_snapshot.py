@@ -0,0 +1,183 @@
+# backend/app/services/catalog_snapshot.py
+"""
+Snapshot compacto del catálogo activo para las terminales del POS.
+
+En vez de recorrer GET /api/products página por página, la terminal baja una
+vez todo el catálogo activo (productos, variantes, precio y stock) en formato
+columnar (una lista por columna, sin repetir las claves en cada fila),
+comprimido con gzip. Después pide solo lo que cambió con `since_version=`
+y busca localmente.
+
+  - El snapshot completo se arma una vez por versión del catálogo y del stock
+    (services/catalog_version.py) y queda guardado, ya comprimido, en el worker.
+  - Cada producto tiene modificado_at, que se actualiza cuando cambia el producto
+    (onupdate), su stock (el UPDATE de stock_total, ver stock_totals.py) o sus
+    variantes (listener de abajo). Un delta devuelve los productos activos con
+    modificado_at posterior al token, más la lista completa de ids activos
+    (codificada como diferencias: comprimida ocupa muy poco) para que la
+    terminal descarte los que se borraron o se desactivaron.
+
+El token `version` incluye la hora del snapshot menos SINCE_MARGIN: una
+transacción que estampó filas antes de ese momento pero confirmó después no
+se pierde (en el peor caso, esas filas vienen repetidas en el próximo delta).
+"""
+import gzip
+import threading
+from datetime import datetime, timedelta
+from itertools import chain
+
+import orjson
+from sqlalchemy import event, inspect, update
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.products.models import Producto, ProductoVariante, Inventario, Categoria, CategoriaEspecifica
+from app.services.catalog_version import get_versions, cambio_visible
+
+# Margen hacia atrás del token (más que la transacción más larga que toca productos)
+SINCE_MARGIN = timedelta(minutes=2)
+
+COLUMNAS_PRODUCTO = ("id", "nombre", "precio", "stock_total", "categoria_id", "liga_id", "imagen")
+COLUMNAS_VARIANTE = ("id_variante", "id_producto", "talle", "estampa", "sku", "stock")
+
+
+class SnapshotInvalido(ValueError):
+    pass
+
+
+# --- Token ---
+_EPOCH = datetime(1970, 1, 1) # Las fechas son UTC naive: nada de .timestamp(), que asume hora local
+
+
+def _encode_token(versiones, desde):
+    ms = (desde - _EPOCH) // timedelta(milliseconds=1)
+    return f"{versiones['catalogo']}.{versiones['stock']}.{ms}"
+
+
+def _decode_token(token):
+    """Momento desde el que hay que mandar cambios."""
+    try:
+        catalogo, stock, ms = token.split('.')
+        int(catalogo), int(stock)
+        return _EPOCH + timedelta(milliseconds=int(ms))
+    except (ValueError, AttributeError, OverflowError, OSError):
+        raise SnapshotInvalido("since_version inválido. Pedí el snapshot completo de nuevo.")
+
+
+# --- Armado ---
+def _productos(desde=None):
+    q = db.select(Producto.id_producto, Producto.nombre, Producto.precio, Producto.stock_total,
+                  Producto.id_categoria, Producto.id_categoria_especifica, Producto.imagen) \
+        .where(Producto.activo == True).order_by(Producto.id_producto)
+    if desde is not None:
+        q = q.where(Producto.modificado_at >= desde)
+    columnas = {col: [] for col in COLUMNAS_PRODUCTO}
+    destinos = [columnas[col] for col in COLUMNAS_PRODUCTO]
+    for fila in db.session.execute(q):
+        for destino, valor in zip(destinos, fila):
+            destino.append(valor)
+    columnas["precio"] = [float(p) if p is not None else 0.0 for p in columnas["precio"]]
+    return columnas
+
+
+def _variantes(ids_producto, todas=False, chunk_size=1000):
+    q = db.select(ProductoVariante.id_variante, ProductoVariante.id_producto, ProductoVariante.talla,
+                  ProductoVariante.color, ProductoVariante.codigo_sku, Inventario.stock_actual) \
+        .outerjoin(Inventario, Inventario.id_variante == ProductoVariante.id_variante) \
+        .order_by(ProductoVariante.id_producto, ProductoVariante.id_variante)
+    if todas:
+        bloques = [q.join(Producto, Producto.id_producto == ProductoVariante.id_producto).where(Producto.activo == True)]
+    else:
+        bloques = [q.where(ProductoVariante.id_producto.in_(ids_producto[i:i + chunk_size]))
+                   for i in range(0, len(ids_producto), chunk_size)]
+
+    columnas = {col: [] for col in COLUMNAS_VARIANTE}
+    destinos = [columnas[col] for col in COLUMNAS_VARIANTE]
+    for stmt in bloques:
+        for fila in db.session.execute(stmt):
+            for destino, valor in zip(destinos, fila):
+                destino.append(valor)
+    columnas["stock"] = [s or 0 for s in columnas["stock"]]
+    return columnas
+
+
+def _ids_activos_delta():
+    """Ids activos ordenados, como diferencias con el anterior ([5, 6, 9] -> [5, 1, 3])."""
+    ids = db.session.execute(
+        db.select(Producto.id_producto).where(Producto.activo == True).order_by(Producto.id_producto)
+    ).scalars().all()
+    anterior, resultado = 0, []
+    for id_producto in ids:
+        resultado.append(id_producto - anterior)
+        anterior = id_producto
+    return resultado
+
+
+def _armar(versiones, desde=None):
+    ahora = datetime.utcnow()
+    productos = _productos(desde)
+    datos = {
+        "version": _encode_token(versiones, ahora - SINCE_MARGIN),
+        "full": desde is None,
+        "generated_at": ahora.isoformat(),
+        "categorias": {c.id_categoria: c.nombre for c in Categoria.query.all()},
+        "ligas": {c.id_categoria_especifica: c.nombre for c in CategoriaEspecifica.query.all()},
+        "productos": productos,
+        "variantes": _variantes(productos["id"], todas=desde is None),
+    }
+    if desde is not None:
+        datos["ids_activos_delta"] = _ids_activos_delta()
+    return gzip.compress(orjson.dumps(datos, option=orjson.OPT_NON_STR_KEYS), compresslevel=6)
+
+
+_cache_lock = threading.Lock()
+_cache_completo = {} # {(catalogo, stock): bytes gzip} (solo el último)
+
+
+def build_snapshot(since_version=None):
+    """Cuerpo gzip del snapshot completo (cacheado por versión) o del delta desde `since_version`."""
+    versiones = get_versions() # Antes de leer datos: el token nunca es más nuevo que lo que se mandó
+    if since_version:
+        return _armar(versiones, _decode_token(since_version))
+
+    clave = (versiones['catalogo'], versiones['stock'])
+    cuerpo = _cache_completo.get(clave)
+    if cuerpo is None:
+        cuerpo = _armar(versiones)
+        with _cache_lock:
+            _cache_completo.clear()
+            _cache_completo[clave] = cuerpo
+    return cuerpo
+
+
+# --- Listener: cambios de variantes estampan el producto ---
+@event.listens_for(Session, 'before_flush')
+def _registrar_cambios(session, flush_context, instances):
+    variantes = session.info.setdefault('snapshot_variantes', [])
+    for obj in chain(session.new, session.deleted, session.dirty):
+        if not isinstance(obj, ProductoVariante):
+            continue
+        if obj in session.dirty and not cambio_visible(obj):
+            continue
+        variantes.append(obj)
+        # Variante movida de producto: el anterior también cambió
+        variantes.extend(v for v in inspect(obj).attrs.id_producto.history.deleted if v)
+
+
+@event.listens_for(Session, 'after_flush')
+def _estampar_productos(session, flush_context):
+    variantes = session.info.pop('snapshot_variantes', None)
+    if not variantes:
+        return
+    ids = {v if isinstance(v, int) else v.id_producto for v in variantes}
+    ids.discard(None)
+    if ids:
+        tabla = Producto.__table__
+        session.connection().execute(
+            update(tabla).where(tabla.c.id_producto.in_(sorted(ids))).values(modificado_at=datetime.utcnow())
+        )
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_cambios(session):
+    session.info.pop('snapshot_variantes', None)
@@ -0,0 +1,235 @@
+# backend/app/services/catalog_version.py
+"""
+Versión del catálogo (tabla catalog_version) para responder 304 Not Modified.
+
+El POS y el inventario vuelven a pedir /api/products, las categorías y los
+métodos de pago cada vez que se abre una pantalla, aunque no haya cambiado
+nada. Ahora cada respuesta lleva un ETag débil armado con dos contadores:
+
+  - 'catalogo': productos, variantes, precios, categorías, ligas y métodos de pago.
+  - 'stock':    Inventario (ventas, devoluciones, compras, ajustes, webhooks).
+
+Si el navegador manda el mismo ETag en If-None-Match, la respuesta es un 304
+que cuesta una lectura por clave primaria, sin consultar ni serializar.
+Además cada worker guarda las últimas respuestas en un LRU indexado por
+(ETag, ruta, parámetros) y acotado a CACHE_TOTAL_BYTES: una página que ya armó
+otro usuario se devuelve tal cual.
+
+Los contadores los suben listeners de la sesión, DESPUÉS del commit y en una
+transacción aparte: así una fila "caliente" no serializa todas las ventas. Si
+alguien lee entre el commit y el bump, cachea datos nuevos con el ETag viejo,
+lo que solo cuesta una recarga de más cuando sube la versión.
+"""
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+from itertools import chain
+
+from flask import request, current_app
+from sqlalchemy import event, inspect, update, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.products.models import (
+    Producto, ProductoVariante, Categoria, CategoriaEspecifica, Inventario, CatalogVersion
+)
+from app.sales.models import MetodoPago
+
+SCOPES = ('catalogo', 'stock')
+
+# Qué modelo sube qué contador
+_SCOPE_DE = {
+    Producto: 'catalogo',
+    ProductoVariante: 'catalogo',
+    Categoria: 'catalogo',
+    CategoriaEspecifica: 'catalogo',
+    MetodoPago: 'catalogo',
+    Inventario: 'stock',
+}
+
+# Columnas que no se muestran en los listados: cambiarlas no invalida nada
+# (stock_total se mantiene aparte; tn_* los escribe el sync-worker en cada envío)
+_IGNORADAS = {
+    Producto: {'stock_total'},
+    ProductoVariante: {'tn_stock_sincronizado', 'tn_precio_sincronizado', 'tn_sincronizado_at'},
+}
+
+# UPDATE masivos que solo escriben columnas de _IGNORADAS (ej. el registro tn_* del sync-worker)
+# no invalidan nada si lo avisan: query.execution_options(**SIN_VERSION).update({...})
+SIN_VERSION = {'catalog_version': False}
+
+# Respuestas guardadas por worker: cantidad, tamaño máximo de cada una y total en memoria
+CACHE_SIZE = 64
+CACHE_MAX_BYTES = 512 * 1024
+CACHE_TOTAL_BYTES = 16 * 1024 * 1024
+
+
+# --- Contadores ---
+def get_versions(scopes=SCOPES):
+    """{scope: versión} leídos de la DB (0 si el scope todavía no tiene fila)."""
+    filas = db.session.query(CatalogVersion.scope, CatalogVersion.version) \
+        .filter(CatalogVersion.scope.in_(scopes)).all()
+    versiones = dict.fromkeys(scopes, 0)
+    versiones.update(filas)
+    return versiones
+
+
+def bump_version(*scopes, bind=None):
+    """Sube esos contadores en una transacción propia (no toma locks de la transacción del llamador)."""
+    tabla = CatalogVersion.__table__
+    motor = bind if bind is not None else db.engine
+    ahora = datetime.utcnow()
+    try:
+        with motor.begin() as conexion:
+            for scope in sorted(set(scopes)):
+                actualizadas = conexion.execute(
+                    update(tabla).where(tabla.c.scope == scope)
+                    .values(version=tabla.c.version + 1, updated_at=ahora)
+                ).rowcount
+                if not actualizadas:
+                    conexion.execute(insert(tabla).values(scope=scope, version=1, updated_at=ahora))
+    except IntegrityError:
+        pass # Otro worker creó la fila al mismo tiempo: ya hay una versión nueva
+    except Exception as e:
+        print(f"⚠️ No se pudo subir la versión del catálogo ({', '.join(scopes)}): {e}")
+
+
+def marcar_cambio(session, *scopes):
+    """Para escrituras con SQL directo (sin objetos en la sesión): sube esos contadores al confirmar."""
+    session.info.setdefault('catalog_version', set()).update(scopes)
+
+
+# --- Listeners ---
+def cambio_visible(obj):
+    ignoradas = _IGNORADAS.get(type(obj), ())
+    estado = inspect(obj)
+    return any(
+        attr.key not in ignoradas and estado.attrs[attr.key].history.has_changes()
+        for attr in estado.mapper.column_attrs
+    )
+
+
+@event.listens_for(Session, 'before_flush')
+def _registrar_cambios(session, flush_context, instances):
+    scopes = session.info.setdefault('catalog_version', set())
+    for obj in chain(session.new, session.deleted):
+        scope = _SCOPE_DE.get(type(obj))
+        if scope:
+            scopes.add(scope)
+    for obj in session.dirty:
+        scope = _SCOPE_DE.get(type(obj))
+        if scope and scope not in scopes and cambio_visible(obj):
+            scopes.add(scope)
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _registrar_masivos(orm_execute_state):
+    """UPDATE / DELETE masivos (query.update(), db.session.execute(update(Modelo)))."""
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    if not orm_execute_state.execution_options.get('catalog_version', True):
+        return # Avisó que solo toca columnas ignoradas (SIN_VERSION)
+    mapper = orm_execute_state.bind_mapper
+    scope = _SCOPE_DE.get(mapper.class_) if mapper is not None else None
+    if not scope:
+        return
+    if orm_execute_state.is_update and _solo_ignoradas(orm_execute_state.parameters, mapper):
+        return
+    orm_execute_state.session.info.setdefault('catalog_version', set()).add(scope)
+
+
+def _solo_ignoradas(parametros, mapper):
+    """
+    UPDATE por clave primaria (session.execute(update(Modelo), [{...}, ...])): ¿solo escribe
+    columnas ignoradas? Con otros UPDATE no se puede saber y se sube la versión.
+    """
+    if not isinstance(parametros, list) or not parametros:
+        return False
+    primarias = {columna.key for columna in mapper.primary_key}
+    columnas = {clave for fila in parametros for clave in fila} - primarias
+    return bool(columnas) and columnas <= _IGNORADAS.get(mapper.class_, set())
+
+
+@event.listens_for(Session, 'after_commit')
+def _subir_versiones(session):
+    scopes = session.info.pop('catalog_version', None)
+    if scopes:
+        bump_version(*scopes, bind=session.get_bind())
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_cambios(session):
+    session.info.pop('catalog_version', None)
+
+
+# --- Respuestas condicionales ---
+class _ResponseCache:
+    """LRU acotado por cantidad y por bytes (los listados grandes se comen la memoria del worker)."""
+
+    def __init__(self, size=CACHE_SIZE, max_bytes=CACHE_TOTAL_BYTES):
+        self.size = size
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self._bytes = 0
+
+    def get(self, clave):
+        with self._lock:
+            cuerpo = self._items.get(clave)
+            if cuerpo is not None:
+                self._items.move_to_end(clave)
+            return cuerpo
+
+    def put(self, clave, cuerpo):
+        with self._lock:
+            anterior = self._items.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= len(anterior)
+            self._items[clave] = cuerpo
+            self._bytes += len(cuerpo)
+            while self._items and (len(self._items) > self.size or self._bytes > self.max_bytes):
+                _, viejo = self._items.popitem(last=False)
+                self._bytes -= len(viejo)
+
+
+response_cache = _ResponseCache()
+
+
+def versioned(*scopes, cache=True):
+    """
+    Decorador para GETs que solo dependen de esos contadores: agrega el ETag,
+    contesta 304 si el cliente ya lo tiene y, con cache=True, reutiliza el
+    cuerpo ya serializado. Va debajo de @jwt_required().
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def envoltura(*args, **kwargs):
+            versiones = get_versions(scopes)
+            etag = '.'.join(f"{scope[0]}{versiones[scope]}" for scope in scopes)
+
+            if request.if_none_match.contains_weak(etag):
+                resp = current_app.response_class(status=304)
+                resp.set_etag(etag, weak=True)
+                resp.headers['Cache-Control'] = 'private, no-cache'
+                return resp
+
+            clave = (etag, request.path, tuple(sorted(request.args.items(multi=True))))
+            cuerpo = response_cache.get(clave) if cache else None
+            if cuerpo is not None:
+                resp = current_app.response_class(cuerpo, status=200, mimetype='application/json')
+            else:
+                resp = current_app.make_response(vista(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp # Errores y 400 no se cachean ni llevan ETag
+                if cache and resp.mimetype == 'application/json':
+                    cuerpo = resp.get_data()
+                    if len(cuerpo) <= CACHE_MAX_BYTES:
+                        response_cache.put(clave, cuerpo)
+
+            resp.set_etag(etag, weak=True)
+            resp.headers['Cache-Control'] = 'private, no-cache' # Siempre revalidar (con el ETag)
+            return resp
+        return envoltura
+    return decorador
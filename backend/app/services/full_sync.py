@@ -0,0 +1,133 @@
+# backend/app/services/full_sync.py
+"""
+Motor de la sincronización completa con Tienda Nube.
+
+Antes se recorría producto por producto esperando cada PUT, así que el tiempo
+total era la suma de todas las latencias (casi una hora para el catálogo).
+Ahora un pool acotado de hilos mantiene varios productos en vuelo a la vez y
+el que marca el ritmo es el rate limiter compartido de tn_service, no la red.
+
+Dentro de un producto el orden se respeta (datos base -> variantes nuevas ->
+stock/precio de las variantes), porque todo eso corre en el mismo hilo.
+Cada tarea abre su propio app context, y por lo tanto su propia sesión de DB.
+
+Por defecto es una sync "delta": sólo se tocan los productos con variantes
+cuyo stock/precio difiere de lo último confirmado por TN (ver sync_state.py).
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app.extensions import db
+from app.products.models import Producto, ProductoVariante
+from app.services.tiendanube_service import tn_service
+from app.services.sync_state import variantes_pendientes, marcar_sincronizada
+
+# Productos en vuelo a la vez. Más hilos no aceleran una vez alcanzado el límite de TN.
+SYNC_WORKERS = int(os.getenv('TN_SYNC_WORKERS', 4))
+
+
+def _sync_producto(app, id_producto, nombre, ids_variante=None):
+    """
+    Sincroniza UN producto. Devuelve (nombre, variantes_ok, error).
+    ids_variante=None es la sync forzada: datos base + TODAS las variantes.
+    Con una lista sólo se empujan esas variantes (las "sucias").
+    """
+    with app.app_context():
+        try:
+            prod = db.session.get(Producto, id_producto)
+            if not prod or not prod.tiendanube_id:
+                return nombre, 0, None
+
+            # 1. Actualizamos estructura y variantes nuevas (Vital para que no falle la estampa).
+            # En modo delta los datos base no se reenvían: editar el producto ya los sube.
+            if ids_variante is None:
+                tn_service.update_product_data(prod)
+            if any(not v.tiendanube_variant_id for v in prod.variantes) and tn_service.sync_missing_variants(prod):
+                # Guardamos los IDs de TN de las variantes recién creadas
+                db.session.commit()
+
+            # 2. Stock y precio de las variantes en un solo request por producto
+            variantes = {}
+            cambios = []
+            for var in prod.variantes:
+                if var.tiendanube_variant_id and (ids_variante is None or var.id_variante in ids_variante):
+                    stock_actual = var.inventario.stock_actual if var.inventario else 0
+                    variantes[str(var.tiendanube_variant_id)] = var
+                    cambios.append({"id": var.tiendanube_variant_id, "stock": stock_actual, "precio_local": prod.precio})
+
+            resultados = tn_service.update_product_variants(prod.tiendanube_id, cambios)
+            actualizados = 0
+            for c in cambios:
+                if resultados.get(str(c["id"])) is True:
+                    var = variantes[str(c["id"])]
+                    marcar_sincronizada(var, stock=c["stock"], precio_local=prod.precio)
+                    print(f"✅ TN Sync OK: {var.codigo_sku} -> Stock {c['stock']} | Precio Local Base: ${prod.precio}")
+                    actualizados += 1
+
+            db.session.commit()
+            return nombre, actualizados, None
+        except Exception as e:
+            db.session.rollback()
+            return nombre, 0, str(e)
+
+
+def _tareas_delta():
+    """(id_producto, nombre, ids_variante) sólo para productos con algo que empujar."""
+    tareas = {}
+    for var in variantes_pendientes():
+        _, _, ids = tareas.setdefault(var.id_producto, (var.id_producto, var.producto.nombre, set()))
+        ids.add(var.id_variante)
+
+    # Productos vinculados con variantes que todavía no existen en TN
+    sin_vincular = db.session.query(Producto.id_producto, Producto.nombre) \
+        .join(ProductoVariante, ProductoVariante.id_producto == Producto.id_producto) \
+        .filter(Producto.tiendanube_id.isnot(None), ProductoVariante.tiendanube_variant_id.is_(None)) \
+        .distinct().all()
+    for id_producto, nombre in sin_vincular:
+        tareas.setdefault(id_producto, (id_producto, nombre, set()))
+
+    return [tareas[k] for k in sorted(tareas)]
+
+
+def run_full_sync(app, on_progress=None, workers=None, forzar=False, should_stop=None):
+    """
+    Sincroniza con TN los productos vinculados. Por defecto sólo las variantes cuyo
+    stock/precio difiere de lo último confirmado; forzar=True reenvía todo el catálogo.
+    `on_progress(actual, total, nombre)` se llama desde el hilo que invoca esta función
+    (nunca desde los workers). Si `should_stop()` devuelve True se descartan los
+    productos que todavía no empezaron (los que están en vuelo terminan).
+    Devuelve (variantes_actualizadas, productos_con_error).
+    """
+    workers = workers or SYNC_WORKERS
+
+    with app.app_context():
+        if forzar:
+            productos = db.session.query(Producto.id_producto, Producto.nombre) \
+                .filter(Producto.tiendanube_id.isnot(None)).order_by(Producto.id_producto).all()
+            tareas = [(id_producto, nombre, None) for id_producto, nombre in productos]
+        else:
+            tareas = _tareas_delta()
+
+    total = len(tareas)
+    actualizados = 0
+    errores = 0
+    modo = "completa" if forzar else "delta"
+    print(f"🔄 [BACKGROUND] Iniciando Sync Masiva ({modo}) de {total} productos con Tienda Nube ({workers} en paralelo)...")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='tn-sync') as pool:
+        futuros = [pool.submit(_sync_producto, app, *tarea) for tarea in tareas]
+
+        for hechos, futuro in enumerate(as_completed(futuros), start=1):
+            nombre, ok, error = futuro.result()
+            actualizados += ok
+            if error:
+                errores += 1
+                print(f"❌ TN Sync Error en producto {nombre}: {error}")
+            if on_progress:
+                on_progress(hechos, total, nombre)
+            if should_stop and should_stop():
+                for pendiente in futuros:
+                    pendiente.cancel()
+                break
+
+    return actualizados, errores
@@ -0,0 +1,194 @@
+# backend/app/services/inventory.py
+"""
+Único punto para mover stock: ventas, reservas, anulaciones, cambios,
+compras, ajustes masivos y órdenes de Tienda Nube.
+
+Antes cada endpoint hacía `variante.inventario.stock_actual -= n` sobre el
+objeto ORM: leía el stock, restaba en Python y escribía el resultado. Con dos
+cajas y las órdenes web a la vez, dos transacciones podían leer el mismo
+valor y la segunda pisaba a la primera (stock que "aparece"), además de
+cargar las variantes de a una.
+
+ajustar_stock recibe todos los movimientos de la operación [(id_variante, delta)]
+y, dentro de la transacción del llamador:
+
+  1. Suma los deltas por variante y las procesa ordenadas por id: dos
+     operaciones que tocan las mismas variantes toman los locks en el mismo
+     orden y no se traban entre sí (deadlock).
+  2. Aplica cada una con un UPDATE condicional
+     `SET stock_actual = stock_actual - n WHERE stock_actual >= n`: la
+     verificación y el descuento son atómicos, sin leer antes.
+  3. Ajusta productos.stock_total (también ordenado por id), marca el cambio
+     de stock para catalog_version y encola la sync a Tienda Nube en lote.
+
+Si a alguna variante no le alcanza el stock lanza StockInsuficiente con el
+detalle de todas: el llamador hace rollback y no queda nada a medias. Las
+variantes sin fila de Inventario siguen sin control de stock (se venden sin
+chequear); un ingreso (compra, devolución) les crea la fila.
+"""
+from datetime import datetime
+
+from sqlalchemy import select, update, insert, func
+
+from app.extensions import db
+from app.products.models import Producto, ProductoVariante, Inventario
+from app.services.catalog_version import marcar_cambio
+from app.services.stock_sync_queue import enqueue_stock_syncs
+
+
+class StockInsuficiente(Exception):
+    def __init__(self, faltantes):
+        # [{"id_variante", "disponible", "pedido"}]
+        self.faltantes = faltantes
+        super().__init__(f"Stock insuficiente en {len(faltantes)} variante(s)")
+
+
+class VarianteInexistente(Exception):
+    def __init__(self, ids):
+        self.ids = ids
+        super().__init__(f"Variantes inexistentes: {', '.join(map(str, ids))}")
+
+
+def _productos_de(conexion, ids_variante, chunk_size=500):
+    producto_de = {}
+    for i in range(0, len(ids_variante), chunk_size):
+        filas = conexion.execute(
+            select(ProductoVariante.id_variante, ProductoVariante.id_producto)
+            .where(ProductoVariante.id_variante.in_(ids_variante[i:i + chunk_size]))
+        )
+        producto_de.update(dict(filas.all()))
+    return producto_de
+
+
+def _niveles(conexion, ids_variante, chunk_size=500):
+    niveles = {}
+    tabla = Inventario.__table__
+    for i in range(0, len(ids_variante), chunk_size):
+        filas = conexion.execute(
+            select(tabla.c.id_variante, tabla.c.stock_actual)
+            .where(tabla.c.id_variante.in_(ids_variante[i:i + chunk_size]))
+        )
+        for id_variante, stock in filas:
+            niveles.setdefault(id_variante, stock or 0)
+    return niveles
+
+
+def _expirar(session, ids_variante, ids_producto):
+    """Los objetos ya cargados en la sesión se releen (el UPDATE fue por SQL directo)."""
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Inventario) and obj.id_variante in ids_variante:
+            session.expire(obj, ['stock_actual'])
+        elif isinstance(obj, Producto) and obj.id_producto in ids_producto:
+            session.expire(obj, ['stock_total', 'modificado_at'])
+
+
+def ajustar_stock(movimientos, permitir_negativo=False, sincronizar=True, crear_inventario=True):
+    """
+    Aplica [(id_variante, delta)] en la transacción actual (no hace commit).
+    Devuelve {id_variante: stock nuevo}.
+
+    permitir_negativo: para órdenes de TN, que ya se vendieron (se registra la sobreventa).
+    Las variantes sin fila de Inventario no llevan control de stock: sus salidas se ignoran
+    (no se chequean ni descuentan) y un ingreso les crea la fila (con permitir_negativo,
+    cualquier movimiento). Las órdenes de TN ya filtran las variantes sin inventario.
+    sincronizar: encola el push a Tienda Nube (no hace falta para las órdenes que vienen de TN).
+    crear_inventario=False: las variantes sin inventario se saltean siempre (anulaciones y
+    cancelaciones: devuelven lo que la venta descontó, y a esas no se les descontó nada).
+    """
+    deltas = {}
+    for id_variante, delta in movimientos:
+        deltas[int(id_variante)] = deltas.get(int(id_variante), 0) + int(delta)
+    deltas = {v: d for v, d in deltas.items() if d}
+    if not deltas:
+        return {}
+
+    session = db.session()
+    session.flush() # Lo pendiente del llamador va primero (sus objetos de Inventario incluidos)
+    conexion = session.connection()
+    ids = sorted(deltas)
+
+    producto_de = _productos_de(conexion, ids)
+    inexistentes = [v for v in ids if v not in producto_de]
+    if inexistentes:
+        raise VarianteInexistente(inexistentes)
+
+    tabla = Inventario.__table__
+    stock = func.coalesce(tabla.c.stock_actual, 0)
+    faltantes = []
+    for id_variante in ids:
+        delta = deltas[id_variante]
+        stmt = update(tabla).where(tabla.c.id_variante == id_variante).values(stock_actual=stock + delta)
+        if delta < 0 and not permitir_negativo:
+            stmt = stmt.where(stock >= -delta)
+        if conexion.execute(stmt).rowcount:
+            continue
+
+        # No se actualizó nada: o no alcanza el stock o la variante no tiene fila de inventario
+        actual = conexion.execute(select(stock).where(tabla.c.id_variante == id_variante)).first()
+        if actual is not None:
+            faltantes.append({"id_variante": id_variante, "disponible": actual[0], "pedido": -delta})
+        elif crear_inventario and (delta > 0 or permitir_negativo):
+            # Ingreso (compra, devolución) o valor fijado de una variante sin inventario: se le crea la fila
+            conexion.execute(insert(tabla).values(id_variante=id_variante, stock_actual=delta))
+        else:
+            # Sin fila de inventario la variante no lleva control de stock: se vende sin
+            # chequear ni descontar, como siempre
+            del deltas[id_variante]
+
+    if faltantes:
+        raise StockInsuficiente(faltantes)
+    if not deltas:
+        return {}
+    ids = sorted(deltas)
+
+    deltas_producto = {}
+    for id_variante, delta in deltas.items():
+        id_producto = producto_de[id_variante]
+        deltas_producto[id_producto] = deltas_producto.get(id_producto, 0) + delta
+    productos = Producto.__table__
+    ahora = datetime.utcnow()
+    for id_producto in sorted(deltas_producto):
+        # Aunque la suma neta sea 0 (cambio de talle): modificado_at avisa al snapshot del catálogo
+        conexion.execute(
+            update(productos).where(productos.c.id_producto == id_producto)
+            .values(stock_total=productos.c.stock_total + deltas_producto[id_producto], modificado_at=ahora)
+        )
+
+    niveles = _niveles(conexion, ids)
+    _expirar(session, set(ids), set(deltas_producto))
+    marcar_cambio(session, 'stock')
+    if sincronizar:
+        enqueue_stock_syncs(niveles)
+    return niveles
+
+
+def fijar_stock(cantidades, sincronizar=True):
+    """
+    Deja el stock de cada variante en el valor dado ({id_variante: cantidad}, ej. ajustes
+    masivos o conteos). Bloquea las filas en orden, calcula la diferencia y la aplica
+    con ajustar_stock. Devuelve {id_variante: stock nuevo}.
+    """
+    cantidades = {int(v): int(c) for v, c in cantidades.items()}
+    if not cantidades:
+        return {}
+    db.session.flush()
+    ids = sorted(cantidades)
+    actuales = {}
+    for i in range(0, len(ids), 500):
+        filas = db.session.execute(
+            select(Inventario.id_variante, Inventario.stock_actual)
+            .where(Inventario.id_variante.in_(ids[i:i + 500]))
+            .order_by(Inventario.id_variante)
+            .with_for_update()
+        )
+        for id_variante, actual in filas:
+            actuales.setdefault(id_variante, actual or 0)
+
+    niveles = ajustar_stock(
+        [(v, cantidades[v] - actuales.get(v, 0)) for v in ids], permitir_negativo=True, sincronizar=False
+    )
+    # Sin diferencia no hay movimiento, pero igual se informa (y se sincroniza) el valor pedido
+    niveles = {v: niveles.get(v, cantidades[v]) for v in ids}
+    if sincronizar:
+        enqueue_stock_syncs(niveles)
+    return niveles
@@ -0,0 +1,93 @@
+# backend/app/services/order_backfill.py
+"""
+Recupera ventas web cuyos webhooks nunca llegaron (servidor caído, TN que
+dejó de reintentar): recorre las órdenes de Tienda Nube creadas desde una
+fecha e importa las que no están en tn_ordenes.
+
+Se trabaja de a una página de la API (hasta 200 órdenes): una consulta para
+saber cuáles ya están registradas, dos para resolver todas las variantes de
+la página (resolver_variantes), un descuento de stock por inventario y un
+solo commit. Si el commit choca con el índice único (el webhook registró una
+de esas órdenes mientras tanto) la página se reintenta orden por orden.
+"""
+from app.extensions import db
+from app.sales.models import OrdenTiendaNube
+from app.sales.webhooks import (
+    resolver_variantes, metodo_pago_tienda_nube, armar_venta_tienda_nube,
+    aplicar_descuentos, process_cloud_order, OrdenDuplicada
+)
+from app.services.tiendanube_service import tn_service
+from app.services.webhook_inbox import ORDER_FIELDS
+from sqlalchemy.exc import IntegrityError
+
+
+def _ya_registradas(order_ids):
+    return {fila[0] for fila in db.session.query(OrdenTiendaNube.tn_order_id)
+            .filter(OrdenTiendaNube.tn_order_id.in_(order_ids)).all()}
+
+
+def _importar_de_a_una(ordenes):
+    """Camino lento (solo tras un choque): cada orden en su propia transacción."""
+    importadas, duplicadas, errores = 0, 0, 0
+    for orden in ordenes:
+        try:
+            process_cloud_order(orden)
+            importadas += 1
+        except OrdenDuplicada:
+            duplicadas += 1
+        except Exception as e:
+            db.session.rollback()
+            errores += 1
+            print(f"❌ Backfill: no se pudo importar la orden #{orden.get('id')}: {e}")
+    return importadas, duplicadas, errores
+
+
+def _importar_pagina(ordenes):
+    """Importa en una sola transacción las órdenes de la página. Devuelve (importadas, duplicadas, errores)."""
+    metodo_nube = metodo_pago_tienda_nube()
+    por_tn_id, por_sku = resolver_variantes([item for orden in ordenes for item in orden.get('products', [])])
+
+    descuentos = {}
+    for orden in ordenes:
+        venta = armar_venta_tienda_nube(orden, metodo_nube, por_tn_id, por_sku, descuentos, verbose=False)
+        db.session.add(OrdenTiendaNube(tn_order_id=str(orden.get('id')), venta=venta))
+    aplicar_descuentos(descuentos)
+
+    try:
+        db.session.commit()
+        return len(ordenes), 0, 0
+    except IntegrityError:
+        db.session.rollback()
+        print("⚠️ Backfill: otra entrega registró una orden de esta página. Reintentando de a una...")
+        return _importar_de_a_una(ordenes)
+
+
+def backfill_orders(created_at_min):
+    """
+    Importa las órdenes de TN creadas desde `created_at_min` (datetime UTC) que no
+    estén registradas. Devuelve un resumen con lo revisado e importado.
+    """
+    resumen = {"revisadas": 0, "importadas": 0, "ya_registradas": 0, "errores": 0}
+
+    for pagina in tn_service.iter_order_pages(created_at_min, fields=ORDER_FIELDS):
+        resumen["revisadas"] += len(pagina)
+
+        # Una misma orden podría repetirse entre páginas si entra una nueva mientras paginamos
+        por_id = {}
+        for orden in pagina:
+            if orden.get('id'):
+                por_id.setdefault(str(orden['id']), orden)
+
+        registradas = _ya_registradas(list(por_id.keys()))
+        nuevas = [orden for order_id, orden in por_id.items() if order_id not in registradas]
+        resumen["ya_registradas"] += len(pagina) - len(nuevas)
+        if not nuevas:
+            continue
+
+        importadas, duplicadas, errores = _importar_pagina(nuevas)
+        resumen["importadas"] += importadas
+        resumen["ya_registradas"] += duplicadas
+        resumen["errores"] += errores
+        print(f"📥 Backfill de órdenes: {importadas} importadas en esta página ({resumen['revisadas']} revisadas)")
+
+    return resumen
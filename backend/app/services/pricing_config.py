@@ -0,0 +1,94 @@
+# backend/app/services/pricing_config.py
+"""
+Margen web (recargo de Tienda Nube sobre el precio local) cacheado en memoria.
+
+El margen vive en tn_config.json. Antes cada calcular_precio_web abría y
+parseaba el archivo: una corrida de margen sobre miles de variantes eran miles
+de lecturas de disco. Ahora se guarda en memoria y solo se relee si cambió el
+mtime del archivo, chequeándolo como mucho cada CHECK_INTERVAL segundos: un
+set_margen_web hecho en otro worker se ve en todos en ese plazo.
+"""
+import json
+import os
+import threading
+import time
+
+DEFAULT_MARGEN = 1.27
+
+# Cada cuánto se mira el mtime del archivo (demora máxima para ver un cambio de otro worker)
+CHECK_INTERVAL = 2.0
+
+
+class PricingConfig:
+    def __init__(self, config_file, default=DEFAULT_MARGEN, check_interval=CHECK_INTERVAL):
+        self.config_file = config_file
+        self.default = default
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._margen = None
+        self._mtime = None
+        self._ultimo_chequeo = 0.0
+
+    def _mtime_actual(self):
+        try:
+            return os.stat(self.config_file).st_mtime_ns
+        except OSError:
+            return None
+
+    def _leer(self):
+        """Lee el margen del archivo JSON. Si no existe, devuelve el default."""
+        try:
+            if os.path.exists(self.config_file):
+                with open(self.config_file, 'r') as f:
+                    data = json.load(f)
+                    return float(data.get('margen', self.default))
+        except Exception as e:
+            print(f"⚠️ Error leyendo archivo margen: {e}")
+        return self.default
+
+    def get_margen(self):
+        ahora = time.monotonic()
+        if self._margen is not None and ahora - self._ultimo_chequeo < self.check_interval:
+            return self._margen
+
+        with self._lock:
+            mtime = self._mtime_actual()
+            if self._margen is None or mtime != self._mtime:
+                self._margen = self._leer()
+                self._mtime = mtime
+            self._ultimo_chequeo = ahora
+        return self._margen
+
+    def set_margen(self, nuevo_margen):
+        """Guarda el margen (escritura atómica: nadie lee un archivo a medio escribir)."""
+        nuevo_margen = float(nuevo_margen)
+        tmp = f"{self.config_file}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump({'margen': nuevo_margen}, f)
+        os.replace(tmp, self.config_file)
+
+        with self._lock:
+            self._margen = nuevo_margen
+            self._mtime = self._mtime_actual()
+            self._ultimo_chequeo = time.monotonic()
+
+    def calcular_precio(self, precio_local):
+        if not precio_local: return 0.0
+        try:
+            return round(float(precio_local) * self.get_margen(), 2)
+        except (TypeError, ValueError):
+            return 0.0
+
+    def calcular_precios(self, precios_locales):
+        """Versión en lote: lee el margen una sola vez para toda la lista."""
+        margen = self.get_margen()
+        resultado = []
+        for precio_local in precios_locales:
+            if not precio_local:
+                resultado.append(0.0)
+                continue
+            try:
+                resultado.append(round(float(precio_local) * margen, 2))
+            except (TypeError, ValueError):
+                resultado.append(0.0)
+        return resultado
@@ -0,0 +1,321 @@
+# backend/app/services/product_search.py
+"""
+Índice de búsqueda de productos en memoria (trigramas), por worker.
+
+La búsqueda de /api/products hacía un ILIKE '%term%' sobre nombre, categoría
+y SKU con JOIN a variantes y GROUP BY: un scan completo de productos ×
+variantes en cada tecla del POS. Ahora cada producto se guarda como un texto
+normalizado (minúsculas y sin acentos: "Camión" encuentra "camion") con su
+nombre, categoría y SKUs, y un índice invertido de trigramas. Cada término
+de la búsqueda se resuelve intersectando los trigramas y confirmando la
+subcadena, y los términos se combinan con AND (mismo resultado que el ILIKE).
+
+Se mantiene al día así:
+  - Los cambios hechos en ESTE worker (alta/edición de productos, variantes o
+    categorías) se detectan con listeners de la sesión y se reindexan solo esos
+    productos en la próxima búsqueda.
+  - Los hechos en otros workers (o con UPDATE masivos) suben la versión del
+    catálogo (services/catalog_version.py): como mucho cada CHECK_INTERVAL
+    segundos se compara con la del índice y, si cambió, se reconstruye en un
+    hilo aparte. Cada INDEX_TTL se reconstruye igual, por las dudas.
+
+Las búsquedas leen un _Indice inmutable: las actualizaciones arman uno nuevo
+(copiando solo lo que cambia) y lo reemplazan bajo el lock.
+
+Si una búsqueda matchea más de MAX_RESULTADOS productos, el llamador filtra en
+SQL con filtro_sql, que compara contra las columnas normalizadas igual que acá.
+"""
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+from itertools import chain
+
+from flask import current_app
+from sqlalchemy import event, inspect, func, or_
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.products.models import Producto, ProductoVariante, Categoria
+from app.services.catalog_version import get_versions
+
+# Cada cuánto se mira la versión del catálogo (cambios de otros workers)
+CHECK_INTERVAL = 2.0
+
+# Reconstrucción completa aunque la versión no haya cambiado
+INDEX_TTL = 15 * 60
+
+# Si una búsqueda matchea más productos que esto, conviene filtrar en SQL (IN gigante)
+MAX_RESULTADOS = 2000
+
+# Separador entre campos: los términos no tienen espacios, así que no matchean entre campos
+_SEPARADOR = '\n'
+
+
+# Tabla de traducción para las letras acentuadas latinas (mucho más rápida que NFKD letra por letra)
+_SIN_ACENTOS = {}
+for _cp in range(0xC0, 0x250):
+    _base = ''.join(c for c in unicodedata.normalize('NFKD', chr(_cp)) if not unicodedata.combining(c))
+    if _base != chr(_cp):
+        _SIN_ACENTOS[_cp] = _base
+
+
+def normalizar(texto):
+    """Minúsculas y sin acentos ('Camión Ñandú' -> 'camion nandu')."""
+    texto = (texto or '').lower().translate(_SIN_ACENTOS)
+    if texto.isascii():
+        return texto
+    texto = unicodedata.normalize('NFKD', texto)
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+# Letras acentuadas que se sacan también en SQL: las del castellano, en minúscula y mayúscula (el LOWER
+# de SQLite solo convierte ASCII). Cada una es un REPLACE anidado, así que la lista se mantiene corta.
+_ACENTOS_SQL = {c: normalizar(c) for c in 'áéíóúüñÁÉÍÓÚÜÑ'}
+
+
+def normalizar_sql(columna):
+    """La misma normalización que normalizar(), como expresión SQL."""
+    expresion = func.lower(columna)
+    for letra, base in _ACENTOS_SQL.items():
+        expresion = func.replace(expresion, letra, base)
+    return expresion
+
+
+def filtro_sql(search, *columnas):
+    """
+    Condiciones para query.filter(): cada término en alguna de las columnas, sin acentos ni
+    mayúsculas (el mismo resultado que el índice, para las búsquedas con demasiados resultados).
+    """
+    return [
+        or_(*(normalizar_sql(columna).contains(termino, autoescape=True) for columna in columnas))
+        for termino in {normalizar(t) for t in search.split()}
+    ]
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class _Indice:
+    """Datos inmutables de una versión del índice: se arma uno nuevo y se reemplaza bajo el lock."""
+    __slots__ = ('docs', 'trigramas')
+
+    def __init__(self, docs, trigramas):
+        self.docs = docs            # id_producto -> texto normalizado
+        self.trigramas = trigramas  # trigrama -> frozenset(id_producto)
+
+
+class ProductSearchIndex:
+
+    def __init__(self, ttl=INDEX_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._indice = None
+        self._version = None
+        self._construido_at = None
+        self._ultimo_chequeo = 0.0
+        self._reconstruyendo = False
+        self._pendientes = set()
+        self._reaplicar = set()  # Reindexados mientras corría una reconstrucción (su carga puede ser vieja)
+
+    # --- Carga desde la DB ---
+    def _cargar(self, ids=None, chunk_size=500):
+        """Textos de los productos (todos, o solo `ids`) con consultas de columnas, sin objetos ORM."""
+        nombres, skus = {}, {}
+        bloques = [None] if ids is None else [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+
+        for bloque in bloques:
+            q = db.session.query(Producto.id_producto, Producto.nombre, Categoria.nombre) \
+                .outerjoin(Categoria, Categoria.id_categoria == Producto.id_categoria)
+            q_skus = db.session.query(ProductoVariante.id_producto, ProductoVariante.codigo_sku) \
+                .filter(ProductoVariante.codigo_sku.isnot(None))
+            if bloque is not None:
+                q = q.filter(Producto.id_producto.in_(bloque))
+                q_skus = q_skus.filter(ProductoVariante.id_producto.in_(bloque))
+
+            for id_producto, nombre, categoria in q:
+                nombres[id_producto] = (nombre, categoria)
+            for id_producto, sku in q_skus:
+                skus.setdefault(id_producto, []).append(sku)
+
+        return {
+            id_producto: normalizar(_SEPARADOR.join([nombre or '', categoria or ''] + skus.get(id_producto, [])))
+            for id_producto, (nombre, categoria) in nombres.items()
+        }
+
+    def reconstruir(self):
+        """Arma el índice completo y lo reemplaza de una vez (las búsquedas en curso usan el viejo)."""
+        inicio = time.monotonic()
+        version = get_versions(('catalogo',))['catalogo'] # Antes de leer: si algo cambia mientras tanto, nace viejo
+        docs = self._cargar()
+        trigramas = defaultdict(set)
+        for id_producto, texto in docs.items():
+            for tri in _trigramas(texto):
+                trigramas[tri].add(id_producto)
+        indice = _Indice(docs, {tri: frozenset(ids) for tri, ids in trigramas.items()})
+
+        with self._lock:
+            self._indice, self._version = indice, version
+            self._construido_at = inicio
+            self._pendientes |= self._reaplicar
+            self._reaplicar = set()
+        print(f"🔎 Índice de búsqueda: {len(docs)} productos indexados en {time.monotonic() - inicio:.2f}s (catálogo v{version})")
+
+    def _reconstruir_en_segundo_plano(self, app):
+        with self._lock:
+            if self._reconstruyendo:
+                return
+            self._reconstruyendo = True
+
+        def tarea():
+            try:
+                with app.app_context():
+                    self.reconstruir()
+            except Exception as e:
+                print(f"⚠️ Error reconstruyendo el índice de búsqueda: {e}")
+            finally:
+                self._reconstruyendo = False
+
+        threading.Thread(target=tarea, daemon=True).start()
+
+    def _aplicar_pendientes(self):
+        """Reindexa los productos tocados en este worker sobre una copia y la publica (copy-on-write)."""
+        with self._lock:
+            ids, self._pendientes = list(self._pendientes), set()
+            if self._reconstruyendo:
+                self._reaplicar.update(ids)
+        if not ids:
+            return
+        cargados = self._cargar(ids)
+        with self._lock:
+            anterior = self._indice
+            docs = dict(anterior.docs)
+            cambios = defaultdict(lambda: [set(), set()])  # trigrama -> [ids a sacar, ids a agregar]
+            for id_producto in ids:
+                texto = docs.pop(id_producto, None)
+                if texto is not None:
+                    for tri in _trigramas(texto):
+                        cambios[tri][0].add(id_producto)
+                if id_producto in cargados:
+                    docs[id_producto] = cargados[id_producto]
+                    for tri in _trigramas(cargados[id_producto]):
+                        cambios[tri][1].add(id_producto)
+
+            # Solo se copian los conjuntos de los trigramas tocados; el resto se comparte con el anterior
+            trigramas = dict(anterior.trigramas)
+            for tri, (sacar, agregar) in cambios.items():
+                ids_tri = (trigramas.get(tri, frozenset()) - sacar) | agregar
+                if ids_tri:
+                    trigramas[tri] = frozenset(ids_tri)
+                else:
+                    trigramas.pop(tri, None)
+            self._indice = _Indice(docs, trigramas)
+
+    def _asegurar_vigente(self):
+        if self._construido_at is None or self._indice is None:
+            self.reconstruir()
+            return
+        self._aplicar_pendientes()
+        ahora = time.monotonic()
+        if ahora - self._ultimo_chequeo < CHECK_INTERVAL:
+            return
+        self._ultimo_chequeo = ahora
+        # Cambios de otros workers o UPDATE masivos: los delata la versión del catálogo
+        if ahora - self._construido_at > self.ttl or get_versions(('catalogo',))['catalogo'] != self._version:
+            self._reconstruir_en_segundo_plano(current_app._get_current_object())
+
+    # --- API ---
+    def invalidar(self, ids_producto):
+        """Reindexa esos productos en la próxima búsqueda."""
+        with self._lock:
+            self._pendientes |= set(ids_producto)
+
+    def invalidar_todo(self):
+        """Fuerza una reconstrucción completa en la próxima búsqueda (ej: se renombró una categoría)."""
+        with self._lock:
+            self._construido_at = None
+
+    def buscar(self, search, limite=MAX_RESULTADOS):
+        """
+        IDs de los productos que contienen TODOS los términos (en nombre, categoría o SKU).
+        Devuelve None si son más de `limite` (el llamador filtra en SQL con filtro_sql).
+        """
+        terminos = sorted({normalizar(t) for t in search.split()}, key=len, reverse=True)
+        if not terminos:
+            return None
+        self._asegurar_vigente()
+
+        with self._lock:
+            indice = self._indice # Una versión fija: las actualizaciones publican otra, nunca la modifican
+        docs, trigramas = indice.docs, indice.trigramas
+        resultado = None
+        for termino in terminos:
+            if len(termino) >= 3:
+                posting = sorted((trigramas.get(tri, frozenset()) for tri in _trigramas(termino)), key=len)
+                candidatos = set(posting[0]).intersection(*posting[1:]) if posting else set()
+                if resultado is not None:
+                    candidatos &= resultado
+            else:
+                # Términos de 1-2 letras: se filtran sobre lo que ya quedó (o sobre todo)
+                candidatos = resultado if resultado is not None else docs.keys()
+
+            resultado = {i for i in candidatos if termino in docs.get(i, '')}
+            if not resultado:
+                return set()
+
+        if len(resultado) > limite:
+            return None
+        return resultado
+
+
+search_index = ProductSearchIndex()
+
+
+def buscar_productos(search, limite=MAX_RESULTADOS):
+    return search_index.buscar(search, limite)
+
+
+# --- Listeners: cambios hechos en este worker ---
+def _cambio(obj, *campos):
+    estado = inspect(obj)
+    return any(estado.attrs[campo].history.has_changes() for campo in campos)
+
+
+@event.listens_for(Session, 'after_flush')
+def _registrar_cambios(session, flush_context):
+    ids = set()
+    todo = False
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Producto):
+            if obj in session.dirty and not _cambio(obj, 'nombre', 'id_categoria'):
+                continue
+            ids.add(obj.id_producto)
+        elif isinstance(obj, ProductoVariante):
+            if obj in session.dirty and not _cambio(obj, 'codigo_sku', 'id_producto'):
+                continue
+            ids.add(obj.id_producto)
+            # Si la variante cambió de producto, el anterior también pierde el SKU
+            ids.update(v for v in inspect(obj).attrs.id_producto.history.deleted if v)
+        elif isinstance(obj, Categoria):
+            todo = True
+
+    if ids:
+        session.info.setdefault('busqueda_productos', set()).update(i for i in ids if i is not None)
+    if todo:
+        session.info['busqueda_todo'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _aplicar_cambios(session):
+    ids = session.info.pop('busqueda_productos', None)
+    if session.info.pop('busqueda_todo', False):
+        search_index.invalidar_todo()
+    elif ids:
+        search_index.invalidar(ids)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_cambios(session):
+    session.info.pop('busqueda_productos', None)
+    session.info.pop('busqueda_todo', None)
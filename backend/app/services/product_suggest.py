@@ -0,0 +1,317 @@
+# backend/app/services/product_suggest.py
+"""
+Sugerencias de búsqueda (type-ahead) con un índice de prefijos en memoria, por worker.
+
+El buscador del POS pedía GET /api/products?search= en cada tecla: JOINs,
+GROUP BY, COUNT de la paginación y serialización completa, solo para mostrar
+cinco sugerencias. /api/products/suggest responde desde una lista ORDENADA de
+claves normalizadas (sin acentos, minúsculas) y busca el prefijo con bisect:
+O(log n) más el rango que matchea, sin tocar la DB.
+
+Claves indexadas:
+  - Productos activos: el nombre desde cada palabra ("camiseta boca 2024",
+    "boca 2024", "2024"), así "boca 20" encuentra "Camiseta Boca 2024".
+  - SKUs de sus variantes.
+  - Categorías y ligas (CategoriaEspecifica).
+
+Orden: coincidencia al principio del texto, después categorías/ligas, productos
+y SKUs, y dentro de cada grupo los más vendidos (ranking_ventas). Para prefijos
+de hasta 3 letras (rangos enormes) el top ya viene calculado; para los más
+largos se ordenan como mucho MAX_SCAN entradas (el presupuesto de latencia).
+
+Se mantiene al día por partes: como mucho cada CHECK_INTERVAL segundos se mira
+la versión del catálogo y, si cambió, un hilo aparte reindexa solo los
+productos con modificado_at reciente (services/catalog_snapshot.py) y saca los
+que ya no están activos. Cada REBUILD_INTERVAL se rearma todo (ranking al día).
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+from heapq import nsmallest
+from datetime import datetime
+
+from flask import current_app
+
+from app.extensions import db
+from app.products.models import Producto, ProductoVariante, Categoria, CategoriaEspecifica, RankingVenta
+from app.services.catalog_snapshot import SINCE_MARGIN
+from app.services.catalog_version import get_versions
+from app.services.product_search import normalizar
+
+CHECK_INTERVAL = 2.0
+REBUILD_INTERVAL = 15 * 60
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+
+# Entradas que se miran como máximo para un prefijo (los de hasta 3 letras usan el top precalculado)
+MAX_SCAN = 1000
+PREFIJO_CORTO = 3
+
+# Peso por tipo: categorías/ligas primero (son pocas y sirven de filtro), después productos y SKUs
+_PESO = {'categoria': 0, 'liga': 0, 'producto': 1, 'sku': 2}
+
+
+class _Indice:
+    """Datos inmutables de una versión del índice (las búsquedas nunca ven uno a medio armar)."""
+    __slots__ = ('entradas', 'items', 'claves', 'cortos', 'populares')
+
+    def __init__(self, entradas, items, claves, cortos, populares):
+        self.entradas = entradas   # [(clave, posición, tipo, id)] ordenada
+        self.items = items         # (tipo, id) -> (dict de respuesta, puntaje base)
+        self.claves = claves       # (tipo, id) -> [entradas] (para sacarlas al reindexar)
+        self.cortos = cortos       # prefijo corto -> [(tipo, id)] ya ordenado
+        self.populares = populares # id_producto -> (unidades_30d, unidades_total)
+
+
+def _claves_nombre(texto):
+    """El texto normalizado desde el comienzo de cada palabra, con la posición de la palabra."""
+    palabras = normalizar(texto).split()
+    return [(' '.join(palabras[i:]), i) for i in range(len(palabras))]
+
+
+def _puntaje(tipo, id_, texto, populares):
+    vendidos_30d, vendidos_total = populares.get(id_, (0, 0)) if tipo in ('producto', 'sku') else (0, 0)
+    return (_PESO[tipo], -vendidos_30d, -vendidos_total, len(texto or ''))
+
+
+class ProductSuggestIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indice = None
+        self._version = None
+        self._desde = None          # Hora (UTC) de la última carga: se reindexan los modificados después
+        self._construido_at = 0.0
+        self._ultimo_chequeo = 0.0
+        self._actualizando = False
+
+    # --- Carga ---
+    def _cargar_productos(self, desde=None):
+        q = db.select(Producto.id_producto, Producto.nombre, Producto.precio, Producto.imagen) \
+            .where(Producto.activo == True)
+        if desde is not None:
+            q = q.where(Producto.modificado_at >= desde)
+        productos = {id_: (nombre, precio, imagen) for id_, nombre, precio, imagen in db.session.execute(q)}
+
+        skus = {}
+        ids = list(productos)
+        bloques = [None] if desde is None else [ids[i:i + 500] for i in range(0, len(ids), 500)]
+        for bloque in bloques:
+            q = db.select(ProductoVariante.id_variante, ProductoVariante.id_producto, ProductoVariante.codigo_sku) \
+                .where(ProductoVariante.codigo_sku.isnot(None))
+            if bloque is not None:
+                q = q.where(ProductoVariante.id_producto.in_(bloque))
+            for id_variante, id_producto, sku in db.session.execute(q):
+                if id_producto in productos:
+                    skus.setdefault(id_producto, []).append((id_variante, sku))
+        return productos, skus
+
+    def _items_de_producto(self, id_producto, datos, skus):
+        """[((tipo, id), dict, [(clave, posición)])] del producto y sus SKUs."""
+        nombre, precio, imagen = datos
+        items = [(('producto', id_producto), {
+            "tipo": "producto", "id": id_producto, "texto": nombre,
+            "precio": float(precio) if precio is not None else 0.0, "imagen": imagen
+        }, _claves_nombre(nombre))]
+        for id_variante, sku in skus:
+            items.append((('sku', id_variante), {
+                "tipo": "sku", "id": id_producto, "id_variante": id_variante, "texto": sku, "producto": nombre
+            }, [(normalizar(sku), 0)]))
+        return items
+
+    def _items_de_referencias(self):
+        items = []
+        for tipo, modelo, columna_id in (('categoria', Categoria, Categoria.id_categoria),
+                                         ('liga', CategoriaEspecifica, CategoriaEspecifica.id_categoria_especifica)):
+            for id_, nombre in db.session.execute(db.select(columna_id, modelo.nombre)):
+                items.append(((tipo, id_), {"tipo": tipo, "id": id_, "texto": nombre}, _claves_nombre(nombre)))
+        return items
+
+    def _populares(self):
+        return {
+            id_producto: (u30 or 0, total or 0)
+            for id_producto, u30, total in db.session.execute(
+                db.select(RankingVenta.id_producto, RankingVenta.unidades_30d, RankingVenta.unidades_total)
+            )
+        }
+
+    # --- Armado ---
+    @staticmethod
+    def _agregar(entradas, items, claves, clave_item, respuesta, claves_texto, populares, ordenada):
+        tipo, id_ = clave_item
+        id_producto = respuesta["id"]
+        items[clave_item] = (respuesta, _puntaje(tipo, id_producto, respuesta["texto"], populares))
+        propias = []
+        for texto, posicion in claves_texto:
+            if not texto:
+                continue
+            entrada = (texto, posicion, tipo, id_)
+            propias.append(entrada)
+            if ordenada:
+                insort(entradas, entrada)
+            else:
+                entradas.append(entrada)
+        claves[clave_item] = propias
+        return propias
+
+    @staticmethod
+    def _sacar(entradas, items, claves, clave_item):
+        propias = claves.pop(clave_item, [])
+        for entrada in propias:
+            i = bisect_left(entradas, entrada)
+            if i < len(entradas) and entradas[i] == entrada:
+                del entradas[i]
+        items.pop(clave_item, None)
+        return propias
+
+    @staticmethod
+    def _mejores(candidatos, items, limite):
+        """candidatos: (tipo, id) -> ¿matcheó solo a mitad del texto? Los `limite` mejores, en orden."""
+        return nsmallest(limite, candidatos, key=lambda k: (candidatos[k],) + items[k][1])
+
+    @classmethod
+    def _calcular_cortos(cls, entradas, items):
+        """Top de cada prefijo corto (en esos rangos MAX_SCAN no alcanza para ordenar bien)."""
+        buckets = {}
+        for texto, posicion, tipo, id_ in entradas:
+            medio = posicion > 0
+            for largo in range(1, min(PREFIJO_CORTO, len(texto)) + 1):
+                bucket = buckets.setdefault(texto[:largo], {})
+                if not medio or (tipo, id_) not in bucket:
+                    bucket[(tipo, id_)] = medio
+        return {prefijo: cls._mejores(bucket, items, MAX_LIMIT) for prefijo, bucket in buckets.items()}
+
+    @classmethod
+    def _recalcular_cortos(cls, cortos, entradas, items, prefijos):
+        """Rehace solo el top de esos prefijos (los tocados por una actualización)."""
+        for prefijo in prefijos:
+            bucket = {}
+            i = bisect_left(entradas, (prefijo,))
+            while i < len(entradas) and entradas[i][0].startswith(prefijo):
+                _, posicion, tipo, id_ = entradas[i]
+                if posicion == 0 or (tipo, id_) not in bucket:
+                    bucket[(tipo, id_)] = posicion > 0
+                i += 1
+            if bucket:
+                cortos[prefijo] = cls._mejores(bucket, items, MAX_LIMIT)
+            else:
+                cortos.pop(prefijo, None)
+
+    def reconstruir(self):
+        inicio = time.monotonic()
+        version = get_versions(('catalogo',))['catalogo']
+        desde = datetime.utcnow()
+        populares = self._populares()
+        productos, skus = self._cargar_productos()
+
+        entradas, items, claves = [], {}, {}
+        for id_producto, datos in productos.items():
+            for clave_item, respuesta, claves_texto in self._items_de_producto(id_producto, datos, skus.get(id_producto, [])):
+                self._agregar(entradas, items, claves, clave_item, respuesta, claves_texto, populares, ordenada=False)
+        for clave_item, respuesta, claves_texto in self._items_de_referencias():
+            self._agregar(entradas, items, claves, clave_item, respuesta, claves_texto, populares, ordenada=False)
+        entradas.sort()
+
+        indice = _Indice(entradas, items, claves, self._calcular_cortos(entradas, items), populares)
+        with self._lock:
+            self._indice, self._version, self._desde = indice, version, desde
+            self._construido_at = time.monotonic()
+        print(f"💡 Índice de sugerencias: {len(entradas)} claves en {time.monotonic() - inicio:.2f}s (catálogo v{version})")
+
+    def actualizar(self):
+        """Reindexa solo los productos modificados desde la última carga (copia y reemplaza)."""
+        anterior = self._indice
+        version = get_versions(('catalogo',))['catalogo']
+        desde = datetime.utcnow()
+        productos, skus = self._cargar_productos(self._desde - SINCE_MARGIN)
+        activos = set(db.session.execute(db.select(Producto.id_producto).where(Producto.activo == True)).scalars())
+
+        entradas, items = list(anterior.entradas), dict(anterior.items)
+        claves = {k: list(v) for k, v in anterior.claves.items()}
+        populares = anterior.populares
+
+        tocadas = []
+        # Productos reindexados, borrados o desactivados: fuera todas sus entradas (producto y SKUs)
+        for clave_item in [k for k in claves if k[0] in ('producto', 'sku')]:
+            id_producto = items[clave_item][0]["id"]
+            if id_producto in productos or id_producto not in activos:
+                tocadas += self._sacar(entradas, items, claves, clave_item)
+        for clave_item in [k for k in claves if k[0] in ('categoria', 'liga')]:
+            tocadas += self._sacar(entradas, items, claves, clave_item)
+
+        for id_producto, datos in productos.items():
+            for clave_item, respuesta, claves_texto in self._items_de_producto(id_producto, datos, skus.get(id_producto, [])):
+                tocadas += self._agregar(entradas, items, claves, clave_item, respuesta, claves_texto, populares, ordenada=True)
+        for clave_item, respuesta, claves_texto in self._items_de_referencias():
+            tocadas += self._agregar(entradas, items, claves, clave_item, respuesta, claves_texto, populares, ordenada=True)
+
+        cortos = dict(anterior.cortos)
+        prefijos = {texto[:largo] for texto, *_ in tocadas for largo in range(1, min(PREFIJO_CORTO, len(texto)) + 1)}
+        self._recalcular_cortos(cortos, entradas, items, prefijos)
+
+        indice = _Indice(entradas, items, claves, cortos, populares)
+        with self._lock:
+            self._indice, self._version, self._desde = indice, version, desde
+        print(f"💡 Índice de sugerencias: {len(productos)} productos reindexados (catálogo v{version})")
+
+    def _actualizar_en_segundo_plano(self, completo):
+        with self._lock:
+            if self._actualizando:
+                return
+            self._actualizando = True
+        app = current_app._get_current_object()
+
+        def tarea():
+            try:
+                with app.app_context():
+                    self.reconstruir() if completo else self.actualizar()
+            except Exception as e:
+                print(f"⚠️ Error actualizando el índice de sugerencias: {e}")
+            finally:
+                self._actualizando = False
+
+        threading.Thread(target=tarea, daemon=True).start()
+
+    def _asegurar_vigente(self):
+        if self._indice is None:
+            self.reconstruir()
+            return
+        ahora = time.monotonic()
+        if ahora - self._ultimo_chequeo < CHECK_INTERVAL:
+            return
+        self._ultimo_chequeo = ahora
+        if ahora - self._construido_at > REBUILD_INTERVAL:
+            self._actualizar_en_segundo_plano(completo=True)
+        elif get_versions(('catalogo',))['catalogo'] != self._version:
+            self._actualizar_en_segundo_plano(completo=False)
+
+    # --- API ---
+    def sugerir(self, texto, limite=DEFAULT_LIMIT):
+        prefijo = ' '.join(normalizar(texto).split())
+        if not prefijo:
+            return []
+        self._asegurar_vigente()
+        indice = self._indice
+
+        if len(prefijo) <= PREFIJO_CORTO:
+            return [indice.items[k][0] for k in indice.cortos.get(prefijo, [])[:limite]]
+
+        candidatos = {}
+        entradas = indice.entradas
+        i = bisect_left(entradas, (prefijo,))
+        fin = min(len(entradas), i + MAX_SCAN)
+        while i < fin and entradas[i][0].startswith(prefijo):
+            _, posicion, tipo, id_ = entradas[i]
+            if posicion == 0 or (tipo, id_) not in candidatos:
+                candidatos[(tipo, id_)] = posicion > 0
+            i += 1
+
+        return [indice.items[k][0] for k in self._mejores(candidatos, indice.items, limite)]
+
+
+suggest_index = ProductSuggestIndex()
+
+
+def sugerir_productos(texto, limite=DEFAULT_LIMIT):
+    return suggest_index.sugerir(texto, min(max(limite, 1), MAX_LIMIT))
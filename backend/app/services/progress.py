@@ -0,0 +1,154 @@
+# backend/app/services/progress.py
+"""
+Progreso de procesos largos (sync completa, actualización de margen) guardado
+en la tabla sync_progress en vez de archivos JSON en el temp del servidor.
+
+Con varios workers (o varios servidores) cada uno tenía su propio temp, así que
+el estado que veía React dependía de a qué worker le tocaba el request. Ahora
+todos leen la misma fila, el "ya hay uno corriendo" se resuelve con un UPDATE
+condicional (atómico) y las escrituras del loop se limitan a una por segundo.
+
+Cada corrida tiene un run_id: si el usuario cancela o el proceso quedó trabado
+y otra corrida toma el lugar, las escrituras de la corrida vieja no pisan nada.
+"""
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db
+from app.products.models import SyncProgress
+
+JOBS = ('full_sync', 'margen')
+
+# Si un proceso "corriendo" no escribe nada en este tiempo, se lo da por muerto
+STALE_AFTER = timedelta(minutes=10)
+
+ESTADO_VACIO = {"is_running": False, "current": 0, "total": 0, "message": "", "errores": 0}
+
+
+def _serializar(fila):
+    if fila is None:
+        return dict(ESTADO_VACIO)
+    return {
+        "is_running": bool(fila.is_running),
+        "current": fila.current or 0,
+        "total": fila.total or 0,
+        "message": fila.message or "",
+        "errores": fila.errores or 0
+    }
+
+
+def get_progress(job):
+    """Estado actual del proceso (mismo formato que los viejos archivos JSON)."""
+    return _serializar(db.session.get(SyncProgress, job))
+
+
+def request_cancel(job, message="Proceso cancelado por el usuario."):
+    """
+    Pide la cancelación y libera el "lock" ya mismo, para que el usuario pueda
+    iniciar otro proceso sin esperar a que la corrida vieja lo note (o aunque
+    haya quedado trabada tras un reinicio del servidor).
+    """
+    SyncProgress.query.filter_by(job=job).update(
+        {"cancel_requested": True, "is_running": False, "message": message, "updated_at": datetime.utcnow()},
+        synchronize_session=False
+    )
+    db.session.commit()
+
+
+class ProgressReporter:
+    """
+    Escribe el progreso de UNA corrida. Cada escritura usa su propio app context
+    (y por lo tanto su propia sesión), así que puede llamarse desde cualquier hilo
+    sin mezclarse con la transacción del proceso que reporta.
+    """
+
+    def __init__(self, app, job, min_interval=1.0):
+        self.app = app
+        self.job = job
+        self.min_interval = min_interval
+        self.run_id = uuid.uuid4().hex
+        self._ultima_escritura = 0.0
+        self._ultimo_chequeo = 0.0
+        self._cancelado = False
+
+    def claim(self, message="Preparando..."):
+        """Toma el proceso si no hay otro corriendo. Devuelve False si ya hay uno en curso."""
+        with self.app.app_context():
+            if db.session.get(SyncProgress, self.job) is None:
+                try:
+                    db.session.add(SyncProgress(job=self.job, is_running=False, cancel_requested=False))
+                    db.session.commit()
+                except IntegrityError:
+                    db.session.rollback() # Otro worker la creó al mismo tiempo
+
+            ahora = datetime.utcnow()
+            tomadas = SyncProgress.query.filter(
+                SyncProgress.job == self.job,
+                or_(SyncProgress.is_running == False, SyncProgress.updated_at < ahora - STALE_AFTER)
+            ).update({
+                "run_id": self.run_id,
+                "is_running": True,
+                "cancel_requested": False,
+                "current": 0,
+                "total": 0,
+                "errores": 0,
+                "message": message[:255],
+                "started_at": ahora,
+                "updated_at": ahora
+            }, synchronize_session=False)
+            db.session.commit()
+        self._ultima_escritura = time.monotonic()
+        return tomadas == 1
+
+    def _write(self, valores, final=False):
+        valores["updated_at"] = datetime.utcnow()
+        with self.app.app_context():
+            query = SyncProgress.query.filter_by(job=self.job, run_id=self.run_id)
+            if not final:
+                # Tras una cancelación no volvemos a pisar el mensaje con "Actualizando..."
+                query = query.filter(SyncProgress.cancel_requested == False)
+            escritas = query.update(valores, synchronize_session=False)
+            db.session.commit()
+        if not escritas:
+            # Otra corrida tomó el lugar: dejamos de reportar y el proceso debería cortar
+            self._cancelado = True
+        self._ultima_escritura = time.monotonic()
+
+    def update(self, current, total=None, message=None, errores=None, force=False):
+        """Guarda el avance, como mucho una vez cada min_interval (salvo force)."""
+        if not force and time.monotonic() - self._ultima_escritura < self.min_interval:
+            return
+        valores = {"current": current}
+        if total is not None:
+            valores["total"] = total
+        if message is not None:
+            valores["message"] = message[:255]
+        if errores is not None:
+            valores["errores"] = errores
+        self._write(valores)
+
+    def finish(self, message, current=None, total=None, errores=None):
+        valores = {"is_running": False, "message": message[:255]}
+        if current is not None:
+            valores["current"] = current
+        if total is not None:
+            valores["total"] = total
+        if errores is not None:
+            valores["errores"] = errores
+        self._write(valores, final=True)
+
+    def cancelled(self):
+        """True si el usuario pidió cancelar (se consulta la DB como mucho una vez por min_interval)."""
+        if self._cancelado:
+            return True
+        if time.monotonic() - self._ultimo_chequeo < self.min_interval:
+            return False
+        self._ultimo_chequeo = time.monotonic()
+        with self.app.app_context():
+            fila = db.session.get(SyncProgress, self.job)
+            self._cancelado = fila is None or fila.run_id != self.run_id or bool(fila.cancel_requested)
+        return self._cancelado
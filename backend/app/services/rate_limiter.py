@@ -0,0 +1,169 @@
+# backend/app/services/rate_limiter.py
+"""
+Rate limiter compartido (token bucket) para la API de Tienda Nube.
+
+TN aplica un "leaky bucket" por tienda: ~40 requests de ráfaga que se
+vacían a ~2 req/seg. Ese presupuesto es UNO solo para toda la instalación,
+pero cada worker de gunicorn, cada hilo de sync y el worker de la cola
+tenían su propio contador en memoria, así que bajo carga igual llovían 429.
+
+El estado del bucket vive en un archivo JSON protegido con un file lock
+(filelock), de modo que todos los procesos del mismo servidor comparten el
+mismo presupuesto. Además, después de cada respuesta se leen los headers
+x-rate-limit-* de TN para corregir el estado con el dato real del servidor.
+
+SUPONE UN SOLO HOST: web, sync-worker, webhook-worker y rank (Procfile) corren
+en la misma máquina y ven el mismo directorio temporal. Si algún día se
+reparten en varios servidores o contenedores sin un /tmp común, cada uno tendrá
+su propio bucket y entre todos pueden pasarse del límite de TN (vuelven los
+429, que penalize() igual amortigua). En ese caso el estado tiene que pasar a
+un almacén compartido (ej. una fila en la DB con SELECT ... FOR UPDATE o
+Redis); no alcanza con apuntar state_dir a un disco de red, porque los file
+locks no son confiables sobre NFS.
+"""
+import json
+import os
+import tempfile
+import time
+
+from filelock import FileLock
+
+# Segundos de historial que se usan para calcular requests/seg
+STATS_WINDOW = 60
+
+
+class SharedTokenBucket:
+    """Token bucket compartido entre los procesos de ESTE servidor (ver la nota de un solo host arriba)."""
+
+    def __init__(self, name, capacity=40, refill_rate=2.0, state_dir=None):
+        state_dir = state_dir or tempfile.gettempdir()
+        self.state_file = os.path.join(state_dir, f"{name}_bucket.json")
+        self.lock = FileLock(self.state_file + ".lock")
+        self.default_capacity = capacity
+        self.default_refill_rate = refill_rate
+
+    # ------------------------------------------
+    # Estado compartido (siempre con el lock tomado)
+    # ------------------------------------------
+    def _load(self):
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault('capacity', self.default_capacity)
+        state.setdefault('refill_rate', self.default_refill_rate)
+        state.setdefault('tokens', float(state['capacity']))
+        state.setdefault('updated', time.time())
+        state.setdefault('blocked_until', 0)
+        state.setdefault('hits', {})
+        return state
+
+    def _save(self, state):
+        tmp = self.state_file + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_file)
+
+    def _refill(self, state, now):
+        elapsed = max(0.0, now - state['updated'])
+        state['tokens'] = min(float(state['capacity']), state['tokens'] + elapsed * state['refill_rate'])
+        state['updated'] = now
+
+    def _register_hit(self, state, now):
+        segundo = str(int(now))
+        hits = {k: v for k, v in state['hits'].items() if now - int(k) < STATS_WINDOW}
+        hits[segundo] = hits.get(segundo, 0) + 1
+        state['hits'] = hits
+
+    # ------------------------------------------
+    # API pública
+    # ------------------------------------------
+    def acquire(self):
+        """Bloquea hasta que haya un token disponible en el bucket compartido."""
+        while True:
+            with self.lock:
+                state = self._load()
+                now = time.time()
+                self._refill(state, now)
+
+                if now >= state['blocked_until'] and state['tokens'] >= 1:
+                    state['tokens'] -= 1
+                    self._register_hit(state, now)
+                    self._save(state)
+                    return
+
+                espera_bloqueo = state['blocked_until'] - now
+                espera_token = (1 - state['tokens']) / state['refill_rate']
+                self._save(state)
+
+            time.sleep(max(espera_bloqueo, espera_token, 0.01))
+
+    def update_from_headers(self, headers):
+        """
+        Ajusta el bucket con lo que informa TN:
+          x-rate-limit-limit      tamaño del bucket
+          x-rate-limit-remaining  requests que quedan antes del 429
+          x-rate-limit-reset      ms hasta que el bucket se vacía del todo
+        Con remaining y reset se deduce la velocidad real de drenaje.
+        """
+        try:
+            limit = int(headers.get('x-rate-limit-limit'))
+            remaining = int(headers.get('x-rate-limit-remaining'))
+        except (TypeError, ValueError):
+            return
+        try:
+            reset_ms = int(headers.get('x-rate-limit-reset'))
+        except (TypeError, ValueError):
+            reset_ms = None
+
+        with self.lock:
+            state = self._load()
+            self._refill(state, time.time())
+            state['capacity'] = limit
+            # El servidor manda: nunca creemos tener más margen del que dice TN
+            state['tokens'] = min(state['tokens'], float(remaining))
+
+            usados = limit - remaining
+            if reset_ms and usados > 0:
+                tasa = usados / (reset_ms / 1000.0)
+                # Acotamos para que un header raro no nos frene del todo ni nos desboque
+                state['refill_rate'] = min(max(tasa, 0.5), 10.0)
+            self._save(state)
+
+    def penalize(self, retry_after=None):
+        """Tras un 429: vaciamos el bucket y frenamos a TODOS los procesos un rato."""
+        try:
+            espera = float(retry_after) if retry_after is not None else None
+        except (TypeError, ValueError):
+            espera = None
+
+        with self.lock:
+            state = self._load()
+            if espera is None:
+                espera = state['capacity'] / state['refill_rate'] / 4
+            state['tokens'] = 0.0
+            state['updated'] = time.time()
+            state['blocked_until'] = max(state['blocked_until'], time.time() + espera)
+            self._save(state)
+
+    def stats(self):
+        with self.lock:
+            state = self._load()
+            now = time.time()
+            self._refill(state, now)
+
+        hits = {int(k): v for k, v in state['hits'].items() if now - int(k) < STATS_WINDOW}
+        if hits:
+            ventana = max(now - min(hits), 1.0)
+            rps = sum(hits.values()) / ventana
+        else:
+            rps = 0.0
+
+        return {
+            "requests_per_sec": round(rps, 2),
+            "tokens_disponibles": round(state['tokens'], 2),
+            "capacidad": state['capacity'],
+            "tasa_recarga": round(state['refill_rate'], 2),
+            "bloqueado_por_seg": round(max(0.0, state['blocked_until'] - now), 2)
+        }
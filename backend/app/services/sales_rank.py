@@ -0,0 +1,182 @@
+# backend/app/services/sales_rank.py
+"""
+Ranking de ventas por producto (tabla ranking_ventas): unidades vendidas en
+total y en los últimos 30 y 90 días.
+
+El orden "más vendidos" del listado sumaba TODO detalles_ventas (con JOIN a
+variantes) en cada página. Ahora se une contra esta tabla, una fila por
+producto.
+
+Se mantiene igual que productos.stock_total (ver stock_totals.py): listeners
+de la sesión anotan los DetalleVenta que se crean (venta, retiro de reserva,
+webhook de TN) o se borran (anulación) y, tras el flush, suman la diferencia
+con un upsert por producto, dentro de la misma transacción.
+
+Las ventanas de 30/90 días no pueden "vencer" solas: las ventas que salen de
+la ventana se descuentan al reconstruir la tabla (`flask sales-rank-rebuild`),
+que el proceso `rank` del Procfile corre cada RANK_REBUILD_INTERVAL.
+
+ventas.fecha_venta se guarda en hora de Argentina (UTC-3, ver ahora_argentina en
+sales/routes.py): las ventanas se miden con esa misma hora, no con la del servidor.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, inspect, select, insert, update, case, func
+from sqlalchemy.dialects import mysql, sqlite, postgresql
+from sqlalchemy.orm import Session
+
+from app.extensions import db
+from app.products.models import ProductoVariante, RankingVenta
+from app.sales.models import DetalleVenta, Venta
+from app.services.catalog_version import bump_version
+
+VENTANAS = (30, 90)
+
+# Cada cuánto se reconstruye la tabla para que las ventas viejas salgan de las ventanas
+RANK_REBUILD_INTERVAL = timedelta(hours=6)
+
+
+def ahora_argentina():
+    return datetime.utcnow() - timedelta(hours=3)
+
+
+def _fecha_venta(session, detalle):
+    """Fecha de la venta del detalle si ya está en memoria; si no, se asume ahora (venta recién hecha)."""
+    venta = detalle.__dict__.get('venta')
+    if venta is None and detalle.id_venta is not None:
+        venta = session.identity_map.get(inspect(Venta).identity_key_from_primary_key((detalle.id_venta,)))
+    return getattr(venta, 'fecha_venta', None) or ahora_argentina()
+
+
+@event.listens_for(Session, 'before_flush')
+def _registrar_cambios(session, flush_context, instances):
+    cambios = session.info.setdefault('ranking_ventas', [])
+    for obj in session.new:
+        if isinstance(obj, DetalleVenta):
+            cambios.append((obj, None, obj.cantidad or 0, _fecha_venta(session, obj)))
+
+    for obj in session.deleted:
+        if isinstance(obj, DetalleVenta) and obj.id_variante is not None:
+            cambios.append((None, obj.id_variante, -(obj.cantidad or 0), _fecha_venta(session, obj)))
+
+    for obj in session.dirty:
+        if not isinstance(obj, DetalleVenta):
+            continue
+        estado = inspect(obj)
+        hist_cant = estado.attrs.cantidad.history
+        hist_var = estado.attrs.id_variante.history
+        if not hist_cant.has_changes() and not hist_var.has_changes():
+            continue
+        cant_vieja = (hist_cant.deleted or hist_cant.unchanged or [0])[0] or 0
+        var_vieja = (hist_var.deleted or hist_var.unchanged or [None])[0]
+        fecha = _fecha_venta(session, obj)
+        if var_vieja is not None:
+            cambios.append((None, var_vieja, -cant_vieja, fecha))
+        cambios.append((obj, None, obj.cantidad or 0, fecha))
+
+
+def _upsert(conexion, id_producto, deltas):
+    """Suma los deltas a la fila del producto (la crea si no existe) en una sola sentencia."""
+    tabla = RankingVenta.__table__
+    valores = {"id_producto": id_producto, "updated_at": datetime.utcnow(), **deltas}
+    dialecto = conexion.dialect.name
+
+    if dialecto == 'mysql':
+        stmt = mysql.insert(tabla).values(**valores)
+        stmt = stmt.on_duplicate_key_update(
+            updated_at=stmt.inserted.updated_at,
+            **{col: tabla.c[col] + stmt.inserted[col] for col in deltas}
+        )
+    elif dialecto in ('sqlite', 'postgresql'):
+        dialect_insert = sqlite.insert if dialecto == 'sqlite' else postgresql.insert
+        stmt = dialect_insert(tabla).values(**valores)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['id_producto'],
+            set_={"updated_at": stmt.excluded.updated_at, **{col: tabla.c[col] + stmt.excluded[col] for col in deltas}}
+        )
+    else:
+        actualizadas = conexion.execute(
+            update(tabla).where(tabla.c.id_producto == id_producto)
+            .values(updated_at=valores["updated_at"], **{col: tabla.c[col] + val for col, val in deltas.items()})
+        ).rowcount
+        if actualizadas:
+            return
+        stmt = insert(tabla).values(**valores)
+    conexion.execute(stmt)
+
+
+@event.listens_for(Session, 'after_flush')
+def _aplicar_cambios(session, flush_context):
+    cambios = session.info.pop('ranking_ventas', None)
+    if not cambios:
+        return
+
+    ahora = ahora_argentina()
+    por_variante = {}
+    for detalle, id_variante, cantidad, fecha in cambios:
+        if detalle is not None:
+            id_variante = detalle.id_variante # Las filas nuevas recién tienen IDs después del flush
+        if id_variante is None or not cantidad:
+            continue
+        deltas = por_variante.setdefault(id_variante, {"unidades_total": 0, "unidades_30d": 0, "unidades_90d": 0})
+        deltas["unidades_total"] += cantidad
+        for dias in VENTANAS:
+            if fecha >= ahora - timedelta(days=dias):
+                deltas[f"unidades_{dias}d"] += cantidad
+
+    if not por_variante:
+        return
+
+    conexion = session.connection()
+    ids_variante = list(por_variante)
+    producto_de = {}
+    for i in range(0, len(ids_variante), 500):
+        filas = conexion.execute(
+            select(ProductoVariante.id_variante, ProductoVariante.id_producto)
+            .where(ProductoVariante.id_variante.in_(ids_variante[i:i + 500]))
+        )
+        producto_de.update({id_variante: id_producto for id_variante, id_producto in filas})
+
+    por_producto = {}
+    for id_variante, deltas in por_variante.items():
+        id_producto = producto_de.get(id_variante)
+        if id_producto is None:
+            continue
+        acumulado = por_producto.setdefault(id_producto, {"unidades_total": 0, "unidades_30d": 0, "unidades_90d": 0})
+        for col, val in deltas.items():
+            acumulado[col] += val
+
+    # Mismo orden en todas las transacciones para no trabarse entre sí
+    for id_producto in sorted(por_producto):
+        if any(por_producto[id_producto].values()):
+            _upsert(conexion, id_producto, por_producto[id_producto])
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_cambios(session):
+    session.info.pop('ranking_ventas', None)
+
+
+def rebuild_sales_rank():
+    """Recalcula toda la tabla desde detalles_ventas. Devuelve la cantidad de productos con ventas."""
+    ahora = ahora_argentina()
+    columnas = [
+        ProductoVariante.id_producto,
+        func.sum(DetalleVenta.cantidad),
+        *[func.sum(case((Venta.fecha_venta >= ahora - timedelta(days=dias), DetalleVenta.cantidad), else_=0))
+          for dias in VENTANAS],
+        db.literal(datetime.utcnow(), db.DateTime)
+    ]
+    origen = select(*columnas) \
+        .join(ProductoVariante, ProductoVariante.id_variante == DetalleVenta.id_variante) \
+        .join(Venta, Venta.id_venta == DetalleVenta.id_venta) \
+        .group_by(ProductoVariante.id_producto)
+
+    tabla = RankingVenta.__table__
+    db.session.execute(tabla.delete())
+    db.session.execute(tabla.insert().from_select(
+        ['id_producto', 'unidades_total', 'unidades_30d', 'unidades_90d', 'updated_at'], origen
+    ))
+    db.session.commit()
+    bump_version('stock') # Cambia el orden "más vendidos" del listado
+    return db.session.query(func.count(RankingVenta.id_producto)).scalar()
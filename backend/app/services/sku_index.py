@@ -0,0 +1,175 @@
+# backend/app/services/sku_index.py
+"""
+Índice en memoria SKU / id de variante -> datos fijos de la variante, por worker.
+
+Cada pitido del lector de códigos llamaba a /sales/scan: consulta por SKU,
+a veces otra por id, y después lazy-load de inventario y producto (3-4 idas
+a la DB por escaneo). Ahora nombre, talle, estampa y precio salen de un
+diccionario, y la DB se consulta una sola vez por clave primaria para traer
+el stock VIGENTE junto con la versión del catálogo (services/catalog_version.py).
+
+Si esa versión no es la del índice (alguien editó productos en cualquier
+worker) ese escaneo se resuelve en la DB como antes y el índice se reconstruye
+en un hilo aparte: nunca se devuelve un precio o un nombre viejo.
+"""
+import threading
+import time
+from typing import NamedTuple
+
+from flask import current_app
+
+from app.extensions import db
+from app.products.models import Producto, ProductoVariante, Inventario, CatalogVersion
+
+# Máximo de códigos por /scan/batch
+MAX_BATCH = 1000
+
+
+class VarianteScan(NamedTuple):
+    id_variante: int
+    sku: str
+    nombre: str
+    talle: str
+    estampa: str
+    precio: float
+
+
+def _columnas():
+    return (ProductoVariante.id_variante, ProductoVariante.codigo_sku, Producto.nombre,
+            ProductoVariante.talla, ProductoVariante.color, Producto.precio)
+
+
+def _a_scan(fila):
+    id_variante, sku, nombre, talla, color, precio = fila
+    return VarianteScan(id_variante, sku, nombre, talla, color, float(precio) if precio is not None else 0.0)
+
+
+def _version_catalogo():
+    return db.session.execute(
+        db.select(CatalogVersion.version).where(CatalogVersion.scope == 'catalogo')
+    ).scalar() or 0
+
+
+def _stock_y_version(ids_variante, chunk_size=500):
+    """({id_variante: stock}, versión del catálogo) en una sola ida a la DB (por bloque)."""
+    version_sq = db.select(CatalogVersion.version).where(CatalogVersion.scope == 'catalogo').scalar_subquery()
+    stock, version = {}, None
+    for i in range(0, len(ids_variante), chunk_size):
+        filas = db.session.execute(
+            db.select(Inventario.id_variante, Inventario.stock_actual, version_sq)
+            .where(Inventario.id_variante.in_(ids_variante[i:i + chunk_size]))
+        )
+        for id_variante, cantidad, ver in filas:
+            stock.setdefault(id_variante, cantidad or 0)
+            version = ver
+    if version is None:
+        version = _version_catalogo() # Ninguna variante con fila de inventario
+    return stock, version or 0
+
+
+def buscar_en_db(codigos, chunk_size=500):
+    """{código: VarianteScan} resolviendo en la DB: primero por SKU exacto, después por id interno."""
+    encontrados = {}
+    codigos = list(dict.fromkeys(codigos))
+    for i in range(0, len(codigos), chunk_size):
+        bloque = codigos[i:i + chunk_size]
+        filas = db.session.execute(
+            db.select(*_columnas()).join(Producto, Producto.id_producto == ProductoVariante.id_producto)
+            .where(ProductoVariante.codigo_sku.in_(bloque))
+        )
+        for fila in filas:
+            encontrados[fila[1]] = _a_scan(fila)
+
+    por_id = {int(c): c for c in codigos if c not in encontrados and c.isdigit()}
+    ids = list(por_id)
+    for i in range(0, len(ids), chunk_size):
+        filas = db.session.execute(
+            db.select(*_columnas()).join(Producto, Producto.id_producto == ProductoVariante.id_producto)
+            .where(ProductoVariante.id_variante.in_(ids[i:i + chunk_size]))
+        )
+        for fila in filas:
+            encontrados[por_id[fila[0]]] = _a_scan(fila)
+    return encontrados
+
+
+class SkuIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._por_sku = {}
+        self._por_id = {}
+        self._version = None
+        self._reconstruyendo = False
+
+    def reconstruir(self):
+        inicio = time.monotonic()
+        version = _version_catalogo() # Antes de leer: si algo cambia mientras tanto, el índice nace viejo
+        por_sku, por_id = {}, {}
+        filas = db.session.execute(
+            db.select(*_columnas()).join(Producto, Producto.id_producto == ProductoVariante.id_producto)
+        )
+        for fila in filas:
+            scan = _a_scan(fila)
+            por_id[scan.id_variante] = scan
+            if scan.sku:
+                por_sku[scan.sku] = scan
+        with self._lock:
+            self._por_sku, self._por_id, self._version = por_sku, por_id, version
+        print(f"🏷️ Índice de SKUs: {len(por_id)} variantes en {time.monotonic() - inicio:.2f}s (catálogo v{version})")
+
+    def _reconstruir_en_segundo_plano(self):
+        with self._lock:
+            if self._reconstruyendo:
+                return
+            self._reconstruyendo = True
+        app = current_app._get_current_object()
+
+        def tarea():
+            try:
+                with app.app_context():
+                    self.reconstruir()
+            except Exception as e:
+                print(f"⚠️ Error reconstruyendo el índice de SKUs: {e}")
+            finally:
+                self._reconstruyendo = False
+
+        threading.Thread(target=tarea, daemon=True).start()
+
+    def _buscar(self, codigo):
+        scan = self._por_sku.get(codigo)
+        if scan is None and codigo.isdigit():
+            scan = self._por_id.get(int(codigo))
+        return scan
+
+    def resolver(self, codigos):
+        """
+        [(código, VarianteScan | None, stock)] en el mismo orden que `codigos`.
+        Cuesta una consulta (stock + versión) si el índice está al día.
+        """
+        if self._version is None:
+            self.reconstruir()
+
+        encontrados = {c: self._buscar(c) for c in codigos}
+        ids = list({scan.id_variante for scan in encontrados.values() if scan is not None})
+        stock, version = _stock_y_version(ids) if ids else ({}, _version_catalogo())
+
+        if version != self._version:
+            # Catálogo cambiado desde que se armó el índice: esta vez se resuelve en la DB
+            self._reconstruir_en_segundo_plano()
+            desde_db = buscar_en_db(codigos)
+            encontrados = {c: desde_db.get(c) for c in codigos}
+            faltan = [scan.id_variante for scan in desde_db.values() if scan.id_variante not in stock]
+            if faltan:
+                stock.update(_stock_y_version(faltan)[0])
+
+        return [
+            (c, encontrados[c], stock.get(encontrados[c].id_variante, 0) if encontrados[c] else None)
+            for c in codigos
+        ]
+
+
+sku_index = SkuIndex()
+
+
+def scan_codes(codigos):
+    return sku_index.resolver(codigos)
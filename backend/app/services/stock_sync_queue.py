@@ -0,0 +1,239 @@
+# backend/app/services/stock_sync_queue.py
+"""
+Cola persistente (outbox) para empujar stock a Tienda Nube.
+
+Los endpoints que mueven stock NO llaman a la API: agregan una fila a
+sync_queue dentro de la MISMA transacción que la venta/devolución/ajuste.
+Si la transacción hace rollback, la tarea desaparece con ella; si hace
+commit, la tarea queda guardada aunque gunicorn recicle el worker.
+
+Un proceso aparte (`flask sync-worker`) drena la tabla en lotes, con
+reintentos, backoff exponencial y estado 'failed' al agotar los intentos.
+
+Las ráfagas se colapsan por tn_variant_id (gana la última escritura): una
+tarea nueva espera COALESCE_WINDOW antes de enviarse, las ventas que llegan
+mientras tanto agregan sus propias filas y el worker reclama todas las
+pendientes de esa variante juntas, y al enviar se lee el stock VIGENTE
+de Inventario en vez del valor capturado al encolar. Así tres ventas del
+mismo talle en un minuto terminan en un solo PUT con el valor correcto.
+
+Encolar siempre inserta (nunca reutiliza una fila existente): una fila leída
+sin lock puede estar siendo enviada por el worker en ese momento, y una que
+está en backoff le heredaría la espera a la venta nueva.
+"""
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.products.models import SyncQueue, Inventario, Producto, ProductoVariante
+from app.services.tiendanube_service import tn_service
+from app.services.catalog_mirror import registrar_stock
+from app.services.catalog_version import SIN_VERSION
+
+MAX_RETRIES = 8
+COALESCE_WINDOW = timedelta(seconds=5)
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 30 * 60
+
+# Si un worker muere a mitad de un lote, sus filas quedan en 'processing'.
+# Pasado este tiempo se consideran abandonadas y vuelven a 'pending'.
+PROCESSING_TIMEOUT = timedelta(minutes=5)
+
+# Las tareas completadas se conservan un tiempo para poder auditar.
+COMPLETED_RETENTION = timedelta(days=7)
+
+
+def enqueue_stock_sync(variante):
+    """
+    Agenda el push del stock actual de la variante. No hace commit: la fila
+    viaja en la transacción del llamador. Las tareas pendientes de la misma
+    variante de TN se colapsan al reclamarlas (ver _reclamar_lote).
+    Devuelve la tarea o None si la variante no está vinculada a Tienda Nube.
+    """
+    producto = variante.producto
+    if not variante.tiendanube_variant_id or not producto or not producto.tiendanube_id:
+        return None
+
+    tarea = SyncQueue(
+        tn_product_id=str(producto.tiendanube_id),
+        tn_variant_id=str(variante.tiendanube_variant_id),
+        id_variante=variante.id_variante,
+        new_stock=variante.inventario.stock_actual if variante.inventario else 0,
+        status='pending',
+        retries=0,
+        next_attempt_at=datetime.utcnow() + COALESCE_WINDOW
+    )
+    db.session.add(tarea)
+    return tarea
+
+
+def enqueue_stock_syncs(niveles, chunk_size=500):
+    """
+    Versión en lote de enqueue_stock_sync para {id_variante: stock} (ver services/inventory.py):
+    una consulta para saber cuáles están vinculadas a TN y una fila nueva por cada una.
+    """
+    tareas = []
+    ids = sorted(niveles)
+    ahora = datetime.utcnow()
+    for i in range(0, len(ids), chunk_size):
+        filas = db.session.query(
+            ProductoVariante.id_variante, ProductoVariante.tiendanube_variant_id, Producto.tiendanube_id
+        ).join(Producto, Producto.id_producto == ProductoVariante.id_producto) \
+            .filter(ProductoVariante.id_variante.in_(ids[i:i + chunk_size]))
+        for id_variante, tn_variant_id, tn_product_id in filas:
+            if tn_variant_id and tn_product_id:
+                tareas.append(SyncQueue(
+                    tn_product_id=str(tn_product_id),
+                    tn_variant_id=str(tn_variant_id),
+                    id_variante=id_variante,
+                    new_stock=niveles[id_variante],
+                    status='pending',
+                    retries=0,
+                    next_attempt_at=ahora + COALESCE_WINDOW
+                ))
+    db.session.add_all(tareas)
+    return tareas
+
+
+def _backoff(retries):
+    segundos = BACKOFF_BASE_SECONDS * (2 ** max(retries - 1, 0))
+    return timedelta(seconds=min(segundos, BACKOFF_MAX_SECONDS))
+
+
+def _recuperar_abandonadas():
+    limite = datetime.utcnow() - PROCESSING_TIMEOUT
+    return SyncQueue.query.filter(
+        SyncQueue.status == 'processing',
+        SyncQueue.updated_at < limite
+    ).update({"status": "pending"}, synchronize_session=False)
+
+
+def _reclamar_lote(batch_size):
+    """
+    Marca un lote de tareas vencidas como 'processing' y las devuelve
+    agrupadas por tn_variant_id: {tn_variant_id: [tareas...]}.
+
+    También se reclaman las otras pendientes de esas mismas variantes aunque
+    todavía no les toque: como al enviar se lee el stock vigente, quedan
+    cubiertas por el mismo PUT.
+
+    SKIP LOCKED permite correr más de un worker sin que se pisen (en motores
+    que no lo soportan, SQLAlchemy simplemente omite el FOR UPDATE).
+    """
+    ahora = datetime.utcnow()
+    vencidas = SyncQueue.query.filter(
+        SyncQueue.status == 'pending',
+        SyncQueue.next_attempt_at <= ahora
+    ).order_by(SyncQueue.id).limit(batch_size).with_for_update(skip_locked=True).all()
+
+    grupos = {}
+    for tarea in vencidas:
+        grupos.setdefault(tarea.tn_variant_id, []).append(tarea)
+
+    if grupos:
+        ya_reclamadas = {t.id for t in vencidas}
+        hermanas = SyncQueue.query.filter(
+            SyncQueue.status == 'pending',
+            SyncQueue.tn_variant_id.in_(list(grupos.keys()))
+        ).with_for_update(skip_locked=True).all()
+        for tarea in hermanas:
+            if tarea.id not in ya_reclamadas:
+                grupos[tarea.tn_variant_id].append(tarea)
+
+    for tareas in grupos.values():
+        for tarea in tareas:
+            tarea.status = 'processing'
+    db.session.commit()
+    return grupos
+
+
+def _stock_vigente(tareas):
+    """Stock actual en Inventario para la variante del grupo (last write wins)."""
+    id_variante = next((t.id_variante for t in reversed(tareas) if t.id_variante), None)
+    if id_variante:
+        stock = db.session.query(Inventario.stock_actual).filter_by(id_variante=id_variante).scalar()
+    else:
+        # Filas encoladas antes de guardar id_variante: resolvemos por el ID de TN
+        stock = db.session.query(Inventario.stock_actual) \
+            .join(ProductoVariante, ProductoVariante.id_variante == Inventario.id_variante) \
+            .filter(ProductoVariante.tiendanube_variant_id == tareas[0].tn_variant_id).scalar()
+
+    if stock is None:
+        # La variante ya no existe localmente: usamos el último valor encolado
+        stock = max(tareas, key=lambda t: t.id).new_stock
+    return stock
+
+
+def _procesar_grupo(tareas):
+    """Un solo PUT por variante de TN; el resultado se aplica a todas las filas colapsadas."""
+    principal = max(tareas, key=lambda t: t.id)
+    try:
+        stock = _stock_vigente(tareas)
+        ok = tn_service.update_variant_stock(principal.tn_product_id, principal.tn_variant_id, stock, max_retries=1)
+        error = None if ok else "Tienda Nube rechazó la actualización (ver logs)"
+    except Exception as e:
+        ok, error = False, str(e)
+
+    if ok:
+        for tarea in tareas:
+            tarea.status = 'completed'
+            tarea.new_stock = stock
+            tarea.last_error = None
+        # Lo dejamos registrado para que la sync delta no vuelva a empujar este stock
+        ProductoVariante.query.filter_by(tiendanube_variant_id=principal.tn_variant_id) \
+            .execution_options(**SIN_VERSION).update(
+            {"tn_stock_sincronizado": stock, "tn_sincronizado_at": datetime.utcnow()},
+            synchronize_session=False
+        )
+        registrar_stock(principal.tn_variant_id, stock)
+        return True
+
+    # Las filas colapsadas se cierran; el reintento queda en la más nueva
+    for tarea in tareas:
+        if tarea is not principal:
+            tarea.status = 'completed'
+            tarea.last_error = f"Colapsada en la tarea #{principal.id}"
+
+    principal.retries = max((t.retries or 0) for t in tareas) + 1
+    principal.last_error = (error or "")[:255]
+    if principal.retries >= MAX_RETRIES:
+        principal.status = 'failed'
+        print(f"❌ SyncQueue #{principal.id}: variante {principal.tn_variant_id} marcada como FAILED tras {principal.retries} intentos.")
+    else:
+        principal.status = 'pending'
+        principal.next_attempt_at = datetime.utcnow() + _backoff(principal.retries)
+    return False
+
+
+def process_sync_queue(batch_size=50):
+    """
+    Procesa UN lote de la cola. Devuelve (variantes_enviadas, exitosas).
+    Hace commit después de cada variante para no perder el avance si algo explota.
+    """
+    if _recuperar_abandonadas():
+        db.session.commit()
+
+    grupos = _reclamar_lote(batch_size)
+    exitosas = 0
+    for tareas in grupos.values():
+        if _procesar_grupo(tareas):
+            exitosas += 1
+        db.session.commit()
+
+    return len(grupos), exitosas
+
+
+def purge_completed():
+    limite = datetime.utcnow() - COMPLETED_RETENTION
+    borradas = SyncQueue.query.filter(
+        SyncQueue.status == 'completed',
+        SyncQueue.updated_at < limite
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return borradas
+
+
+def queue_status():
+    filas = db.session.query(SyncQueue.status, db.func.count(SyncQueue.id)).group_by(SyncQueue.status).all()
+    resumen = {"pending": 0, "processing": 0, "completed": 0, "failed": 0}
+    resumen.update({estado: cantidad for estado, cantidad in filas})
+    return resumen
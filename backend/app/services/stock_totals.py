@@ -0,0 +1,189 @@
+# backend/app/services/stock_totals.py
+"""
+Stock total por producto (productos.stock_total), mantenido en la misma
+transacción que cada cambio de Inventario.
+
+El filtro "ocultar sin stock" y los órdenes mayor/menor stock del listado
+sumaban Inventario.stock_actual de todas las variantes en cada request. Ahora
+leen una columna indexada.
+
+No hace falta tocar cada endpoint (ventas, devoluciones, compras, webhooks,
+reservas, ajustes masivos): un listener de la sesión mira, en cada flush, qué
+filas de Inventario se crearon, cambiaron o borraron y aplica la diferencia
+con `UPDATE productos SET stock_total = stock_total + delta`. Es una suma (no
+relee las otras variantes), así que dos ventas simultáneas del mismo producto
+no se bloquean entre sí más allá de la fila del producto. Los movimientos de
+services/inventory.py van por SQL directo (no pasan por este listener) y
+ajustan stock_total ellos mismos con la misma suma.
+
+Cuando no se puede calcular la diferencia (la variante cambió de producto, o
+el stock se asignó con una expresión SQL) se recalcula la suma de ese
+producto. `flask stock-total-check` compara todo contra la suma
+real y con --fix corrige lo que no coincida.
+"""
+from datetime import datetime
+from itertools import chain
+
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import ClauseElement
+
+from app.extensions import db
+from app.products.models import Producto, ProductoVariante, Inventario
+
+
+def _suma_real(id_producto_col):
+    """Subconsulta correlacionada: SUM(stock_actual) de las variantes del producto."""
+    return select(db.func.coalesce(db.func.sum(Inventario.stock_actual), 0)) \
+        .join(ProductoVariante, ProductoVariante.id_variante == Inventario.id_variante) \
+        .where(ProductoVariante.id_producto == id_producto_col) \
+        .scalar_subquery()
+
+
+def recalcular(conexion, ids_producto=None):
+    """Recalcula stock_total desde Inventario (de esos productos o de todos). Devuelve filas tocadas."""
+    tabla = Producto.__table__
+    stmt = update(tabla).values(stock_total=_suma_real(tabla.c.id_producto))
+    if ids_producto is not None:
+        if not ids_producto:
+            return 0
+        stmt = stmt.where(tabla.c.id_producto.in_(sorted(ids_producto)))
+    return conexion.execute(stmt).rowcount
+
+
+def _valor(valor):
+    return valor if isinstance(valor, int) else 0
+
+
+def _delta_inventario(inv, tipo):
+    """(delta, recalcular?) del cambio de esta fila de Inventario. tipo: 'new' | 'dirty' | 'deleted'."""
+    hist = inspect(inv).attrs.stock_actual.history
+    nuevo = hist.added[0] if hist.added else None
+    expresion = isinstance(nuevo, ClauseElement)
+
+    if tipo == 'deleted':
+        anterior = hist.deleted or hist.unchanged
+        return (-_valor(anterior[0]), False) if anterior else (0, True)
+
+    if expresion:
+        return 0, True
+
+    if tipo == 'new':
+        return _valor(nuevo), False
+    if not hist.added:
+        return 0, False
+    if not hist.deleted:
+        return 0, True # No sabemos cuánto había: recalculamos
+    return _valor(nuevo) - _valor(hist.deleted[0]), False
+
+
+@event.listens_for(Session, 'before_flush')
+def _registrar_cambios(session, flush_context, instances):
+    """
+    Antes del flush (cuando la historia de los atributos todavía tiene el valor
+    anterior y las expresiones SQL asignadas) se anota qué cambió. Los IDs de las
+    filas nuevas todavía no existen: se guardan los objetos y se resuelven después.
+    """
+    cambios = session.info.setdefault('stock_totals', [])
+    for tipo, objetos in (('new', session.new), ('dirty', session.dirty), ('deleted', session.deleted)):
+        for obj in objetos:
+            if isinstance(obj, Inventario):
+                hist_var = inspect(obj).attrs.id_variante.history
+                if hist_var.deleted and hist_var.added:
+                    cambios.append(('recalc_variantes', [v for v in chain(hist_var.deleted, hist_var.added) if v]))
+                    continue
+                delta, hay_que_recalcular = _delta_inventario(obj, tipo)
+                if hay_que_recalcular:
+                    cambios.append(('recalc_inventario', obj))
+                elif delta:
+                    cambios.append(('delta', obj, delta))
+
+            elif isinstance(obj, ProductoVariante):
+                if obj.id_variante is not None and obj.id_producto is not None:
+                    cambios.append(('variante', obj.id_variante, obj.id_producto))
+                # Variante movida a otro producto: se recalculan los dos
+                hist = inspect(obj).attrs.id_producto.history
+                if hist.deleted and hist.added:
+                    cambios.append(('recalc_productos', [v for v in chain(hist.deleted, hist.added) if v]))
+
+
+@event.listens_for(Session, 'after_flush')
+def _ajustar_totales(session, flush_context):
+    cambios = session.info.pop('stock_totals', None)
+    if not cambios:
+        return
+
+    deltas_variante = {}     # id_variante -> delta
+    recalc_variantes = set()
+    recalc_productos = set()
+    producto_de = {}         # id_variante -> id_producto (de los objetos en sesión, incluso borrados)
+
+    for cambio in cambios:
+        tipo = cambio[0]
+        if tipo == 'delta':
+            _, inv, delta = cambio
+            if inv.id_variante is not None:
+                deltas_variante[inv.id_variante] = deltas_variante.get(inv.id_variante, 0) + delta
+        elif tipo == 'recalc_inventario':
+            if cambio[1].id_variante is not None:
+                recalc_variantes.add(cambio[1].id_variante)
+        elif tipo == 'recalc_variantes':
+            recalc_variantes.update(cambio[1])
+        elif tipo == 'recalc_productos':
+            recalc_productos.update(cambio[1])
+        elif tipo == 'variante':
+            producto_de[cambio[1]] = cambio[2]
+
+    if not deltas_variante and not recalc_variantes and not recalc_productos:
+        return
+
+    conexion = session.connection()
+    faltan = [v for v in set(deltas_variante) | recalc_variantes if v not in producto_de]
+    for i in range(0, len(faltan), 500):
+        filas = conexion.execute(
+            select(ProductoVariante.id_variante, ProductoVariante.id_producto)
+            .where(ProductoVariante.id_variante.in_(faltan[i:i + 500]))
+        )
+        producto_de.update({id_variante: id_producto for id_variante, id_producto in filas})
+
+    deltas_producto = {}
+    for id_variante, delta in deltas_variante.items():
+        id_producto = producto_de.get(id_variante)
+        if id_producto is not None:
+            deltas_producto[id_producto] = deltas_producto.get(id_producto, 0) + delta
+    recalc_productos.update(producto_de[v] for v in recalc_variantes if v in producto_de)
+
+    tabla = Producto.__table__
+    ahora = datetime.utcnow()
+    # Siempre en el mismo orden (por id) para que dos transacciones no se traben entre sí.
+    # También con suma neta 0 (cambio de talle dentro del producto): se estampa
+    # modificado_at igual, así el snapshot del catálogo manda el stock nuevo de las variantes
+    for id_producto in sorted(deltas_producto):
+        if id_producto in recalc_productos:
+            continue
+        conexion.execute(
+            update(tabla).where(tabla.c.id_producto == id_producto)
+            .values(stock_total=tabla.c.stock_total + deltas_producto[id_producto], modificado_at=ahora)
+        )
+    recalcular(conexion, recalc_productos)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _descartar_cambios(session):
+    session.info.pop('stock_totals', None)
+
+
+def check_stock_totals(fix=False):
+    """Productos cuyo stock_total no coincide con la suma real. Con fix=True los corrige."""
+    suma = _suma_real(Producto.id_producto)
+    diferencias = db.session.query(Producto.id_producto, Producto.nombre, Producto.stock_total, suma) \
+        .filter(db.func.coalesce(Producto.stock_total, -1) != suma).all()
+
+    if fix and diferencias:
+        recalcular(db.session.connection(), [fila[0] for fila in diferencias])
+        db.session.commit()
+
+    return [
+        {"id": id_producto, "nombre": nombre, "stock_total": guardado, "stock_real": int(real)}
+        for id_producto, nombre, guardado, real in diferencias
+    ]
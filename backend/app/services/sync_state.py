@@ -0,0 +1,63 @@
+# backend/app/services/sync_state.py
+"""
+Estado de sincronización por variante ("delta sync").
+
+Cada ProductoVariante guarda el último stock y el último precio web que
+Tienda Nube CONFIRMÓ (respuesta 2xx), y cuándo. Una variante está "sucia"
+si nunca se sincronizó o si su stock / precio web actual difiere de lo
+último enviado. La sync completa, la de precios y la de margen sólo empujan
+las sucias, salvo que se pida forzar.
+"""
+from datetime import datetime
+
+from sqlalchemy import or_, func
+from sqlalchemy.orm import contains_eager
+
+from app.products.models import Producto, ProductoVariante, Inventario
+from app.services.tiendanube_service import tn_service
+
+
+def variantes_pendientes(campos=('stock', 'precio'), ids_producto=None, forzar=False, solo_activos=False):
+    """
+    Variantes vinculadas a TN que difieren de lo último confirmado, en UNA consulta
+    (con su producto e inventario ya cargados). `campos` indica qué se compara.
+    Con forzar=True devuelve todas las vinculadas.
+    """
+    stock_local = func.coalesce(Inventario.stock_actual, 0)
+    precio_web = func.round(Producto.precio * tn_service.get_margen_web(), 2)
+
+    query = ProductoVariante.query \
+        .join(Producto, Producto.id_producto == ProductoVariante.id_producto) \
+        .outerjoin(Inventario, Inventario.id_variante == ProductoVariante.id_variante) \
+        .options(contains_eager(ProductoVariante.producto), contains_eager(ProductoVariante.inventario)) \
+        .filter(ProductoVariante.tiendanube_variant_id.isnot(None), Producto.tiendanube_id.isnot(None))
+
+    if ids_producto:
+        query = query.filter(Producto.id_producto.in_(ids_producto))
+    if solo_activos:
+        query = query.filter(Producto.activo == True)
+
+    if not forzar:
+        condiciones = []
+        if 'stock' in campos:
+            condiciones += [
+                ProductoVariante.tn_stock_sincronizado.is_(None),
+                ProductoVariante.tn_stock_sincronizado != stock_local
+            ]
+        if 'precio' in campos:
+            condiciones += [
+                ProductoVariante.tn_precio_sincronizado.is_(None),
+                func.abs(ProductoVariante.tn_precio_sincronizado - precio_web) > 0.005
+            ]
+        query = query.filter(or_(*condiciones))
+
+    return query.order_by(ProductoVariante.id_producto, ProductoVariante.id_variante).all()
+
+
+def marcar_sincronizada(variante, stock=None, precio_local=None):
+    """Registra lo que TN acaba de confirmar. No hace commit."""
+    if stock is not None:
+        variante.tn_stock_sincronizado = int(stock)
+    if precio_local is not None:
+        variante.tn_precio_sincronizado = tn_service.calcular_precio_web(precio_local)
+    variante.tn_sincronizado_at = datetime.utcnow()
@@ -1,20 +1,42 @@
 import os
 import requests
-import json
+import queue
+import threading
 import time # NUEVO: Importamos time para los reintentos
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from app.services.rate_limiter import SharedTokenBucket
+from app.services.pricing_config import PricingConfig
 
 load_dotenv()
 
+# (connect, read) en segundos: ningún request a TN puede colgar un hilo para siempre
+DEFAULT_TIMEOUT = (5, 20)
+
+# Conexiones keep-alive por host. Alcanza para los hilos de sync + el worker de la cola.
+POOL_MAXSIZE = 10
+
+# Tope de variantes por request en el endpoint batch de TN
+BATCH_MAX_VARIANTS = 50
+
 class TiendaNubeService:
     def __init__(self):
         self.access_token = os.getenv('TIENDANUBE_ACCESS_TOKEN')
         self.store_id = os.getenv('TIENDANUBE_STORE_ID')
         self.api_url = f"https://api.tiendanube.com/v1/{self.store_id}" if self.store_id else None
         self.user_agent = "AppGestion (tu_email@ejemplo.com)"
+
+        # Presupuesto de requests compartido entre TODOS los procesos/hilos (ver rate_limiter.py)
+        self.rate_limiter = SharedTokenBucket(f"tiendanube_{self.store_id or 'default'}")
+
+        # Sesión HTTP con pool de conexiones, una por proceso (ver _get_session)
+        self._session = None
+        self._session_pid = None
+        self._session_lock = threading.Lock()
         
         # Archivo local para persistir el margen sin DB
         self.CONFIG_FILE = os.path.join(os.path.dirname(__file__), 'tn_config.json')
+        self.pricing = PricingConfig(self.CONFIG_FILE)
         
         self.PESO_ESTANDAR = 0.150  
         self.MEDIDAS_ESTANDAR = {"width": 10, "height": 10, "depth": 5}
@@ -131,50 +153,90 @@ class TiendaNubeService:
             "Content-Type": "application/json"
         }
 
-    def _throttle(self):
+    def _get_session(self):
         """
-        Espaciado mínimo entre requests a la API de TN para no pisar el rate limit,
-        sin importar desde qué endpoint/loop se dispare la sincronización.
+        requests.Session con keep-alive: reutiliza la conexión TLS en vez de abrir
+        una nueva por cada llamada. Se crea una por PID porque gunicorn forkea
+        después de importar el módulo y un socket no se puede compartir entre procesos.
         """
-        min_interval = 0.35  # ~3 req/seg, con margen bajo el límite real de TN
-        now = time.time()
-        elapsed = now - getattr(self, '_last_request_ts', 0)
-        if elapsed < min_interval:
-            time.sleep(min_interval - elapsed)
-        self._last_request_ts = time.time()
+        pid = os.getpid()
+        if self._session is None or self._session_pid != pid:
+            with self._session_lock:
+                if self._session is None or self._session_pid != pid:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._session_pid = pid
+        return self._session
+
+    def connection_stats(self):
+        """Conexiones abiertas vs. reutilizadas por el pool de este proceso."""
+        abiertas = 0
+        requests_hechos = 0
+        session = self._session if self._session_pid == os.getpid() else None
+        if session:
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool:
+                        abiertas += pool.num_connections
+                        requests_hechos += pool.num_requests
+        return {
+            "pid": os.getpid(),
+            "requests": requests_hechos,
+            "conexiones_abiertas": abiertas,
+            "conexiones_reutilizadas": max(requests_hechos - abiertas, 0)
+        }
+
+    def _request(self, method, url, **kwargs):
+        """
+        Único punto de salida hacia la API de TN: pide un token al bucket compartido,
+        hace el request y corrige el bucket con los headers x-rate-limit-* de la respuesta.
+        Ante un 429 frena a todos los procesos según Retry-After / x-rate-limit-reset.
+        """
+        kwargs.setdefault('headers', self._get_headers())
+        kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+        self.rate_limiter.acquire()
+
+        response = self._get_session().request(method, url, **kwargs)
+        self.rate_limiter.update_from_headers(response.headers)
+
+        if response.status_code == 429:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after is None and response.headers.get('x-rate-limit-reset'):
+                try:
+                    retry_after = int(response.headers['x-rate-limit-reset']) / 1000.0
+                except ValueError:
+                    retry_after = None
+            self.rate_limiter.penalize(retry_after)
+
+        return response
 
     # ==========================================
     # LÓGICA DINÁMICA DE MÁRGENES
     # ==========================================
     def get_margen_web(self):
-        """Lee el margen del archivo JSON. Si no existe, devuelve 1.27 por defecto"""
-        try:
-            if os.path.exists(self.CONFIG_FILE):
-                with open(self.CONFIG_FILE, 'r') as f:
-                    data = json.load(f)
-                    return float(data.get('margen', 1.27))
-        except Exception as e:
-            print(f"⚠️ Error leyendo archivo margen: {e}")
-        return 1.27
+        """Margen vigente (cacheado en memoria, ver pricing_config.py). 1.27 por defecto"""
+        return self.pricing.get_margen()
 
     def set_margen_web(self, nuevo_margen):
         """Guarda el nuevo margen en el archivo JSON"""
         try:
-            with open(self.CONFIG_FILE, 'w') as f:
-                json.dump({'margen': float(nuevo_margen)}, f)
+            self.pricing.set_margen(nuevo_margen)
             print(f"✅ Nuevo margen de {nuevo_margen} guardado con éxito.")
         except Exception as e:
             print(f"⚠️ Error crítico guardando el archivo de margen: {e}")
 
     def calcular_precio_web(self, precio_local):
-        """Aplica el recargo leyendo SIEMPRE el margen dinámico y actualizado"""
-        if not precio_local: return 0.0
-        try:
-            margen_actual = self.get_margen_web()
-            precio = float(precio_local)
-            return round(precio * margen_actual, 2)
-        except ValueError:
-            return 0.0
+        """Aplica el recargo con el margen dinámico y actualizado"""
+        return self.pricing.calcular_precio(precio_local)
+
+    def calcular_precios_web(self, precios_locales):
+        """Igual que calcular_precio_web pero para una lista entera (un solo chequeo del margen)"""
+        return self.pricing.calcular_precios(precios_locales)
 
     # =======================================================
     # FUNCIONES AUXILIARES: INTELIGENCIA DE VARIANTES
@@ -226,7 +288,7 @@ class TiendaNubeService:
         
         try:
             url = f"{self.api_url}/store"
-            response = requests.get(url, headers=self._get_headers())
+            response = self._request('GET', url)
             
             if response.status_code == 200:
                 return {"success": True, "data": response.json()}
@@ -235,80 +297,127 @@ class TiendaNubeService:
         except Exception as e:
             return {"success": False, "error": str(e)}
 
-    def update_variant_price(self, tn_product_id, tn_variant_id, precio_local):
+    def update_variant(self, tn_product_id, tn_variant_id, stock=None, precio_local=None, max_retries=3):
         """
+        Actualiza stock y/o precio de una variante en UN solo PUT (antes eran dos
+        requests seguidos al mismo recurso). Los campos en None no se envían.
+
         Devuelve True si se actualizó, "not_found" si TN respondió 404 (vínculo local
         desactualizado: el producto/variante ya no existe del lado de Tienda Nube y no
         tiene sentido reintentar), o False para cualquier otro fallo (red, 5xx, etc).
         """
         if not self.access_token or not self.api_url: return False
 
-        precio_web = self.calcular_precio_web(precio_local)
+        data = {}
+        if stock is not None:
+            data["stock"] = int(stock)
+        if precio_local is not None:
+            data["price"] = self.calcular_precio_web(precio_local)
+            data["promotional_price"] = None
+
+        if not data: return False
 
         url = f"{self.api_url}/products/{tn_product_id}/variants/{tn_variant_id}"
-        data = {
-            "price": precio_web,
-            "promotional_price": None
-        }
+        detalle = ", ".join(f"{k}={v}" for k, v in data.items() if k != "promotional_price")
 
-        max_retries = 3
         for attempt in range(max_retries):
-            self._throttle()
             try:
-                response = requests.put(url, json=data, headers=self._get_headers(), timeout=10)
+                # Le agregamos un timeout por las dudas para que no se quede colgado
+                response = self._request('PUT', url, json=data, timeout=10)
 
                 if response.status_code in [200, 201]:
-                    print(f"✅ TN Sync: Precio actualizado a ${precio_web} (ID: {tn_variant_id})")
+                    print(f"✅ TN Sync: Variante actualizada ({detalle}) (ID: {tn_variant_id})")
                     return True
                 elif response.status_code == 429:
-                    # Rate limit de Tienda Nube: esperamos más y reintentamos
+                    # Rate limit de Tienda Nube: el limiter ya frenó a todos, reintentamos sin dormir acá
                     print(f"⏳ Rate limit TN (429) en variante {tn_variant_id}, intento {attempt + 1}")
-                    time.sleep(3)
+                    continue
                 elif response.status_code == 404:
                     # No es transitorio: el producto/variante ya no existe en TN, reintentar no sirve.
                     print(f"❌ TN Sync: Variante {tn_variant_id} (producto {tn_product_id}) no existe en Tienda Nube (404). Se desvinculará localmente.")
                     return "not_found"
                 else:
-                    print(f"⚠️ Intento {attempt + 1} fallido TN Sync precio: Status {response.status_code} (ID: {tn_variant_id}) - {response.text}")
+                    print(f"⚠️ Intento {attempt + 1} fallido TN Sync: Status {response.status_code} (ID: {tn_variant_id}) - {response.text}")
             except Exception as e:
-                print(f"⚠️ Intento {attempt + 1} fallido actualizando precio en TN: {e}")
+                print(f"⚠️ Intento {attempt + 1} fallido actualizando variante en TN: {e}")
 
+            # Si llegamos acá es porque falló. Si no es el último intento, esperamos 2 segundos.
             if attempt < max_retries - 1:
                 time.sleep(2)
 
-        print(f"❌ ERROR CRÍTICO: No se pudo actualizar el precio en TN de la variante {tn_variant_id} después de {max_retries} intentos.")
+        print(f"❌ ERROR CRÍTICO: No se pudo actualizar la variante {tn_variant_id} en TN después de {max_retries} intentos.")
         return False
 
-    # --- NUEVO: SISTEMA DE REINTENTOS PARA ACTUALIZAR STOCK ---
-    def update_variant_stock(self, tn_product_id, tn_variant_id, new_stock):
-        if not self.access_token or not self.api_url: return False
+    def update_variant_price(self, tn_product_id, tn_variant_id, precio_local):
+        """Mismos valores de retorno que update_variant (True / "not_found" / False)."""
+        return self.update_variant(tn_product_id, tn_variant_id, precio_local=precio_local)
 
-        url = f"{self.api_url}/products/{tn_product_id}/variants/{tn_variant_id}"
-        data = {"stock": int(new_stock)} if new_stock is not None else {}
+    # --- NUEVO: SISTEMA DE REINTENTOS PARA ACTUALIZAR STOCK ---
+    def update_variant_stock(self, tn_product_id, tn_variant_id, new_stock, max_retries=3):
+        """
+        max_retries=1 lo usa el worker de la cola de sync, que ya maneja sus
+        propios reintentos con backoff (no tiene sentido dormir acá adentro).
+        """
+        if new_stock is None: return False
+        return self.update_variant(tn_product_id, tn_variant_id, stock=new_stock, max_retries=max_retries) is True
 
-        if not data: return False
+    def update_product_variants(self, tn_product_id, cambios):
+        """
+        Actualiza varias variantes de un mismo producto con el endpoint batch de TN
+        (PATCH /products/{id}/variants): un request por producto en vez de uno o dos
+        por variante. `cambios` es una lista de dicts {"id", "stock"?, "precio_local"?}.
 
-        max_retries = 3
-        for attempt in range(max_retries):
-            self._throttle()
-            try:
-                # Le agregamos un timeout por las dudas para que no se quede colgado
-                response = requests.put(url, json=data, headers=self._get_headers(), timeout=10)
+        Si TN rechaza el batch (producto inexistente, payload inválido, etc.) se cae
+        a update_variant variante por variante, que sabe distinguir cuál dio 404.
+        Devuelve {tn_variant_id: True | "not_found" | False}.
+        """
+        if not cambios: return {}
+        if not self.access_token or not self.api_url:
+            return {str(c["id"]): False for c in cambios}
+
+        resultados = {}
+        url = f"{self.api_url}/products/{tn_product_id}/variants"
+
+        for i in range(0, len(cambios), BATCH_MAX_VARIANTS):
+            lote = cambios[i:i + BATCH_MAX_VARIANTS]
+            precios_web = self.calcular_precios_web([c.get("precio_local") for c in lote])
+            payload = []
+            for c, precio_web in zip(lote, precios_web):
+                tn_id = str(c["id"])
+                item = {"id": int(tn_id) if tn_id.isdigit() else tn_id}
+                if c.get("stock") is not None:
+                    item["stock"] = int(c["stock"])
+                if c.get("precio_local") is not None:
+                    item["price"] = precio_web
+                    item["promotional_price"] = None
+                payload.append(item)
+
+            ok = False
+            for attempt in range(2):
+                try:
+                    response = self._request('PATCH', url, json=payload)
+                    if response.status_code == 429:
+                        continue
+                    ok = response.status_code in [200, 201]
+                    if not ok:
+                        print(f"⚠️ TN Sync batch rechazado (producto {tn_product_id}): Status {response.status_code} - {response.text[:200]}")
+                except Exception as e:
+                    print(f"⚠️ Error en TN Sync batch (producto {tn_product_id}): {e}")
+                break
 
-                if response.status_code in [200, 201]:
-                    print(f"✅ TN Sync: Stock actualizado a {new_stock} (ID: {tn_variant_id})")
-                    return True # Si sale bien, cortamos la función acá
-                else:
-                    print(f"⚠️ Intento {attempt + 1} fallido TN Sync: Status {response.status_code} (ID: {tn_variant_id}) - {response.text}")
-            except Exception as e:
-                print(f"⚠️ Intento {attempt + 1} fallido actualizando stock en TN: {e}")
+            if ok:
+                print(f"✅ TN Sync: {len(lote)} variantes actualizadas en un solo request (producto {tn_product_id})")
+                for c in lote:
+                    resultados[str(c["id"])] = True
+                continue
 
-            # Si llegamos acá es porque falló. Si no es el último intento, esperamos 2 segundos.
-            if attempt < max_retries - 1:
-                time.sleep(2)
+            # Plan B: una por una
+            for c in lote:
+                resultados[str(c["id"])] = self.update_variant(
+                    tn_product_id, c["id"], stock=c.get("stock"), precio_local=c.get("precio_local")
+                )
 
-        print(f"❌ ERROR CRÍTICO: No se pudo actualizar el stock en TN de la variante {tn_variant_id} después de {max_retries} intentos.")
-        return False
+        return resultados
 
     def update_product_data(self, local_prod):
         """Actualiza SOLO nombre y descripción en TN para evitar conflictos estructurales en la API"""
@@ -331,7 +440,7 @@ class TiendaNubeService:
         }
 
         try:
-            response = requests.put(url, json=data, headers=self._get_headers())
+            response = self._request('PUT', url, json=data)
             if response.status_code == 200:
                 print(f"✅ TN Sync: Info base actualizada (ID: {local_prod.tiendanube_id})")
             else:
@@ -344,7 +453,7 @@ class TiendaNubeService:
         
         url = f"{self.api_url}/products/{tn_product_id}"
         try:
-            requests.delete(url, headers=self._get_headers())
+            self._request('DELETE', url)
             print(f"🗑️ TN Sync: Producto eliminado (ID: {tn_product_id})")
         except Exception as e:
             print(f"⚠️ Error eliminando de TN: {e}")
@@ -354,7 +463,7 @@ class TiendaNubeService:
         
         url = f"{self.api_url}/products/{tn_product_id}/variants/{tn_variant_id}"
         try:
-            response = requests.delete(url, headers=self._get_headers())
+            response = self._request('DELETE', url)
             if response.status_code == 200:
                 print(f"🗑️ TN Sync: Variante eliminada de la nube (ID: {tn_variant_id})")
             else:
@@ -387,9 +496,9 @@ class TiendaNubeService:
             if usa_estampa: attributes_list.append({"es": "Estampa / Jugador"})
 
             variants_data = []
+            precio_web = self.calcular_precio_web(local_prod.precio)
             for var in local_prod.variantes:
                 stock_val = var.inventario.stock_actual if var.inventario else 0
-                precio_web = self.calcular_precio_web(local_prod.precio)
 
                 # Si NO usa estampa (es un llavero o buzo comun), _build_variant_values le dara un array de 1 solo elemento: [{"es": "M"}]
                 variants_data.append({
@@ -412,7 +521,7 @@ class TiendaNubeService:
             }
 
             url = f"{self.api_url}/products"
-            response = requests.post(url, json=payload, headers=self._get_headers())
+            response = self._request('POST', url, json=payload)
             
             if response.status_code == 201:
                 return {"success": True, "tn_data": response.json()}
@@ -425,14 +534,16 @@ class TiendaNubeService:
             traceback.print_exc()
             return {"success": False, "error": str(e)}
 
-    def get_order_details(self, order_id):
+    def get_order_details(self, order_id, fields=None):
+        """`fields` (ej: "id,products") limita la respuesta a esos campos: la orden completa trae cliente, envío, etc."""
         if not self.access_token or not self.api_url: return None
 
         url = f"{self.api_url}/orders/{order_id}"
+        params = {"fields": fields} if fields else None
 
         try:
             print(f"📥 Descargando detalles de Orden #{order_id} desde API...")
-            response = requests.get(url, headers=self._get_headers())
+            response = self._request('GET', url, params=params)
 
             if response.status_code == 200:
                 return response.json()
@@ -468,7 +579,7 @@ class TiendaNubeService:
             }
 
             url = f"{self.api_url}/products/{tn_product_id}/variants"
-            response = requests.post(url, json=payload, headers=self._get_headers())
+            response = self._request('POST', url, json=payload)
 
             if response.status_code == 201:
                 print(f"✅ TN Sync: Variante creada exitosamente.")
@@ -503,52 +614,134 @@ class TiendaNubeService:
         
         return hubo_cambios
 
-    def get_all_products(self):
+    def _fetch_products_page(self, page, per_page, updated_at_min=None):
+        url = f"{self.api_url}/products"
+        params = {"page": page, "per_page": per_page, "fields": "id,name,variants,permalink,canonical_url,updated_at"}
+        if updated_at_min:
+            params["updated_at_min"] = updated_at_min.strftime('%Y-%m-%dT%H:%M:%S+00:00')
+
+        response = self._request('GET', url, params=params, timeout=15)
+
+        # TN responde 404 ("Last page is N") cuando se pide una página más allá de la última
+        if response.status_code == 404:
+            return []
+        if response.status_code != 200:
+            raise RuntimeError(f"Error API TN al listar productos (pág. {page}): {response.status_code} - {response.text}")
+        return response.json() or []
+
+    def iter_product_pages(self, updated_at_min=None, prefetch=2, per_page=200):
         """
-        Trae TODO el catálogo de Tienda Nube (paginado), solo con los campos
-        necesarios para comparar stock: id de producto y sus variantes.
+        Generador: devuelve el catálogo de a una página (lista de productos) por vez.
+        Un hilo en segundo plano va bajando las próximas `prefetch` páginas (siempre
+        pasando por el rate limiter) mientras el llamador procesa la actual, así que
+        en memoria nunca hay más que unas pocas páginas.
+        Solo trae id, nombre, link público, fecha de modificación y variantes; con
+        `updated_at_min` (datetime UTC) solo lo modificado desde entonces.
         Lanza una excepción si no hay credenciales o si la API falla, para que
         el llamador no confunda "no pude consultar" con "no hay diferencias".
         """
         if not self.access_token or not self.api_url:
             raise RuntimeError("Faltan credenciales de Tienda Nube (access_token / store_id)")
 
-        productos = []
-        page = 1
-        per_page = 200
         max_pages = 200  # tope de seguridad (40.000 productos)
+        cola = queue.Queue(maxsize=max(prefetch, 1))
+        detener = threading.Event()
+        fin = object()
+
+        def encolar(item):
+            # Si el consumidor dejó de leer (break / excepción) no nos quedamos colgados
+            while not detener.is_set():
+                try:
+                    cola.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+
+        def productor():
+            try:
+                for page in range(1, max_pages + 1):
+                    if detener.is_set():
+                        return
+                    batch = self._fetch_products_page(page, per_page, updated_at_min)
+                    if batch:
+                        encolar(batch)
+                    if len(batch) < per_page:
+                        break
+                encolar(fin)
+            except Exception as e:
+                encolar(e)
 
-        while page <= max_pages:
-            self._throttle()
-            url = f"{self.api_url}/products"
-            params = {"page": page, "per_page": per_page, "fields": "id,name,variants"}
+        hilo = threading.Thread(target=productor, name='tn-prefetch', daemon=True)
+        hilo.start()
+        try:
+            while True:
+                item = cola.get()
+                if item is fin:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            detener.set()
+
+    def iter_products(self, updated_at_min=None, prefetch=2):
+        """Como iter_product_pages, pero de a un producto por vez."""
+        for pagina in self.iter_product_pages(updated_at_min=updated_at_min, prefetch=prefetch):
+            yield from pagina
+
+    def get_all_products(self, updated_at_min=None):
+        """Catálogo completo en una lista. Para recorrerlo sin cargarlo entero usar iter_products."""
+        return list(self.iter_products(updated_at_min=updated_at_min))
+
+    def iter_order_pages(self, created_at_min, fields=None, per_page=200):
+        """
+        Generador: órdenes creadas desde `created_at_min` (datetime UTC), de a una
+        página por vez. Igual que iter_product_pages, lanza excepción si la API falla.
+        """
+        if not self.access_token or not self.api_url:
+            raise RuntimeError("Faltan credenciales de Tienda Nube (access_token / store_id)")
 
-            response = requests.get(url, headers=self._get_headers(), params=params, timeout=15)
+        url = f"{self.api_url}/orders"
+        max_pages = 200  # tope de seguridad (40.000 órdenes)
+        for page in range(1, max_pages + 1):
+            params = {
+                "page": page,
+                "per_page": per_page,
+                "created_at_min": created_at_min.strftime('%Y-%m-%dT%H:%M:%S+00:00')
+            }
+            if fields:
+                params["fields"] = fields
 
+            response = self._request('GET', url, params=params, timeout=15)
+            # Igual que en productos: 404 al pedir una página más allá de la última
+            if response.status_code == 404:
+                return
             if response.status_code != 200:
-                raise RuntimeError(f"Error API TN al listar productos (pág. {page}): {response.status_code} - {response.text}")
-
-            batch = response.json()
-            if not batch:
-                break
-
-            productos.extend(batch)
+                raise RuntimeError(f"Error API TN al listar órdenes (pág. {page}): {response.status_code} - {response.text}")
 
+            batch = response.json() or []
+            if batch:
+                yield batch
             if len(batch) < per_page:
-                break
-            page += 1
+                return
+
+    def get_product(self, tn_product_id):
+        """Detalle de un producto en TN (dict) o None si no existe / falla la API."""
+        if not self.access_token or not self.api_url: return None
 
-        return productos
+        url = f"{self.api_url}/products/{tn_product_id}"
+        r = self._request('GET', url)
+        if r.status_code == 200:
+            return r.json()
+        return None
 
     def get_first_product_image_url(self, tn_product_id):
         if not self.access_token or not self.api_url: return None
         
         try:
-            url = f"{self.api_url}/products/{tn_product_id}"
-            r = requests.get(url, headers=self._get_headers())
+            data = self.get_product(tn_product_id)
             
-            if r.status_code == 200:
-                data = r.json()
+            if data:
                 images = data.get('images', [])
                 if images:
                     images.sort(key=lambda x: int(x.get('position', 99)))
@@ -0,0 +1,203 @@
+# backend/app/services/webhook_inbox.py
+"""
+Bandeja de entrada (inbox) de las notificaciones de órdenes de Tienda Nube.
+
+Antes el webhook descargaba la orden y registraba la venta dentro del mismo
+request: si la API de TN tardaba o estaba limitada, la respuesta se demoraba
+segundos, TN daba la notificación por fallida y la reenviaba. Ahora el
+endpoint valida la tienda, guarda el cuerpo crudo en tn_webhook_inbox y
+responde 200 en milisegundos.
+
+`flask webhook-worker` drena la tabla con un pool de hilos: cada notificación
+se procesa en su propio app context (su propia sesión), descarga solo los
+campos de la orden que usamos y registra la venta. Los duplicados (TN reenvía
+la misma orden) los frena el índice único de tn_ordenes. Los errores se reintentan
+con backoff exponencial hasta MAX_ATTEMPTS.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from app.extensions import db
+from app.sales.models import TnWebhookInbox
+from app.services.tiendanube_service import tn_service
+
+# Campos de la orden que usa process_cloud_order (el resto no se descarga)
+ORDER_FIELDS = "id,products,created_at"
+
+INBOX_WORKERS = 4
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 30 * 60
+
+# Notificaciones que quedaron en 'processing' porque el worker murió
+PROCESSING_TIMEOUT = timedelta(minutes=5)
+
+# Las procesadas se conservan un tiempo para poder auditar
+DONE_RETENTION = timedelta(days=7)
+
+
+def registrar_notificacion(payload_crudo, store_id=None):
+    """
+    Guarda la notificación tal como llegó y hace commit. Es lo único que hace
+    el webhook antes de responder. Devuelve la fila creada.
+    """
+    try:
+        data = json.loads(payload_crudo or '{}')
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+
+    order_id = data.get('id')
+    fila = TnWebhookInbox(
+        event=(data.get('event') or '')[:50] or None,
+        tn_order_id=str(order_id) if order_id else None,
+        store_id=str(store_id or data.get('store_id') or '')[:50] or None,
+        payload=payload_crudo,
+        status='pending' if order_id else 'done', # Sin ID de orden no hay nada que procesar
+        attempts=0,
+        next_attempt_at=datetime.utcnow()
+    )
+    if not order_id:
+        fila.processed_at = datetime.utcnow()
+        fila.last_error = "Sin ID de orden"
+    db.session.add(fila)
+    db.session.commit()
+    return fila
+
+
+def _backoff(attempts):
+    segundos = BACKOFF_BASE_SECONDS * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(segundos, BACKOFF_MAX_SECONDS))
+
+
+def _recuperar_abandonadas():
+    limite = datetime.utcnow() - PROCESSING_TIMEOUT
+    return TnWebhookInbox.query.filter(
+        TnWebhookInbox.status == 'processing',
+        TnWebhookInbox.updated_at < limite
+    ).update({"status": "pending"}, synchronize_session=False)
+
+
+def _reclamar_lote(batch_size):
+    """Marca un lote de notificaciones vencidas como 'processing' y devuelve sus IDs (SKIP LOCKED, como la sync_queue)."""
+    filas = TnWebhookInbox.query.filter(
+        TnWebhookInbox.status == 'pending',
+        TnWebhookInbox.next_attempt_at <= datetime.utcnow()
+    ).order_by(TnWebhookInbox.id).limit(batch_size).with_for_update(skip_locked=True).all()
+
+    for fila in filas:
+        fila.status = 'processing'
+    ids = [fila.id for fila in filas]
+    db.session.commit()
+    return ids
+
+
+def _procesar_notificacion(fila):
+    """Descarga y registra la orden. Devuelve un texto con el resultado; lanza excepción si hay que reintentar."""
+    from app.sales.webhooks import process_cloud_order, orden_registrada, OrdenDuplicada
+
+    order_id = fila.tn_order_id
+    if orden_registrada(order_id):
+        return "Orden ya registrada"
+
+    order_data = tn_service.get_order_details(order_id, fields=ORDER_FIELDS)
+    if not order_data:
+        raise RuntimeError("No se pudo descargar la orden desde la API")
+
+    try:
+        process_cloud_order(order_data)
+    except OrdenDuplicada:
+        # Otra entrega de la misma orden ganó la carrera mientras descargábamos
+        return "Orden ya registrada"
+    return None
+
+
+def _procesar_en_contexto(app, inbox_id):
+    """Procesa UNA notificación en su propio app context (se llama desde los hilos del pool)."""
+    with app.app_context():
+        fila = db.session.get(TnWebhookInbox, inbox_id)
+        if fila is None:
+            return False
+        try:
+            nota = _procesar_notificacion(fila)
+            ok, error = True, nota
+        except Exception as e:
+            db.session.rollback()
+            fila = db.session.get(TnWebhookInbox, inbox_id)
+            ok, error = False, str(e)
+
+        fila.attempts = (fila.attempts or 0) + 1
+        fila.last_error = (error or "")[:255] or None
+        if ok:
+            fila.status = 'done'
+            fila.processed_at = datetime.utcnow()
+        elif fila.attempts >= MAX_ATTEMPTS:
+            fila.status = 'failed'
+            print(f"❌ Webhook #{fila.id}: orden {fila.tn_order_id} marcada como FAILED tras {fila.attempts} intentos.")
+        else:
+            fila.status = 'pending'
+            fila.next_attempt_at = datetime.utcnow() + _backoff(fila.attempts)
+            print(f"⚠️ Webhook #{fila.id}: orden {fila.tn_order_id} falló ({error}). Reintento #{fila.attempts}.")
+        db.session.commit()
+        return ok
+
+
+def process_inbox(app, batch_size=20, workers=INBOX_WORKERS, executor=None):
+    """
+    Procesa UN lote de la bandeja en paralelo. Devuelve (reclamadas, exitosas).
+    `executor` permite reutilizar el pool entre lotes (el worker lo mantiene abierto).
+    """
+    if _recuperar_abandonadas():
+        db.session.commit()
+
+    ids = _reclamar_lote(batch_size)
+    if not ids:
+        return 0, 0
+
+    if executor is None:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            resultados = list(pool.map(lambda i: _procesar_en_contexto(app, i), ids))
+    else:
+        resultados = list(executor.map(lambda i: _procesar_en_contexto(app, i), ids))
+    return len(ids), sum(1 for ok in resultados if ok)
+
+
+def purge_done():
+    limite = datetime.utcnow() - DONE_RETENTION
+    borradas = TnWebhookInbox.query.filter(
+        TnWebhookInbox.status == 'done',
+        TnWebhookInbox.processed_at < limite
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return borradas
+
+
+def inbox_status():
+    """Profundidad de la bandeja y demora de procesamiento (en segundos)."""
+    filas = db.session.query(TnWebhookInbox.status, db.func.count(TnWebhookInbox.id)) \
+        .group_by(TnWebhookInbox.status).all()
+    resumen = {"pending": 0, "processing": 0, "done": 0, "failed": 0}
+    resumen.update({estado: cantidad for estado, cantidad in filas})
+
+    ahora = datetime.utcnow()
+    mas_vieja = db.session.query(db.func.min(TnWebhookInbox.received_at)) \
+        .filter(TnWebhookInbox.status.in_(['pending', 'processing'])).scalar()
+
+    # Demora recepción -> venta registrada en la última hora (en Python: sin funciones de fecha del motor)
+    recientes = db.session.query(TnWebhookInbox.received_at, TnWebhookInbox.processed_at) \
+        .filter(TnWebhookInbox.status == 'done',
+                TnWebhookInbox.processed_at >= ahora - timedelta(hours=1),
+                TnWebhookInbox.tn_order_id.isnot(None)) \
+        .order_by(TnWebhookInbox.processed_at.desc()).limit(1000).all()
+    demoras = sorted((p - r).total_seconds() for r, p in recientes if r and p)
+
+    return {
+        "profundidad": resumen["pending"] + resumen["processing"],
+        "estados": resumen,
+        "mas_vieja_pendiente_seg": round((ahora - mas_vieja).total_seconds(), 1) if mas_vieja else 0,
+        "procesadas_ultima_hora": len(demoras),
+        "demora_promedio_seg": round(sum(demoras) / len(demoras), 2) if demoras else None,
+        "demora_max_seg": round(demoras[-1], 2) if demoras else None
+    }
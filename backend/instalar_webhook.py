@@ -10,7 +10,7 @@ USER_ID = os.getenv('TIENDANUBE_USER_ID')
 
 # ¡¡USA TU IP PÚBLICA AQUÍ!! (No la 100.x.x.x)
 IP_PUBLICA = "http://72.61.219.128" 
-WEBHOOK_URL = f"{IP_PUBLICA}/api/webhooks/tn/orders"
+WEBHOOK_URL = f"{IP_PUBLICA}/api/webhooks/tiendanube/orders"
 
 def registrar():
     url = f"https://api.tiendanube.com/v1/{USER_ID}/webhooks"
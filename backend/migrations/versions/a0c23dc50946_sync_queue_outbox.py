@@ -0,0 +1,55 @@
+"""sync_queue outbox para el stock de Tienda Nube
+
+Revision ID: a0c23dc50946
+Revises: 250db2abec58
+Create Date: 2026-10-17 10:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a0c23dc50946'
+down_revision = '250db2abec58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # El modelo SyncQueue existía pero nunca tuvo migración: en algunas bases
+    # la tabla se creó a mano (db.create_all) y en otras no existe.
+    inspector = sa.inspect(op.get_bind())
+
+    if 'sync_queue' not in inspector.get_table_names():
+        op.create_table('sync_queue',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('tn_product_id', sa.String(length=100), nullable=False),
+        sa.Column('tn_variant_id', sa.String(length=100), nullable=False),
+        sa.Column('new_stock', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(length=20), nullable=True),
+        sa.Column('retries', sa.Integer(), nullable=True),
+        sa.Column('next_attempt_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.String(length=255), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+        )
+    else:
+        columnas = {c['name'] for c in inspector.get_columns('sync_queue')}
+        with op.batch_alter_table('sync_queue', schema=None) as batch_op:
+            if 'next_attempt_at' not in columnas:
+                batch_op.add_column(sa.Column('next_attempt_at', sa.DateTime(), nullable=True))
+            if 'last_error' not in columnas:
+                batch_op.add_column(sa.Column('last_error', sa.String(length=255), nullable=True))
+        op.execute("UPDATE sync_queue SET next_attempt_at = created_at WHERE next_attempt_at IS NULL")
+
+    with op.batch_alter_table('sync_queue', schema=None) as batch_op:
+        batch_op.create_index('ix_sync_queue_status_next_attempt', ['status', 'next_attempt_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('sync_queue', schema=None) as batch_op:
+        batch_op.drop_index('ix_sync_queue_status_next_attempt')
+
+    op.drop_table('sync_queue')
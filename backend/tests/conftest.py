@@ -0,0 +1,87 @@
+# backend/tests/conftest.py
+"""
+Fixtures comunes: app con SQLite en un archivo temporal (las tablas se crean con
+db.create_all, sin migraciones) y un catálogo chico vinculado a Tienda Nube.
+
+Correr desde backend/:  python -m pytest
+"""
+import os
+
+import pytest
+
+os.environ.setdefault('TIENDANUBE_ACCESS_TOKEN', 'token-de-prueba')
+os.environ.setdefault('TIENDANUBE_STORE_ID', '123')
+
+from app import create_app
+from app.extensions import db as _db
+from app.products.models import Categoria, Producto, ProductoVariante, Inventario
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig:
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'test.db'}"
+        SQLALCHEMY_TRACK_MODIFICATIONS = False
+        SECRET_KEY = 'test'
+        JWT_SECRET_KEY = 'test-jwt-secret-de-al-menos-32-bytes'
+        TESTING = True
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        _db.create_all()
+        yield app
+        _db.session.remove()
+        _db.drop_all()
+
+
+@pytest.fixture
+def db(app):
+    return _db
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def auth_headers(app):
+    from flask_jwt_extended import create_access_token
+    return {'Authorization': f"Bearer {create_access_token(identity='1')}"}
+
+
+@pytest.fixture
+def catalogo(db):
+    """
+    Dos productos con talles S y M, stock 5 cada uno y vinculados a TN.
+    Devuelve {sku: id_variante} (SKU 'P<id_producto>-<talle>').
+    """
+    categoria = Categoria(nombre='Camisetas')
+    db.session.add(categoria)
+    db.session.flush()
+    variantes = {}
+    for i in range(2):
+        producto = Producto(nombre=f'Camiseta {i}', precio=1000 + i, id_categoria=categoria.id_categoria,
+                            tiendanube_id=str(900 + i), activo=True)
+        db.session.add(producto)
+        db.session.flush()
+        for talle in ('S', 'M'):
+            sku = f'P{producto.id_producto}-{talle}'
+            variante = ProductoVariante(id_producto=producto.id_producto, talla=talle, codigo_sku=sku,
+                                        tiendanube_variant_id=f'tn-{sku}')
+            db.session.add(variante)
+            db.session.flush()
+            db.session.add(Inventario(id_variante=variante.id_variante, stock_actual=5))
+            variantes[sku] = variante.id_variante
+    db.session.commit()
+    return variantes
+
+
+@pytest.fixture
+def stock_de(db):
+    """stock_de(id_variante): stock_actual leído de la DB (None si no hay fila de inventario)."""
+    def leer(id_variante):
+        return db.session.execute(
+            db.select(Inventario.stock_actual).where(Inventario.id_variante == id_variante)
+        ).scalar()
+    return leer
@@ -0,0 +1,75 @@
+# backend/tests/test_catalog_mirror.py
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.products.models import TnCatalogMirror, TnMirrorStatus
+from app.services import catalog_mirror
+from app.services.catalog_mirror import refresh_catalog_mirror, refresh_if_stale, mirror_status, MIRROR_MAX_AGE
+
+
+@pytest.fixture
+def paginas_tn(monkeypatch):
+    """Reemplaza el catálogo de TN: registra el updated_at_min pedido y devuelve una página."""
+    pedidos = []
+    listo = threading.Event()
+
+    def iter_product_pages(updated_at_min=None):
+        pedidos.append(updated_at_min)
+        yield [{"id": 10, "name": {"es": "Camiseta"}, "updated_at": "2026-10-17T12:00:00+0000",
+                "variants": [{"id": 100, "sku": "P1-S", "stock": 4, "price": "10.00"}]}]
+        listo.set()
+
+    monkeypatch.setattr(catalog_mirror.tn_service, 'iter_product_pages', iter_product_pages)
+    iter_product_pages.pedidos = pedidos
+    iter_product_pages.listo = listo
+    return iter_product_pages
+
+
+def _esperar_refresco(db, paginas_tn):
+    """Espera a que el hilo termine (libera refreshing_since después de confirmar)."""
+    assert paginas_tn.listo.wait(5)
+    for _ in range(100):
+        db.session.expire_all()
+        if not mirror_status()["refrescando"]:
+            return
+        time.sleep(0.05)
+    pytest.fail("El refresco en segundo plano no terminó")
+
+
+def test_el_estado_del_refresco_queda_en_la_db(db, paginas_tn):
+    assert refresh_catalog_mirror()["modo"] == "completo"
+    estado = db.session.get(TnMirrorStatus, 1)
+    assert estado.last_refresh is not None and estado.last_full_refresh == estado.last_refresh
+
+    # El siguiente es incremental, desde el último refresco (con margen)
+    assert refresh_catalog_mirror()["modo"] == "incremental"
+    assert paginas_tn.pedidos[-1] == estado.last_full_refresh - catalog_mirror.INCREMENTAL_OVERLAP
+    assert mirror_status()["variantes"] == 1
+
+
+def test_refresh_if_stale_refresca_en_segundo_plano_una_sola_vez(db, paginas_tn):
+    assert refresh_if_stale() is True
+    assert refresh_if_stale() is False # Ya hay uno en curso
+    _esperar_refresco(db, paginas_tn)
+    estado = mirror_status()
+    assert estado["variantes"] == 1 and not estado["refrescando"]
+    # Recién refrescado: no hace falta otro
+    assert refresh_if_stale() is False
+
+
+def test_refresh_if_stale_vuelve_a_refrescar_cuando_envejece(db, paginas_tn):
+    db.session.add(TnMirrorStatus(id=1, last_refresh=datetime.utcnow() - MIRROR_MAX_AGE - timedelta(seconds=1)))
+    db.session.add(TnCatalogMirror(tn_product_id='10', tn_variant_id='100', stock=4))
+    db.session.commit()
+    assert refresh_if_stale() is True
+    _esperar_refresco(db, paginas_tn)
+    assert db.session.get(TnMirrorStatus, 1).last_refresh > datetime.utcnow() - MIRROR_MAX_AGE
+
+
+def test_auditoria_con_espejo_vacio_no_espera_a_tn(db, client, auth_headers, paginas_tn):
+    r = client.get('/api/products/sync/audit-stock?refresh=0', headers=auth_headers)
+    assert r.status_code == 503
+    assert paginas_tn.pedidos == []
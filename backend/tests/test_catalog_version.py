@@ -0,0 +1,98 @@
+# backend/tests/test_catalog_version.py
+import pytest
+
+from app.products.models import Producto, ProductoVariante
+from app.services import catalog_version
+from app.services.catalog_version import get_versions, SIN_VERSION, _ResponseCache
+
+
+@pytest.fixture(autouse=True)
+def cache_vacio(monkeypatch):
+    """Un cache de respuestas nuevo por test (el del módulo es uno por worker)."""
+    cache = _ResponseCache()
+    monkeypatch.setattr(catalog_version, 'response_cache', cache)
+    return cache
+
+
+def test_etag_y_304(client, auth_headers, catalogo):
+    res = client.get('/api/products/categories', headers=auth_headers)
+    assert res.status_code == 200
+    etag = res.headers['ETag']
+    assert etag.startswith('W/')
+
+    res = client.get('/api/products/categories', headers={**auth_headers, 'If-None-Match': etag})
+    assert res.status_code == 304
+    assert res.get_data() == b''
+
+    # Otro ETag (versión vieja) recibe la respuesta completa
+    res = client.get('/api/products/categories', headers={**auth_headers, 'If-None-Match': 'W/"c0"'})
+    assert res.status_code == 200 and res.headers['ETag'] == etag
+
+
+def test_el_commit_sube_la_version_y_cambia_el_etag(db, client, auth_headers, catalogo):
+    etag = client.get('/api/products', headers=auth_headers).headers['ETag']
+    antes = get_versions()
+
+    producto = db.session.get(Producto, 1)
+    producto.nombre = 'Camiseta renombrada'
+    db.session.flush()
+    assert get_versions() == antes # Recién sube después del commit
+    db.session.commit()
+
+    assert get_versions()['catalogo'] == antes['catalogo'] + 1
+    assert get_versions()['stock'] == antes['stock']
+    res = client.get('/api/products', headers={**auth_headers, 'If-None-Match': etag})
+    assert res.status_code == 200
+    assert res.headers['ETag'] != etag
+    assert 'Camiseta renombrada' in res.get_data(as_text=True)
+
+
+def test_rollback_no_sube_la_version(db, catalogo):
+    antes = get_versions()
+    db.session.get(Producto, 1).nombre = 'Descartado'
+    db.session.flush()
+    db.session.rollback()
+    db.session.commit()
+    assert get_versions() == antes
+
+
+def test_columnas_ignoradas_no_invalidan(db, catalogo):
+    antes = get_versions()
+
+    # Objeto en la sesión: solo cambia el registro de sync
+    db.session.get(ProductoVariante, 1).tn_stock_sincronizado = 5
+    db.session.commit()
+    # UPDATE masivo avisado con SIN_VERSION
+    ProductoVariante.query.filter_by(id_variante=2).execution_options(**SIN_VERSION) \
+        .update({"tn_stock_sincronizado": 5}, synchronize_session=False)
+    db.session.commit()
+    # UPDATE por clave primaria con solo columnas ignoradas
+    db.session.execute(db.update(ProductoVariante), [{"id_variante": 3, "tn_stock_sincronizado": 5}])
+    db.session.commit()
+    assert get_versions() == antes
+
+    # Un UPDATE masivo sin aviso sube la versión (no se puede saber qué toca)
+    ProductoVariante.query.filter_by(id_variante=4).update({"tn_stock_sincronizado": 5}, synchronize_session=False)
+    db.session.commit()
+    assert get_versions()['catalogo'] == antes['catalogo'] + 1
+
+
+def test_el_cache_se_acota_por_bytes():
+    cache = _ResponseCache(size=10, max_bytes=100)
+    cache.put('a', b'x' * 40)
+    cache.put('b', b'x' * 40)
+    assert cache.get('a') is not None # 'a' pasa a ser la más reciente
+    cache.put('c', b'x' * 40)
+    assert cache.get('b') is None # Se fue la menos usada para no pasar de 100 bytes
+    assert cache.get('a') is not None and cache.get('c') is not None
+
+    cache.put('a', b'x' * 10) # Reemplazar descuenta el tamaño anterior
+    assert cache._bytes == 50
+
+
+def test_respuesta_cacheada_se_reutiliza(client, auth_headers, catalogo, cache_vacio):
+    primera = client.get('/api/products/categories', headers=auth_headers)
+    assert len(cache_vacio._items) == 1
+    segunda = client.get('/api/products/categories', headers=auth_headers)
+    assert segunda.get_data() == primera.get_data()
+    assert len(cache_vacio._items) == 1
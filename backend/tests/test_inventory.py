@@ -0,0 +1,178 @@
+# backend/tests/test_inventory.py
+import pytest
+from sqlalchemy import event, Update
+
+from app.products.models import Producto, ProductoVariante, Inventario, SyncQueue
+from app.sales.models import MetodoPago, SesionCaja, Venta
+from app.services.inventory import ajustar_stock, fijar_stock, StockInsuficiente, VarianteInexistente
+from app.services.stock_totals import check_stock_totals
+
+
+def test_descuenta_y_ajusta_stock_total(db, catalogo, stock_de):
+    s, m = catalogo['P1-S'], catalogo['P1-M']
+    niveles = ajustar_stock([(s, -2), (m, -1), (s, -1)])
+    db.session.commit()
+
+    assert niveles == {s: 2, m: 4}
+    assert stock_de(s) == 2 and stock_de(m) == 4
+    assert db.session.get(Producto, 1).stock_total == 6
+    assert check_stock_totals() == []
+
+
+def test_update_condicional_no_deja_stock_negativo(db, catalogo, stock_de):
+    s, m = catalogo['P1-S'], catalogo['P1-M']
+    with pytest.raises(StockInsuficiente) as error:
+        ajustar_stock([(s, -1), (m, -6)])
+    db.session.rollback()
+
+    assert error.value.faltantes == [{"id_variante": m, "disponible": 5, "pedido": 6}]
+    # Todo o nada: la variante que alcanzaba tampoco se descontó
+    assert stock_de(s) == 5 and stock_de(m) == 5
+
+
+def test_permitir_negativo_registra_la_sobreventa(db, catalogo, stock_de):
+    s = catalogo['P1-S']
+    assert ajustar_stock([(s, -7)], permitir_negativo=True, sincronizar=False) == {s: -2}
+    db.session.commit()
+    assert stock_de(s) == -2
+
+
+def test_ingreso_crea_la_fila_de_inventario_faltante(db, catalogo, stock_de):
+    s = catalogo['P1-S']
+    db.session.delete(db.session.get(Inventario, s))
+    db.session.commit()
+
+    assert ajustar_stock([(s, 3)]) == {s: 3}
+    db.session.commit()
+    assert stock_de(s) == 3
+    assert check_stock_totals() == []
+
+
+def test_variante_sin_inventario_se_vende_sin_control(db, catalogo, stock_de):
+    s, m = catalogo['P1-S'], catalogo['P1-M']
+    db.session.delete(db.session.get(Inventario, s))
+    db.session.commit()
+
+    assert ajustar_stock([(s, -2), (m, -1)]) == {m: 4}
+    db.session.commit()
+    assert stock_de(s) is None
+    # Sin crear_inventario tampoco se le crea fila con un ingreso (anulaciones)
+    assert ajustar_stock([(s, 2)], crear_inventario=False) == {}
+    assert stock_de(s) is None
+
+
+def test_variante_inexistente(db, catalogo, stock_de):
+    with pytest.raises(VarianteInexistente) as error:
+        ajustar_stock([(catalogo['P1-S'], -1), (999, -1)])
+    assert error.value.ids == [999]
+    db.session.rollback()
+    assert stock_de(catalogo['P1-S']) == 5
+
+
+def test_bloquea_las_filas_en_orden_de_id(db, catalogo):
+    ids = sorted(catalogo.values())
+    orden = {'inventario': [], 'productos': []}
+
+    def registrar(conn, clauseelement, multiparams, params, execution_options):
+        if isinstance(clauseelement, Update) and clauseelement.table.name in orden:
+            parametros = clauseelement.compile().params
+            orden[clauseelement.table.name] += [v for k, v in parametros.items() if k.startswith('id_')]
+
+    engine = db.engine
+    event.listen(engine, 'before_execute', registrar)
+    try:
+        # Movimientos desordenados: los UPDATE (inventario y productos) salen ordenados por id
+        ajustar_stock([(ids[3], -1), (ids[0], 1), (ids[2], -1), (ids[1], 1)])
+    finally:
+        event.remove(engine, 'before_execute', registrar)
+    db.session.rollback()
+
+    assert orden['inventario'] == ids
+    assert orden['productos'] == [1, 2]
+
+
+def test_encola_sync_en_la_transaccion(db, catalogo):
+    s = catalogo['P1-S']
+    ajustar_stock([(s, -1)])
+    db.session.rollback()
+    assert SyncQueue.query.count() == 0
+
+    ajustar_stock([(s, -1)])
+    db.session.commit()
+    tarea = SyncQueue.query.one()
+    assert (tarea.tn_variant_id, tarea.id_variante, tarea.new_stock) == ('tn-P1-S', s, 4)
+
+
+def test_fijar_stock(db, catalogo, stock_de):
+    s, m, otra = catalogo['P1-S'], catalogo['P1-M'], catalogo['P2-S']
+    db.session.delete(db.session.get(Inventario, otra))
+    db.session.commit()
+
+    niveles = fijar_stock({s: 9, m: 5, otra: 2})
+    db.session.commit()
+
+    assert niveles == {s: 9, m: 5, otra: 2}
+    assert (stock_de(s), stock_de(m), stock_de(otra)) == (9, 5, 2)
+    assert check_stock_totals() == []
+    # Se informa (y sincroniza) también la que no cambió
+    assert sorted(t.id_variante for t in SyncQueue.query.all()) == sorted([s, m, otra])
+
+
+def test_fijar_stock_puede_dejar_negativo(db, catalogo, stock_de):
+    s = catalogo['P1-S']
+    assert fijar_stock({s: -1}, sincronizar=False) == {s: -1}
+    db.session.commit()
+    assert stock_de(s) == -1
+
+
+# --- Endpoints ---
+@pytest.fixture
+def caja(db):
+    db.session.add(MetodoPago(nombre='Efectivo'))
+    db.session.add(SesionCaja(estado='abierta', tipo_caja='PRINCIPAL', monto_inicial=0))
+    db.session.commit()
+
+
+def _checkout(client, auth_headers, *items):
+    return client.post('/api/sales/checkout', headers=auth_headers, json={
+        'items': [{'id_variante': v, 'cantidad': c, 'precio': 10, 'subtotal': 10 * c} for v, c in items],
+        'total_final': 0, 'metodo_pago_id': 1,
+    })
+
+
+def test_checkout_sin_stock_no_registra_nada(db, client, auth_headers, catalogo, caja, stock_de):
+    s, m = catalogo['P1-S'], catalogo['P1-M']
+    r = _checkout(client, auth_headers, (s, 1), (m, 6))
+    assert r.status_code == 400
+    assert 'Camiseta 0 (M)' in r.get_json()['msg']
+    assert Venta.query.count() == 0
+    assert stock_de(s) == 5
+
+
+def test_checkout_de_variante_sin_inventario(db, client, auth_headers, catalogo, caja, stock_de):
+    s = catalogo['P1-S']
+    db.session.delete(db.session.get(Inventario, s))
+    db.session.commit()
+
+    r = _checkout(client, auth_headers, (s, 3))
+    assert r.status_code == 201
+    assert stock_de(s) is None
+
+    # Al anularla tampoco se le inventa stock
+    assert client.delete(f"/api/sales/{r.get_json()['id']}/anular", headers=auth_headers).status_code == 200
+    assert stock_de(s) is None
+
+
+def test_anular_saltea_variantes_borradas(db, client, auth_headers, catalogo, caja, stock_de):
+    s, m = catalogo['P1-S'], catalogo['P1-M']
+    r = _checkout(client, auth_headers, (s, 2), (m, 1))
+    assert r.status_code == 201
+
+    db.session.delete(db.session.get(Inventario, m))
+    db.session.delete(db.session.get(ProductoVariante, m))
+    db.session.commit()
+
+    r = client.delete(f"/api/sales/{r.get_json()['id']}/anular", headers=auth_headers)
+    assert r.status_code == 200
+    assert stock_de(s) == 5
+    assert Venta.query.count() == 0
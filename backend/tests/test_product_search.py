@@ -0,0 +1,94 @@
+# backend/tests/test_product_search.py
+import time
+
+import pytest
+from sqlalchemy import update
+
+from app.products import routes as product_routes
+from app.products.models import Producto, ProductoVariante
+from app.services import product_search
+from app.services.catalog_version import bump_version
+from app.services.product_search import ProductSearchIndex, buscar_productos
+
+
+@pytest.fixture(autouse=True)
+def indice(monkeypatch):
+    """Un índice nuevo por test (el del módulo es uno por worker y sobreviviría entre tests)."""
+    indice = ProductSearchIndex()
+    monkeypatch.setattr(product_search, 'search_index', indice)
+    monkeypatch.setattr(product_search, 'CHECK_INTERVAL', 0)
+    return indice
+
+
+@pytest.fixture
+def camion(db, catalogo):
+    producto = Producto(nombre='Camión Ñandú', precio=500, activo=True)
+    db.session.add(producto)
+    db.session.flush()
+    db.session.add(ProductoVariante(id_producto=producto.id_producto, talla='U', codigo_sku='CAM-U'))
+    db.session.commit()
+    return producto.id_producto
+
+
+def _esperar_reconstruccion(indice):
+    for _ in range(100):
+        if not indice._reconstruyendo:
+            return
+        time.sleep(0.05)
+    pytest.fail("La reconstrucción en segundo plano no terminó")
+
+
+def test_busca_sin_acentos_y_con_and_entre_terminos(camion):
+    assert buscar_productos('camion') == {camion}
+    assert buscar_productos('CAMIÓN nandu') == {camion}
+    assert buscar_productos('camion remera') == set()
+
+
+def test_los_cambios_de_este_worker_se_reindexan_sin_reconstruir(db, camion, indice):
+    assert buscar_productos('camion') == {camion}
+    anterior = indice._indice
+
+    db.session.get(Producto, camion).nombre = 'Colectivo'
+    db.session.commit()
+
+    assert buscar_productos('colectivo') == {camion}
+    assert buscar_productos('camion') == set()
+    # Se publicó un índice nuevo; el anterior (el que puede estar leyendo otra búsqueda) quedó intacto
+    assert indice._indice is not anterior
+    assert 'camion' in anterior.docs[camion]
+
+
+def test_los_cambios_de_otro_worker_se_ven_por_la_version_del_catalogo(db, camion, indice):
+    assert buscar_productos('camion') == {camion}
+
+    # Otro worker renombra con SQL directo: este solo se entera por la versión del catálogo
+    with db.engine.begin() as conexion:
+        conexion.execute(update(Producto.__table__).where(Producto.__table__.c.id_producto == camion)
+                         .values(nombre='Colectivo'))
+    bump_version('catalogo')
+
+    buscar_productos('camion') # Detecta la versión nueva y reconstruye en segundo plano
+    _esperar_reconstruccion(indice)
+    assert buscar_productos('colectivo') == {camion}
+    assert buscar_productos('camion') == set()
+
+
+def test_sobre_el_limite_devuelve_none(camion, catalogo):
+    assert buscar_productos('camiseta', limite=1) is None
+    assert len(buscar_productos('camiseta')) == 2
+
+
+def test_el_filtro_sql_tambien_ignora_acentos(client, auth_headers, camion, monkeypatch):
+    # Forzamos el camino de "demasiados resultados": filtra en SQL
+    monkeypatch.setattr(product_routes, 'buscar_productos', lambda search: None)
+
+    res = client.get('/api/products?search=CAMION+nandu', headers=auth_headers)
+    assert res.status_code == 200
+    assert [p["id"] for p in res.get_json()["products"]] == [camion]
+
+    res = client.get('/api/products?search=camión', headers=auth_headers)
+    assert [p["id"] for p in res.get_json()["products"]] == [camion]
+
+    # Los comodines de LIKE se buscan literalmente, como en el índice
+    res = client.get('/api/products?search=c%25n', headers=auth_headers)
+    assert res.get_json()["products"] == []
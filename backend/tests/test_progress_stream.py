@@ -0,0 +1,67 @@
+# backend/tests/test_progress_stream.py
+import json
+import time
+
+from app.products import routes as product_routes
+from app.services.progress import ProgressReporter
+
+
+def _token(client, auth_headers, job='full_sync'):
+    res = client.post('/api/products/sync/progress/stream-token', json={"job": job}, headers=auth_headers)
+    assert res.status_code == 200
+    return res.get_json()["token"]
+
+
+def _eventos(res):
+    return [json.loads(linea[len('data: '):]) for linea in res.get_data(as_text=True).splitlines()
+            if linea.startswith('data: ')]
+
+
+def test_el_stream_no_acepta_el_jwt_en_la_url(client, auth_headers):
+    jwt = auth_headers['Authorization'].split()[1]
+    assert client.get('/api/products/sync/progress/stream?job=full_sync').status_code == 401
+    assert client.get(f'/api/products/sync/progress/stream?job=full_sync&jwt={jwt}').status_code == 401
+    assert client.get(f'/api/products/sync/progress/stream?job=full_sync&token={jwt}').status_code == 401
+
+
+def test_el_token_de_stream_requiere_login(client):
+    assert client.post('/api/products/sync/progress/stream-token', json={"job": "full_sync"}).status_code == 401
+
+
+def test_stream_con_token(client, auth_headers):
+    token = _token(client, auth_headers)
+    res = client.get(f'/api/products/sync/progress/stream?job=full_sync&token={token}')
+    assert res.status_code == 200
+    assert res.mimetype == 'text/event-stream'
+    eventos = _eventos(res)
+    # Sin proceso corriendo: manda el estado una vez y cierra
+    assert len(eventos) == 1 and eventos[0]["is_running"] is False
+
+
+def test_el_token_sirve_solo_para_su_proceso(client, auth_headers):
+    token = _token(client, auth_headers, job='margen')
+    assert client.get(f'/api/products/sync/progress/stream?job=full_sync&token={token}').status_code == 401
+    assert client.get(f'/api/products/sync/progress/stream?job=margen&token={token}').status_code == 200
+
+
+def test_el_token_vence(client, auth_headers, monkeypatch):
+    token = _token(client, auth_headers)
+    monkeypatch.setattr(product_routes, 'SSE_TOKEN_MAX_AGE', -1)
+    assert client.get(f'/api/products/sync/progress/stream?job=full_sync&token={token}').status_code == 401
+
+
+def test_con_el_cupo_lleno_contesta_el_estado_y_cierra(app, client, auth_headers):
+    token = _token(client, auth_headers)
+    assert ProgressReporter(app, 'full_sync').claim("Sincronizando...")
+    for _ in range(product_routes.SSE_MAX_STREAMS):
+        assert product_routes._sse_streams.acquire(blocking=False)
+    try:
+        inicio = time.monotonic()
+        res = client.get(f'/api/products/sync/progress/stream?job=full_sync&token={token}')
+        eventos = _eventos(res)
+        # Aunque el proceso sigue corriendo, no se queda esperando cambios (no retiene el hilo)
+        assert len(eventos) == 1 and eventos[0]["is_running"] is True
+        assert time.monotonic() - inicio < 1
+    finally:
+        for _ in range(product_routes.SSE_MAX_STREAMS):
+            product_routes._sse_streams.release()
@@ -0,0 +1,58 @@
+# backend/tests/test_sales_rank.py
+from datetime import timedelta
+
+import pytest
+
+from app.products.models import RankingVenta
+from app.sales.models import Venta, DetalleVenta
+from app.services import sales_rank
+from app.services.sales_rank import rebuild_sales_rank, ahora_argentina
+
+
+def _vender(db, id_variante, cantidad, fecha):
+    venta = Venta(total=10 * cantidad, subtotal=10 * cantidad, fecha_venta=fecha)
+    venta.detalles.append(DetalleVenta(id_variante=id_variante, cantidad=cantidad, precio_unitario=10,
+                                       subtotal=10 * cantidad))
+    db.session.add(venta)
+    db.session.commit()
+
+
+def _ranking(db, id_producto):
+    db.session.expire_all()
+    fila = db.session.get(RankingVenta, id_producto)
+    return (fila.unidades_total, fila.unidades_30d, fila.unidades_90d)
+
+
+@pytest.mark.parametrize('reconstruir', [False, True])
+def test_las_ventanas_usan_la_hora_de_argentina(db, catalogo, reconstruir):
+    # fecha_venta está en hora de Argentina: una venta de hace 30 días menos una hora sigue
+    # adentro de la ventana aunque el servidor corra en UTC (3 horas adelante)
+    _vender(db, catalogo['P1-S'], 2, ahora_argentina() - timedelta(days=30) + timedelta(hours=1))
+    _vender(db, catalogo['P1-M'], 3, ahora_argentina() - timedelta(days=30, hours=1))
+    _vender(db, catalogo['P1-M'], 1, ahora_argentina() - timedelta(days=100))
+    if reconstruir:
+        rebuild_sales_rank()
+    assert _ranking(db, 1) == (6, 2, 5)
+
+
+def test_la_reconstruccion_saca_las_ventas_viejas_de_la_ventana(db, catalogo, monkeypatch):
+    _vender(db, catalogo['P2-S'], 4, ahora_argentina() - timedelta(days=29))
+    assert _ranking(db, 2) == (4, 4, 4)
+
+    # Dos días después la venta ya salió de los 30 días: solo lo ve la reconstrucción
+    dentro_de_dos_dias = ahora_argentina() + timedelta(days=2)
+    monkeypatch.setattr(sales_rank, 'ahora_argentina', lambda: dentro_de_dos_dias)
+    assert _ranking(db, 2) == (4, 4, 4)
+    rebuild_sales_rank()
+    assert _ranking(db, 2) == (4, 0, 4)
+
+
+def test_el_comando_sales_rank_rebuild(app, db, catalogo):
+    _vender(db, catalogo['P1-S'], 1, ahora_argentina())
+    db.session.execute(RankingVenta.__table__.delete())
+    db.session.commit()
+
+    resultado = app.test_cli_runner().invoke(args=['sales-rank-rebuild'])
+    assert resultado.exit_code == 0, resultado.output
+    assert _ranking(db, 1) == (1, 1, 1)
+
@@ -0,0 +1,163 @@
+# backend/tests/test_stock_sync_queue.py
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.products.models import ProductoVariante, Inventario, SyncQueue
+from app.services import stock_sync_queue
+from app.services.stock_sync_queue import enqueue_stock_sync, process_sync_queue, COALESCE_WINDOW, BACKOFF_BASE_SECONDS
+
+
+@pytest.fixture
+def pushes(monkeypatch):
+    """Reemplaza el PUT a Tienda Nube: registra cada llamada y responde lo que diga `resultado`."""
+    llamadas = []
+
+    class Push:
+        resultado = True
+
+        def __call__(self, tn_product_id, tn_variant_id, stock, max_retries=None):
+            llamadas.append((tn_product_id, tn_variant_id, stock))
+            if isinstance(self.resultado, Exception):
+                raise self.resultado
+            return self.resultado
+
+    push = Push()
+    push.llamadas = llamadas
+    monkeypatch.setattr(stock_sync_queue.tn_service, 'update_variant_stock', push)
+    return push
+
+
+def _vencer_tareas(db):
+    SyncQueue.query.update({"next_attempt_at": datetime.utcnow() - timedelta(seconds=1)})
+    db.session.commit()
+
+
+def test_encola_en_la_transaccion_del_llamador(db, catalogo):
+    variante = db.session.get(ProductoVariante, catalogo['P1-S'])
+    variante.inventario.stock_actual = 3
+    enqueue_stock_sync(variante)
+    db.session.rollback()
+    assert SyncQueue.query.count() == 0
+
+    variante = db.session.get(ProductoVariante, catalogo['P1-S'])
+    variante.inventario.stock_actual = 3
+    antes = datetime.utcnow()
+    enqueue_stock_sync(variante)
+    db.session.commit()
+
+    tarea = SyncQueue.query.one()
+    assert (tarea.status, tarea.tn_product_id, tarea.tn_variant_id, tarea.new_stock) == ('pending', '900', 'tn-P1-S', 3)
+    assert tarea.next_attempt_at >= antes + COALESCE_WINDOW
+
+
+def test_no_envia_antes_de_la_ventana(db, catalogo, pushes):
+    enqueue_stock_sync(db.session.get(ProductoVariante, catalogo['P1-S']))
+    db.session.commit()
+    assert process_sync_queue() == (0, 0)
+    assert pushes.llamadas == []
+
+
+def test_push_exitoso_completa_y_registra_lo_sincronizado(db, catalogo, pushes):
+    enqueue_stock_sync(db.session.get(ProductoVariante, catalogo['P1-S']))
+    db.session.commit()
+    _vencer_tareas(db)
+
+    assert process_sync_queue() == (1, 1)
+    assert pushes.llamadas == [('900', 'tn-P1-S', 5)]
+    tarea = SyncQueue.query.one()
+    assert (tarea.status, tarea.retries, tarea.last_error) == ('completed', 0, None)
+    variante = db.session.get(ProductoVariante, catalogo['P1-S'])
+    assert variante.tn_stock_sincronizado == 5
+    assert variante.tn_sincronizado_at is not None
+
+
+@pytest.mark.parametrize('resultado', [False, RuntimeError('timeout')])
+def test_push_fallido_reprograma_con_backoff(db, catalogo, pushes, resultado):
+    pushes.resultado = resultado
+    enqueue_stock_sync(db.session.get(ProductoVariante, catalogo['P1-S']))
+    db.session.commit()
+    _vencer_tareas(db)
+
+    antes = datetime.utcnow()
+    assert process_sync_queue() == (1, 0)
+    tarea = SyncQueue.query.one()
+    assert (tarea.status, tarea.retries) == ('pending', 1)
+    assert tarea.last_error
+    assert tarea.next_attempt_at >= antes + timedelta(seconds=BACKOFF_BASE_SECONDS)
+    assert db.session.get(ProductoVariante, catalogo['P1-S']).tn_stock_sincronizado is None
+
+    # En backoff no se reintenta todavía
+    assert process_sync_queue() == (0, 0)
+    assert len(pushes.llamadas) == 1
+
+
+def test_agota_los_reintentos(db, catalogo, pushes):
+    pushes.resultado = False
+    enqueue_stock_sync(db.session.get(ProductoVariante, catalogo['P1-S']))
+    db.session.commit()
+    SyncQueue.query.update({"retries": stock_sync_queue.MAX_RETRIES - 1})
+    _vencer_tareas(db)
+
+    process_sync_queue()
+    assert SyncQueue.query.one().status == 'failed'
+
+
+# --- Colapso por variante ---
+def _encolar_ventas(db, id_variante, *stocks):
+    """Una tarea por 'venta', cada una con el stock que dejó."""
+    ids = []
+    for stock in stocks:
+        variante = db.session.get(ProductoVariante, id_variante)
+        variante.inventario.stock_actual = stock
+        ids.append(enqueue_stock_sync(variante))
+        db.session.commit()
+    return [t.id for t in ids]
+
+
+def test_varias_tareas_de_una_variante_son_un_solo_put_con_el_ultimo_stock(db, catalogo, pushes):
+    ids = _encolar_ventas(db, catalogo['P1-S'], 4, 3, 2)
+    otra = _encolar_ventas(db, catalogo['P1-M'], 1)
+    # Solo la primera está vencida: las hermanas de la misma variante se reclaman igual
+    SyncQueue.query.filter(SyncQueue.id.in_([ids[0]] + otra)).update(
+        {"next_attempt_at": datetime.utcnow() - timedelta(seconds=1)}, synchronize_session=False
+    )
+    db.session.commit()
+
+    assert process_sync_queue() == (2, 2)
+    assert sorted(pushes.llamadas) == [('900', 'tn-P1-M', 1), ('900', 'tn-P1-S', 2)]
+    assert {t.status for t in SyncQueue.query.all()} == {'completed'}
+
+
+def test_el_put_lleva_el_stock_vigente_no_el_encolado(db, catalogo, pushes):
+    _encolar_ventas(db, catalogo['P1-S'], 4)
+    db.session.get(Inventario, catalogo['P1-S']).stock_actual = 1 # Cambio posterior sin tarea propia
+    db.session.commit()
+    _vencer_tareas(db)
+
+    process_sync_queue()
+    assert pushes.llamadas == [('900', 'tn-P1-S', 1)]
+
+
+def test_put_fallido_cierra_las_hermanas_y_reintenta_la_mas_nueva(db, catalogo, pushes):
+    pushes.resultado = False
+    ids = _encolar_ventas(db, catalogo['P1-S'], 4, 3, 2)
+    SyncQueue.query.filter_by(id=ids[0]).update({"retries": 2})
+    _vencer_tareas(db)
+
+    assert process_sync_queue() == (1, 0)
+    assert len(pushes.llamadas) == 1
+    tareas = {t.id: t for t in SyncQueue.query.all()}
+    for id_hermana in ids[:2]:
+        assert tareas[id_hermana].status == 'completed'
+        assert tareas[id_hermana].last_error == f"Colapsada en la tarea #{ids[2]}"
+    principal = tareas[ids[2]]
+    # Hereda el mayor número de intentos del grupo
+    assert (principal.status, principal.retries) == ('pending', 3)
+
+    # En el reintento exitoso viaja solo la principal
+    pushes.resultado = True
+    _vencer_tareas(db)
+    assert process_sync_queue() == (1, 1)
+    assert pushes.llamadas[-1] == ('900', 'tn-P1-S', 2)
+    assert SyncQueue.query.filter_by(status='pending').count() == 0
@@ -0,0 +1,130 @@
+# backend/tests/test_webhooks.py
+import hashlib
+import hmac
+import importlib.util
+import json
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+from app.products.models import Categoria
+from app.sales.models import TnWebhookInbox, Venta, OrdenTiendaNube
+from app.sales.webhooks import process_cloud_order, reclamar_orden, OrdenDuplicada
+from app.services import webhook_inbox
+
+
+@pytest.fixture
+def sin_api_tn(monkeypatch):
+    """El webhook no debe hablar con Tienda Nube: eso lo hace el webhook-worker."""
+    def prohibido(*args, **kwargs):
+        raise AssertionError("El webhook llamó a la API de Tienda Nube")
+    monkeypatch.setattr(webhook_inbox.tn_service, 'get_order_details', prohibido)
+
+
+def _firmar(cuerpo, secreto):
+    return hmac.new(secreto.encode('utf-8'), cuerpo, hashlib.sha256).hexdigest()
+
+
+def test_el_webhook_solo_deja_la_orden_en_la_bandeja(client, db, sin_api_tn):
+    res = client.post('/api/webhooks/tiendanube/orders', data=json.dumps({"id": 555, "event": "order/created"}),
+                      content_type='application/json')
+    assert res.status_code == 200
+    fila = TnWebhookInbox.query.one()
+    assert (fila.tn_order_id, fila.event, fila.status) == ('555', 'order/created', 'pending')
+
+
+def test_la_ruta_vieja_ya_no_existe(client):
+    assert client.post('/api/webhooks/tn/orders', json={"id": 1}).status_code == 404
+
+
+def test_firma_hmac(client, db, monkeypatch, sin_api_tn):
+    monkeypatch.setenv('TIENDANUBE_CLIENT_SECRET', 'secreto')
+    cuerpo = json.dumps({"id": 556, "event": "order/paid"}).encode()
+
+    res = client.post('/api/webhooks/tiendanube/orders', data=cuerpo, content_type='application/json',
+                      headers={'X-LinkedStore-HMAC-SHA256': 'firma-falsa'})
+    assert res.status_code == 401
+    assert TnWebhookInbox.query.count() == 0
+
+    res = client.post('/api/webhooks/tiendanube/orders', data=cuerpo, content_type='application/json',
+                      headers={'X-LinkedStore-HMAC-SHA256': _firmar(cuerpo, 'secreto')})
+    assert res.status_code == 200
+    assert TnWebhookInbox.query.one().tn_order_id == '556'
+
+
+# --- Duplicados (tn_ordenes) ---
+def _orden(order_id=777, cantidad=2):
+    return {"id": order_id, "created_at": "2026-10-17T15:00:00+0000",
+            "products": [{"variant_id": "tn-P1-S", "sku": "P1-S", "quantity": cantidad, "price": "10.00",
+                          "name": "Camiseta 0"}]}
+
+
+def test_entregas_duplicadas_registran_una_sola_venta(app, db, catalogo, stock_de, monkeypatch):
+    monkeypatch.setattr(webhook_inbox.tn_service, 'get_order_details', lambda order_id, fields=None: _orden())
+    # order/created y order/paid de la misma orden (o un reenvío de TN)
+    webhook_inbox.registrar_notificacion(json.dumps({"id": 777, "event": "order/created"}))
+    webhook_inbox.registrar_notificacion(json.dumps({"id": 777, "event": "order/paid"}))
+
+    assert webhook_inbox.process_inbox(app, workers=1) == (2, 2)
+    db.session.expire_all()
+    assert Venta.query.count() == 1
+    assert OrdenTiendaNube.query.one().id_venta == Venta.query.one().id_venta
+    assert stock_de(catalogo['P1-S']) == 3 # Descontado una sola vez
+    assert [f.status for f in TnWebhookInbox.query.order_by(TnWebhookInbox.id)] == ['done', 'done']
+
+
+def test_process_cloud_order_rechaza_la_segunda_entrega(db, catalogo, stock_de):
+    process_cloud_order(_orden())
+    with pytest.raises(OrdenDuplicada):
+        process_cloud_order(_orden())
+    db.session.rollback()
+    assert Venta.query.count() == 1
+    assert stock_de(catalogo['P1-S']) == 3
+
+
+def test_reclamar_duplicada_no_deshace_la_transaccion_del_llamador(db, catalogo):
+    reclamar_orden(778)
+    db.session.commit()
+
+    db.session.add(Categoria(nombre='Pendiente del llamador'))
+    db.session.flush()
+    with pytest.raises(OrdenDuplicada):
+        reclamar_orden(778)
+    # Solo se deshizo el INSERT de la orden (SAVEPOINT): lo demás se confirma normalmente
+    db.session.commit()
+    assert Categoria.query.filter_by(nombre='Pendiente del llamador').count() == 1
+    assert OrdenTiendaNube.query.filter_by(tn_order_id='778').count() == 1
+
+
+# --- Backfill de la migración fb5d150069c0 ---
+def _cargar_migracion(nombre):
+    ruta = Path(__file__).resolve().parents[1] / 'migrations' / 'versions' / nombre
+    spec = importlib.util.spec_from_file_location(ruta.stem, ruta)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def test_la_migracion_completa_tn_ordenes_desde_observaciones(db):
+    migracion = _cargar_migracion('fb5d150069c0_tn_ordenes.py')
+    OrdenTiendaNube.__table__.drop(db.engine) # La tabla la crea la migración
+
+    for observaciones in ("Orden Tienda Nube #1001", "Venta de mostrador", "Orden Tienda Nube #1002 (con envío)",
+                          "Orden Tienda Nube #1001", None):
+        db.session.add(Venta(total=10, subtotal=10, observaciones=observaciones,
+                             fecha_venta=datetime(2026, 10, 1, 12, 0)))
+    db.session.commit()
+    ids = [v.id_venta for v in Venta.query.order_by(Venta.id_venta)]
+
+    with db.engine.begin() as conexion:
+        with Operations.context(MigrationContext.configure(conexion)):
+            migracion.upgrade()
+
+    filas = {o.tn_order_id: o for o in OrdenTiendaNube.query.all()}
+    assert set(filas) == {'1001', '1002'}
+    assert filas['1001'].id_venta == ids[0] # Con duplicados históricos queda la primera venta
+    assert filas['1002'].id_venta == ids[2]
+    assert filas['1001'].created_at == datetime(2026, 10, 1, 12, 0)
@@ -0,0 +1,23 @@
+import { useRef, useCallback } from 'react';
+
+// Paginación por cursor del listado de productos (/products?cursor=...).
+// Guarda el cursor con el que se pide cada página: ir a la siguiente (o volver
+// a una ya vista) no usa OFFSET, así que la página 200 cuesta lo mismo que la 1.
+// La página 1 siempre arranca de cero y es la única que pide el total.
+export const useCursorPages = () => {
+    const cursors = useRef({});
+
+    const paramsFor = useCallback((page) => {
+        if (page === 1) return { cursor: '', with_total: 'true' };
+        const cursor = cursors.current[page];
+        // Página a la que no llegamos navegando: paginación clásica
+        return cursor !== undefined ? { cursor, page } : { page };
+    }, []);
+
+    const remember = useCallback((page, meta) => {
+        if (page === 1) cursors.current = {};
+        if (meta?.next_cursor) cursors.current[page + 1] = meta.next_cursor;
+    }, []);
+
+    return { paramsFor, remember };
+};
@@ -0,0 +1,54 @@
+import { useEffect, useRef, useState, useCallback } from 'react';
+import { api } from '../context/AuthContext';
+
+// Escucha el progreso de un proceso largo del backend ('full_sync' o 'margen') por
+// Server-Sent Events. Mientras el proceso corre el servidor empuja cada cambio; si no
+// hay nada corriendo manda el estado, cierra, y el navegador se reconecta solo.
+// Devuelve reconnect() para abrir el stream al instante (ej: recién iniciado un proceso).
+export const useProgressStream = (job, token, onData) => {
+    const handlerRef = useRef(onData);
+    handlerRef.current = onData;
+    const [nonce, setNonce] = useState(0);
+
+    useEffect(() => {
+        if (!token) return;
+
+        // EventSource no permite headers: se abre con un token de stream de corta duración
+        // (nunca el JWT en la URL). Cuando vence, el servidor contesta 401, el EventSource
+        // queda cerrado y se pide uno nuevo.
+        let source = null;
+        let timer = null;
+        let activo = true;
+
+        const abrir = async () => {
+            try {
+                const res = await api.post('/products/sync/progress/stream-token', { job });
+                if (!activo) return;
+                const url = `${api.defaults.baseURL}/products/sync/progress/stream?job=${job}&token=${encodeURIComponent(res.data.token)}`;
+                source = new EventSource(url);
+
+                source.onmessage = (e) => {
+                    try {
+                        handlerRef.current(JSON.parse(e.data));
+                    } catch (err) { }
+                };
+                source.onerror = () => {
+                    if (source.readyState === EventSource.CLOSED) {
+                        timer = setTimeout(abrir, 1000);
+                    }
+                };
+            } catch (err) {
+                if (activo) timer = setTimeout(abrir, 5000);
+            }
+        };
+        abrir();
+
+        return () => {
+            activo = false;
+            clearTimeout(timer);
+            if (source) source.close();
+        };
+    }, [job, token, nonce]);
+
+    return useCallback(() => setNonce(n => n + 1), []);
+};
@@ -1,5 +1,7 @@
 import { useEffect, useState, useRef } from 'react';
 import { useAuth, api } from '../context/AuthContext';
+import { useProgressStream } from '../hooks/useProgressStream';
+import { useCursorPages } from '../hooks/useCursorPages';
 import {
     Package, Search, Edit, ChevronLeft, ChevronRight,
     Shirt, Filter, X, Cloud, UploadCloud, Loader2,
@@ -175,6 +177,7 @@ const InventoryPage = () => {
     const [page, setPage] = useState(1);
     const [totalPages, setTotalPages] = useState(1);
     const [totalItems, setTotalItems] = useState(0);
+    const { paramsFor, remember } = useCursorPages();
     const [searchTerm, setSearchTerm] = useState('');
     const [selectedCat, setSelectedCat] = useState('');
     const [selectedSpec, setSelectedSpec] = useState('');
@@ -249,7 +252,7 @@ const InventoryPage = () => {
             const targetPage = isSearching ? 1 : currentPage;
 
             const params = {
-                page: targetPage, limit: limit, search: searchTerm,
+                ...paramsFor(targetPage), limit: limit, search: searchTerm,
                 category_id: selectedCat || undefined, specific_id: selectedSpec || undefined,
                 active: viewMode === 'active' ? 'true' : 'false',
                 min_stock: hideOutOfStock ? 1 : undefined,
@@ -262,9 +265,12 @@ const InventoryPage = () => {
             setProducts(res.data.products);
 
             if (res.data.meta) {
-                setTotalPages(res.data.meta.total_pages);
-                setPage(res.data.meta.current_page);
-                setTotalItems(res.data.meta.total_items);
+                remember(targetPage, res.data.meta);
+                if (res.data.meta.total_pages !== undefined) {
+                    setTotalPages(res.data.meta.total_pages);
+                    setTotalItems(res.data.meta.total_items);
+                }
+                setPage(targetPage);
             }
             if (!silent) setSelectedItems(new Set());
         } catch (error) {
@@ -296,64 +302,46 @@ const InventoryPage = () => {
         // eslint-disable-next-line react-hooks/exhaustive-deps
     }, [selectedCat, selectedSpec, viewMode, hideOutOfStock, filterSize, filterNoImage, sortBy]);
 
-    // EFECTO POLLING MEJORADO PARA SYNC DE STOCK
-    useEffect(() => {
-        const checkActiveSync = async () => {
-            try {
-                const res = await api.get('/products/sync/status');
-                setSyncProgress(prev => {
-                    if (prev && prev.is_running && !res.data.is_running) {
-                        playSound('success');
-                        toast.success("Sincronización Completada", { duration: 4000 });
-                        setTimeout(() => setSyncProgress(null), 8000);
-                        return res.data;
-                    }
-                    if (res.data.is_running || (prev && prev.is_running)) {
-                        setIsSyncing(true);
-                        return res.data;
-                    }
-                    setIsSyncing(false);
-                    return null;
-                });
-            } catch (e) { }
-        };
-
-        checkActiveSync();
-        const interval = setInterval(checkActiveSync, 3000);
-        return () => clearInterval(interval);
-    }, [token]);
+    // PROGRESO DE SYNC DE STOCK (Server-Sent Events, reemplaza el polling cada 3s)
+    const reconnectSyncStream = useProgressStream('full_sync', token, (data) => {
+        setSyncProgress(prev => {
+            if (prev && prev.is_running && !data.is_running) {
+                setIsSyncing(false);
+                playSound('success');
+                toast.success("Sincronización Completada", { duration: 4000 });
+                setTimeout(() => setSyncProgress(null), 8000);
+                return data;
+            }
+            if (data.is_running || (prev && prev.is_running)) {
+                setIsSyncing(true);
+                return data;
+            }
+            setIsSyncing(false);
+            return null;
+        });
+    });
 
-    // EFECTO POLLING MEJORADO PARA MÁRGENES/PRECIOS CON DETECCIÓN DE ERRORES
-    useEffect(() => {
-        const checkMarginStatus = async () => {
-            try {
-                const res = await api.get('/products/tiendanube/margen/status');
-
-                setMarginProgress(prev => {
-                    if (prev && prev.is_running && !res.data.is_running) {
-                        if (res.data.errores > 0) {
-                            playSound('error');
-                            toast.error(res.data.message || `Atención: El proceso terminó, pero ${res.data.errores} precios no se pudieron subir.`, { duration: 8000 });
-                        } else {
-                            playSound('success');
-                            toast.success("¡Todos los precios fueron actualizados en Tienda Nube!", { duration: 6000 });
-                        }
-                        setTimeout(() => setMarginProgress(null), 8000);
-                        return res.data;
-                    }
-
-                    if (res.data.is_running || (prev && prev.is_running)) {
-                        return res.data;
-                    }
-                    return null;
-                });
-            } catch (e) { }
-        };
+    // PROGRESO DE MÁRGENES/PRECIOS CON DETECCIÓN DE ERRORES (Server-Sent Events)
+    useProgressStream('margen', token, (data) => {
+        setMarginProgress(prev => {
+            if (prev && prev.is_running && !data.is_running) {
+                if (data.errores > 0) {
+                    playSound('error');
+                    toast.error(data.message || `Atención: El proceso terminó, pero ${data.errores} precios no se pudieron subir.`, { duration: 8000 });
+                } else {
+                    playSound('success');
+                    toast.success("¡Todos los precios fueron actualizados en Tienda Nube!", { duration: 6000 });
+                }
+                setTimeout(() => setMarginProgress(null), 8000);
+                return data;
+            }
 
-        checkMarginStatus();
-        const interval = setInterval(checkMarginStatus, 4000);
-        return () => clearInterval(interval);
-    }, [token]);
+            if (data.is_running || (prev && prev.is_running)) {
+                return data;
+            }
+            return null;
+        });
+    });
 
     const handleCancelMargin = async () => {
         setIsCancelingMargin(true);
@@ -377,6 +365,7 @@ const InventoryPage = () => {
         try {
             await api.post('/products/sync/force-tiendanube');
             toast.success("Sincronización Iniciada");
+            reconnectSyncStream();
         } catch (error) {
             toast.error("Error al iniciar sync");
             setIsSyncing(false);
@@ -316,7 +316,8 @@ const POSPage = () => {
     }
     const delaySearch = setTimeout(async () => {
       try {
-        const params = { limit: 100, sort_by: 'mas_vendidos' };
+        // Solo lo que muestra el desplegable (sin descripción ni datos de la web)
+        const params = { limit: 100, sort_by: 'mas_vendidos', fields: 'id,nombre,precio,imagen,categoria,variantes' };
         if (manualTerm.trim()) params.search = manualTerm;
         if (selectedCat) params.category_id = selectedCat;
         if (selectedSpec) params.specific_id = selectedSpec;
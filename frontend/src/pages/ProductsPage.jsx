@@ -8,6 +8,7 @@ import {
 } from 'lucide-react';
 import { useAuth, api } from '../context/AuthContext';
 import toast, { Toaster } from 'react-hot-toast';
+import { useCursorPages } from '../hooks/useCursorPages';
 
 // --- DEFINICIÓN DE CURVAS DE TALLES ---
 const SIZE_GRIDS = {
@@ -35,6 +36,7 @@ const ProductsPage = () => {
     // --- FILTROS Y PAGINACIÓN ---
     const [page, setPage] = useState(1);
     const [totalPages, setTotalPages] = useState(1);
+    const { paramsFor, remember } = useCursorPages();
     const [searchTerm, setSearchTerm] = useState('');
     const [selectedCat, setSelectedCat] = useState('');
     const [selectedSpec, setSelectedSpec] = useState('');
@@ -79,7 +81,7 @@ const ProductsPage = () => {
         setLoading(true);
         try {
             const params = {
-                page: currentPage,
+                ...paramsFor(currentPage),
                 limit: 15,
                 search: searchTerm,
                 active: viewMode === 'active' ? 'true' : 'false',
@@ -90,8 +92,9 @@ const ProductsPage = () => {
 
             const res = await api.get('/products', { params });
             setProducts(res.data.products);
-            setTotalPages(res.data.meta.total_pages);
-            setPage(res.data.meta.current_page);
+            remember(currentPage, res.data.meta);
+            if (res.data.meta.total_pages !== undefined) setTotalPages(res.data.meta.total_pages);
+            setPage(currentPage);
             setSelectedItems(new Set());
         } catch (error) {
             console.error(error);